@@ -32,6 +32,7 @@ setup(
             "google-cloud-datastore>=2.19.0",
         ],
         "azure": ["azure-cosmosdb-table>=1.0.6", "bson>=0.5.10"],
+        "async": ["httpx>=0.27.0"],
     },
     # PyPI metadata
     author="SumoLogic",
@@ -1,25 +1,36 @@
 import gzip
 import json
+import math
 import os
+import queue
+import threading
 from io import BytesIO
 import time
-from requests.auth import HTTPDigestAuth
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from sumoappclient.sumoclient.base import BaseAPI
-from sumoappclient.sumoclient.factory import OutputHandlerFactory
 from sumoappclient.common.utils import (
     get_current_timestamp,
     convert_epoch_to_utc_date,
     convert_utc_date_to_epoch,
     convert_date_to_epoch,
 )
-from sumoappclient.sumoclient.httputils import ClientMixin
 from time_and_memory_tracker import TimeAndMemoryTracker
+from outputhandlers import OutputHandlerFactory
+from metric_rollups import MetricRollup, granularity_to_seconds
+from event_dedup import RecentIdCache
+from rate_limiter import get_atlas_rate_limiter
+from session_pool import get_atlas_session_pool
+from background_sender import StateWriteRecorder
+from endpoint_balancer import get_single_url_config
 
 
 class MongoDBAPI(BaseAPI):
     MOVING_WINDOW_DELTA = 0.001
     isoformat = "%Y-%m-%dT%H:%M:%S.%fZ"
     date_format = "%Y-%m-%dT%H:%M:%SZ"
+    # set by the collector, tasks created outside of it use their own output handler
+    output_handler_pool = None
 
     def __init__(self, kvstore, config):
         super(MongoDBAPI, self).__init__(kvstore, config)
@@ -30,7 +41,11 @@ class MongoDBAPI(BaseAPI):
         self.MIN_REQUEST_WINDOW_LENGTH = self.api_config.get("Collection", {}).get(
             "MIN_REQUEST_WINDOW_LENGTH", 60
         )
-        self.digestauth = HTTPDigestAuth(
+        self.rate_limiter = get_atlas_rate_limiter(self.config)
+        # sessions and digest auth are shared by all the tasks for connection and nonce reuse
+        self.session_pool = get_atlas_session_pool(self.config)
+        self.digestauth = self.session_pool.get_auth(
+            self.api_config.get("BASE_URL"),
             username=self.api_config["PUBLIC_API_KEY"],
             password=self.api_config["PRIVATE_API_KEY"],
         )
@@ -38,6 +53,46 @@ class MongoDBAPI(BaseAPI):
             "ACTIVATE_TIME_AND_MEMORY_TRACKER", False
         ) or os.environ.get("ACTIVATE_TIME_AND_MEMORY_TRACKER", False)
 
+    def get_atlas_session(self, url=None):
+        # pooled session, it is shared with the other tasks so it must not be closed
+        return self.session_pool.get_session(url or self.api_config.get("BASE_URL"))
+
+    def get_output_handler(self):
+        if self.output_handler_pool is not None:
+            return self.output_handler_pool.get_handler(path=self.pathname)
+        return OutputHandlerFactory.get_handler(
+            self.collection_config["OUTPUT_HANDLER"],
+            path=self.pathname,
+            config=get_single_url_config(self.config),
+        )
+
+    def save_state_after_send(self, output_handler, *args, **kwargs):
+        """
+        With the background sender the state is built now and saved once the payloads sent before it are
+        acknowledged, otherwise it is saved right away.
+        """
+        if getattr(output_handler, "defers_checkpoints", False) is not True:
+            return self.save_state(*args, **kwargs)
+        kvstore, recorder = self.kvstore, StateWriteRecorder(self.kvstore)
+        self.kvstore = recorder
+        try:
+            self.save_state(*args, **kwargs)
+        finally:
+            self.kvstore = kvstore
+        output_handler.defer_checkpoint(recorder.replay)
+
+    def make_atlas_request(self, url, kwargs, session=None):
+        # every Atlas api call goes through the shared rate limiter
+        return self.rate_limiter.make_request(
+            url,
+            session=session or self.get_atlas_session(url),
+            logger=self.log,
+            TIMEOUT=self.collection_config["TIMEOUT"],
+            MAX_RETRY=self.collection_config["MAX_RETRY"],
+            BACKOFF_FACTOR=self.collection_config["BACKOFF_FACTOR"],
+            **kwargs,
+        )
+
     def get_window(self, last_time_epoch):
         start_time_epoch = last_time_epoch + self.MOVING_WINDOW_DELTA
         end_time_epoch = (get_current_timestamp() - self.collection_config["END_TIME_EPOCH_OFFSET_SECONDS"])
@@ -62,69 +117,210 @@ class MongoDBAPI(BaseAPI):
 
 
 class FetchMixin(MongoDBAPI):
+    def make_fetch_request(self, url, kwargs):
+        return self.make_atlas_request(url, kwargs)
+
+    def split_fetch_request(self, url, kwargs):
+        # kwargs of the requests which together make up the response of a fetch, used by the async fetch engine
+        return [kwargs]
+
+    def merge_fetch_responses(self, request_kwargs, responses):
+        return responses[0]
+
     def fetch(self):
         log_type = self.get_key()
         with TimeAndMemoryTracker(activate=self.collection_config.get("ACTIVATE_TIME_AND_MEMORY_TRACKING", False)) as tracker:
-            output_handler = OutputHandlerFactory.get_handler(
-                self.collection_config["OUTPUT_HANDLER"],
-                path=self.pathname,
-                config=self.config,
-            )
+            output_handler = self.get_output_handler()
             start_message = tracker.start("self.build_fetch_params")
             url, kwargs = self.build_fetch_params()
             end_message = tracker.end("self.build_fetch_params")
             self.log.info(f'''Fetching LogType: {log_type} kwargs: {kwargs} url: {url} {start_message} {end_message}''')
-            state = None
-            payload = []
             try:
                 start_message = tracker.start("ClientMixin.make_request")
-                fetch_success, content = ClientMixin.make_request(
-                    url,
-                    method="get",
-                    logger=self.log,
-                    TIMEOUT=self.collection_config["TIMEOUT"],
-                    MAX_RETRY=self.collection_config["MAX_RETRY"],
-                    BACKOFF_FACTOR=self.collection_config["BACKOFF_FACTOR"],
-                    **kwargs,
-                )
+                fetch_success, content = self.make_fetch_request(url, kwargs)
                 end_message = tracker.end("ClientMixin.make_request")
                 self.log.debug(f'''Fetched LogType: {log_type} kwargs: {kwargs} url: {url} {start_message} {end_message}''')
-                if fetch_success and len(content) > 0:
-                    payload, state = self.transform_data(content)
-                    # Todo Make this atomic if after sending -> Ctrl - C happens then it fails to save state
-                    params = self.build_send_params()
-                    start_message = tracker.start("OutputHandler.send")
-                    send_success = output_handler.send(payload, **params)
-                    end_message = tracker.end("OutputHandler.send")
-                    if send_success:
-                        self.save_state(**state)
-                        self.log.info(f"""Successfully sent LogType: {self.get_key()} Data: {len(content)} kwargs: {kwargs} url: {url} {start_message} {end_message}""")
-                    else:
-                        self.log.error(f"""Failed to send LogType: {self.get_key()} Data: {len(content)} kwargs: {kwargs} url: {url} {start_message} {end_message}""")
-                elif fetch_success and len(content) == 0:
-                    self.log.info(
-                        f"""No results window LogType: {log_type} status: {fetch_success} kwargs: {kwargs} url: {url}"""
-                    )
-                    is_move_fetch_window, new_state = self.check_move_fetch_window(kwargs)
-                    if is_move_fetch_window:
-                        self.save_state(**new_state)
-                        self.log.debug(f"""Moving fetched window newstate: {new_state}""")
-                else:
-                    self.log.error(
-                        f"""Error LogType: {log_type} status: {fetch_success} reason: {content} kwargs: {kwargs} url: {url}"""
-                    )
+                self.handle_fetch_response(url, kwargs, fetch_success, content, output_handler, tracker)
             finally:
                 output_handler.close()
+
+    def handle_fetch_response(self, url, kwargs, fetch_success, content, output_handler, tracker):
+        log_type = self.get_key()
+        state = None
+        payload = []
+        try:
+            if fetch_success and len(content) > 0:
+                payload, state = self.transform_data(content)
+            if fetch_success and len(payload) > 0:
+                # Todo Make this atomic if after sending -> Ctrl - C happens then it fails to save state
+                params = self.build_send_params()
+                start_message = tracker.start("OutputHandler.send")
+                send_success = output_handler.send(payload, **params)
+                end_message = tracker.end("OutputHandler.send")
+                if send_success:
+                    self.save_state_after_send(output_handler, **state)
+                    self.log.info(f"""Successfully sent LogType: {self.get_key()} Data: {len(content)} kwargs: {kwargs} url: {url} {start_message} {end_message}""")
+                else:
+                    self.log.error(f"""Failed to send LogType: {self.get_key()} Data: {len(content)} kwargs: {kwargs} url: {url} {start_message} {end_message}""")
+            elif fetch_success:
+                # either no results or every datapoint got filtered out ex null values or incomplete rollup buckets
                 self.log.info(
-                    f"""Completed LogType: {log_type} curstate: {state} datasent: {len(payload)}"""
+                    f"""No results window LogType: {log_type} status: {fetch_success} kwargs: {kwargs} url: {url}"""
                 )
+                is_move_fetch_window, new_state = self.check_move_fetch_window(kwargs)
+                if is_move_fetch_window:
+                    self.save_state_after_send(output_handler, **new_state)
+                    self.log.debug(f"""Moving fetched window newstate: {new_state}""")
+            else:
+                self.log.error(
+                    f"""Error LogType: {log_type} status: {fetch_success} reason: {content} kwargs: {kwargs} url: {url}"""
+                )
+        finally:
+            self.log.info(
+                f"""Completed LogType: {log_type} curstate: {state} datasent: {len(payload)}"""
+            )
 
 
 class PaginatedFetchMixin(MongoDBAPI):
+    def __init__(self, kvstore, config):
+        super(PaginatedFetchMixin, self).__init__(kvstore, config)
+        self.sent_event_ids = self.load_sent_event_ids({})
+
+    def load_sent_event_ids(self, state):
+        return RecentIdCache(self.collection_config.get("EVENT_DEDUP_CACHE_SIZE", 2000), state.get("sent_event_ids", []))
+
+    def get_event_type_filters(self):
+        filters = (self.api_config.get("EVENT_TYPE_FILTERS") or {}).get(self.log_type) or {}
+        exclude = set(filters.get("EXCLUDE") or [])
+        include = [event_type for event_type in filters.get("INCLUDE") or [] if event_type not in exclude]
+        return include, exclude
+
+    def get_event_type_params(self):
+        # included event types are filtered by the api, requests encodes the list as repeated eventType parameters
+        include, _ = self.get_event_type_filters()
+        return {"eventType": include} if include else {}
+
+    def filter_event_types(self, events):
+        _, exclude = self.get_event_type_filters()
+        if not exclude:
+            return events
+        return [event for event in events if event.get("eventTypeName") not in exclude]
+
+    def filter_sent_events(self, events):
+        # skips events sent in previous pages or runs and the duplicates within the same page
+        page_event_ids = set()
+        for event in events:
+            event_id = event.get("id")
+            if event_id is not None:
+                if event_id in self.sent_event_ids or event_id in page_event_ids:
+                    continue
+                page_event_ids.add(event_id)
+            yield event
+
+    def on_send_success(self, payload):
+        self.sent_event_ids.add_all(event["id"] for event in payload if "id" in event)
+
+    def fetch_page(self, sess, url, kwargs):
+        return self.make_atlas_request(url, kwargs, session=sess)
+
+    def iter_pages(self, sess, url, kwargs):
+        """
+        Yields (status, data) for consecutive pages starting from kwargs["params"]["pageNum"].
+        The caller increments pageNum only after a page is sent, so in sequential mode each page is
+        requested lazily with the current kwargs. With PAGE_FANOUT_WORKERS > 0 the remaining pages of
+        the window are fetched concurrently and with PAGE_PREFETCH_DEPTH > 0 a producer thread fetches
+        ahead into a bounded queue, in both cases pages are yielded in page order.
+        """
+        fanout_workers = int(self.collection_config.get("PAGE_FANOUT_WORKERS", 0) or 0)
+        prefetch_depth = int(self.collection_config.get("PAGE_PREFETCH_DEPTH", 0) or 0)
+        if fanout_workers > 0:
+            yield from self._fan_out_pages(sess, url, kwargs, fanout_workers)
+        elif prefetch_depth > 0:
+            yield from self._prefetch_pages(sess, url, kwargs, prefetch_depth)
+        else:
+            yield from self._iter_sequential_pages(sess, url, kwargs)
+
+    def _iter_sequential_pages(self, sess, url, kwargs):
+        while True:
+            yield self.fetch_page(sess, url, kwargs)
+
+    def _fan_out_pages(self, sess, url, kwargs, max_workers):
+        """
+        Fetches the first page, derives the page count of the window from totalCount and fetches the
+        remaining pages concurrently. At most 2 * max_workers pages are in flight or buffered, the workers share
+        the pooled session. When the consumer stops, the pages still in flight are left to finish on their own
+        and their results are discarded.
+        """
+        first_page = kwargs["params"]["pageNum"]
+        status, data = self.fetch_page(sess, url, kwargs)
+        yield status, data
+        if not (status and isinstance(data, dict) and data.get("results") and "totalCount" in data):
+            yield from self._iter_sequential_pages(sess, url, kwargs)
+            return
+
+        last_page = int(math.ceil(data["totalCount"] / float(kwargs["params"]["itemsPerPage"])))
+
+        def fetch_page_num(page_num):
+            page_kwargs = dict(kwargs, params=dict(kwargs["params"], pageNum=page_num))
+            return self.fetch_page(sess, url, page_kwargs)
+
+        self.log.debug(f"""Fanning out LogType: {self.get_key()} Pages: {first_page + 1}-{last_page} totalCount: {data['totalCount']}""")
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = deque()
+        next_page = first_page + 1
+        try:
+            while futures or next_page <= last_page:
+                while next_page <= last_page and len(futures) < 2 * max_workers:
+                    futures.append(executor.submit(fetch_page_num, next_page))
+                    next_page += 1
+                yield futures.popleft().result()
+            # events created in the window while paging shift the results, so the window ends only on an empty page
+            yield from self._iter_sequential_pages(sess, url, kwargs)
+        finally:
+            # waiting for the requests in flight could overrun the invocation by up to a request timeout
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _prefetch_pages(self, sess, url, kwargs, prefetch_depth):
+        pages = queue.Queue(maxsize=prefetch_depth)
+        stop_event = threading.Event()
+        page_kwargs = dict(kwargs, params=dict(kwargs["params"]))
+
+        def prefetch():
+            is_last_page = False
+            while not (is_last_page or stop_event.is_set()):
+                try:
+                    status, data = self.fetch_page(sess, url, page_kwargs)
+                except Exception as e:
+                    status, data = False, f"Prefetch failed for Page: {page_kwargs['params']['pageNum']} Reason: {e}"
+                # empty or failed page ends the pagination, the consumer decides how to checkpoint it
+                is_last_page = not (status and "results" in data and len(data["results"]) > 0)
+                page_kwargs["params"] = dict(page_kwargs["params"], pageNum=page_kwargs["params"]["pageNum"] + 1)
+                while not stop_event.is_set():
+                    try:
+                        pages.put((status, data), timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+
+        producer = threading.Thread(target=prefetch, name=f"prefetch-{self.get_key()}", daemon=True)
+        producer.start()
+        try:
+            while True:
+                yield pages.get()
+        finally:
+            stop_event.set()
+            # the producer is not joined since it may be inside an http call, it is a daemon thread which exits
+            # on its own once the call returns. The pages fetched ahead are discarded so that a put does not block it.
+            while True:
+                try:
+                    pages.get_nowait()
+                except queue.Empty:
+                    break
+
     def fetch(self):
         current_state = self.get_state()
         with TimeAndMemoryTracker(activate=self.collection_config.get("ACTIVATE_TIME_AND_MEMORY_TRACKING", False)) as tracker:
-            output_handler = OutputHandlerFactory.get_handler(self.collection_config["OUTPUT_HANDLER"], path=self.pathname, config=self.config)
+            output_handler = self.get_output_handler()
             start_message = tracker.start("self.build_fetch_params")
             url, kwargs = self.build_fetch_params()
             end_message = tracker.end("self.build_fetch_params")
@@ -132,21 +328,14 @@ class PaginatedFetchMixin(MongoDBAPI):
             self.log.info(f'''Fetching LogType: {log_type} kwargs: {kwargs} url: {url} {start_message} {end_message} ''')
             next_request = True
             count = 0
-            sess = ClientMixin.get_new_session()
+            sess = self.get_atlas_session()
+            pages = None
             try:
+                pages = self.iter_pages(sess, url, kwargs)
                 while next_request:
                     send_success = has_next_page = False
                     start_message = tracker.start("ClientMixin.make_request")
-                    status, data = ClientMixin.make_request(
-                        url,
-                        method="get",
-                        session=sess,
-                        logger=self.log,
-                        TIMEOUT=self.collection_config["TIMEOUT"],
-                        MAX_RETRY=self.collection_config["MAX_RETRY"],
-                        BACKOFF_FACTOR=self.collection_config["BACKOFF_FACTOR"],
-                        **kwargs,
-                    )
+                    status, data = next(pages)
                     end_message = tracker.end("ClientMixin.make_request")
                     fetch_success = status and "results" in data
                     if (count < 4) or (count % 5 == 0):
@@ -160,6 +349,7 @@ class PaginatedFetchMixin(MongoDBAPI):
                             send_success = output_handler.send(payload, **params)
                             end_message = tracker.end("OutputHandler.send")
                             if send_success:
+                                self.on_send_success(payload)
                                 count += 1
                                 if (count < 4) or (count % 5 == 0):
                                     self.log.info(
@@ -170,7 +360,8 @@ class PaginatedFetchMixin(MongoDBAPI):
                                 current_state.update(updated_state)
                                 # time not available save current state new page num else continue
                                 if not self.is_time_remaining():
-                                    self.save_state(
+                                    self.save_state_after_send(
+                                        output_handler,
                                         {
                                             "start_time_epoch": convert_utc_date_to_epoch(
                                                 kwargs["params"]["minDate"]
@@ -189,7 +380,8 @@ class PaginatedFetchMixin(MongoDBAPI):
                                 self.log.error(
                                     f"""Failed to send LogType: {log_type} Page: {kwargs['params']['pageNum']} starttime: {kwargs['params']['minDate']} endtime: {kwargs['params']['maxDate']} {start_message} {end_message}"""
                                 )
-                                self.save_state(
+                                self.save_state_after_send(
+                                    output_handler,
                                     {
                                         "start_time_epoch": convert_utc_date_to_epoch(
                                             kwargs["params"]["minDate"]
@@ -208,7 +400,8 @@ class PaginatedFetchMixin(MongoDBAPI):
                                 self.log.debug(
                                     f"""Moving starttime window LogType: {log_type} Page: {kwargs['params']['pageNum']} starttime: {kwargs['params']['minDate']} endtime: {kwargs['params']['maxDate']} to last_time_epoch": {convert_epoch_to_utc_date(current_state['last_time_epoch'], date_format=self.isoformat)}"""
                                 )
-                                self.save_state(
+                                self.save_state_after_send(
+                                    output_handler,
                                     {
                                         "page_num": 0,
                                         "last_time_epoch": current_state["last_time_epoch"],
@@ -227,7 +420,8 @@ class PaginatedFetchMixin(MongoDBAPI):
                                     self.log.debug(
                                         f"""Moving starttime window LogType: {log_type} Page: {kwargs['params']['pageNum']} starttime: {kwargs['params']['minDate']} endtime: {kwargs['params']['maxDate']} to last_time_epoch": {convert_epoch_to_utc_date(current_state['last_time_epoch'], date_format=self.isoformat)}"""
                                     )
-                                    self.save_state(
+                                    self.save_state_after_send(
+                                        output_handler,
                                         {
                                             "page_num": 0,
                                             "last_time_epoch": current_state[
@@ -237,7 +431,8 @@ class PaginatedFetchMixin(MongoDBAPI):
                                     )
 
                     else:
-                        self.save_state(
+                        self.save_state_after_send(
+                            output_handler,
                             {
                                 "start_time_epoch": convert_utc_date_to_epoch(
                                     kwargs["params"]["minDate"]
@@ -254,7 +449,10 @@ class PaginatedFetchMixin(MongoDBAPI):
                         )
                     next_request = (fetch_success and send_success and has_next_page and self.is_time_remaining())
             finally:
-                sess.close()
+                if pages is not None:
+                    # stops the prefetching thread before the task completes
+                    pages.close()
+                output_handler.close()
                 self.log.info(
                     f"""Completed LogType: {log_type} Count: {count} Page: {kwargs['params']['pageNum']} starttime: {kwargs['params']['minDate']} endtime: {kwargs['params']['maxDate']}"""
                 )
@@ -268,6 +466,7 @@ class LogAPI(FetchMixin):
         super(LogAPI, self).__init__(kvstore, config)
         self.hostname = hostname
         self.filename = filename
+        self.log_type = "DATABASE" if "audit" not in self.filename else "AUDIT"
         self.pathname = (
             "db_logs.json" if "audit" not in self.filename else "db_auditlogs.json"
         )
@@ -282,10 +481,13 @@ class LogAPI(FetchMixin):
         obj = {"last_time_epoch": last_time_epoch}
         self.kvstore.set(key, obj)
 
+    def init_state(self):
+        self.save_state(self.DEFAULT_START_TIME_EPOCH)
+
     def get_state(self):
         key = self.get_key()
         if not self.kvstore.has_key(key):
-            self.save_state(self.DEFAULT_START_TIME_EPOCH)
+            self.init_state()
         obj = self.kvstore.get(key)
         return obj
 
@@ -387,35 +589,186 @@ class LogAPI(FetchMixin):
         return all_logs, {"last_time_epoch": last_time_epoch}
 
 
-class ProcessMetricsAPI(FetchMixin):
-    pathname = "process_metrics.log"
-
-    def __init__(self, kvstore, process_id, config, cluster_mapping):
-        super(ProcessMetricsAPI, self).__init__(kvstore, config)
-        self.process_id = process_id
+# Descriptor table for the Atlas measurement apis, supporting a new family only requires an entry here.
+# resources: identifiers of the measured resource in the order they appear in the state key
+# dimensions: (carbon2 tag, response field, whether the cluster name is replaced by its alias)
+# cluster_name_field: dimension tag from which the cluster_name tag is derived
+MEASUREMENT_FAMILIES = {
+    # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Monitoring-and-Logs/operation/getHostMeasurements
+    "PROCESS_METRICS": {
+        "path": "processes/{process_id}/measurements",
+        "resources": ("process_id",),
+        "key_suffix": "processmetrics",
+        "pathname": "process_metrics.log",
+        "dimensions": (
+            ("projectId", "groupId", False),
+            ("hostId", "hostId", True),
+            ("processId", "processId", True),
+        ),
+        "cluster_name_field": "hostId",
+    },
+    # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Monitoring-and-Logs/operation/getDiskMeasurements
+    "DISK_METRICS": {
+        "path": "processes/{process_id}/disks/{disk_name}/measurements",
+        "resources": ("process_id", "disk_name"),
+        "key_suffix": "diskmetrics",
+        "pathname": "disk_metrics.log",
+        "dimensions": (
+            ("projectId", "groupId", False),
+            ("partitionName", "partitionName", False),
+            ("hostId", "hostId", True),
+            ("processId", "processId", True),
+        ),
+        "cluster_name_field": "hostId",
+    },
+    # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Monitoring-and-Logs/operation/getDatabaseMeasurements
+    "DATABASE_METRICS": {
+        "path": "processes/{process_id}/databases/{database_name}/measurements",
+        "resources": ("process_id", "database_name"),
+        "key_suffix": "dbmetrics",
+        "pathname": "database_metrics.log",
+        "dimensions": (
+            ("projectId", "groupId", False),
+            ("databaseName", "databaseName", False),
+            ("hostId", "hostId", False),
+            ("processId", "processId", True),
+        ),
+        "cluster_name_field": "processId",
+    },
+}
+
+
+class MeasurementsAPI(FetchMixin):
+    # Generic task for the measurement apis, the family specific parts come from MEASUREMENT_FAMILIES
+
+    def __init__(self, kvstore, config, cluster_mapping, metric_family, **resource_ids):
+        super(MeasurementsAPI, self).__init__(kvstore, config)
+        self.metric_family = metric_family
+        self.log_type = metric_family
+        self.descriptor = MEASUREMENT_FAMILIES[metric_family]
+        self.pathname = self.descriptor["pathname"]
+        self.resource_ids = resource_ids
         self.cluster_mapping = cluster_mapping
+        self.granularity_coverage = {}
+        self.series_watermarks = {}
+        self.last_time_epoch = None
+        self.failed_metric_groups = []
+        self.window_end_epoch = None
+        self.pending_rollup_start = None
 
     def get_key(self):
-        key = f"""{self.api_config['PROJECT_ID']}-{self.process_id}-processmetrics"""
+        resource_ids = "-".join(self.resource_ids[resource] for resource in self.descriptor["resources"])
+        key = f"""{self.api_config['PROJECT_ID']}-{resource_ids}-{self.descriptor['key_suffix']}"""
         return key
 
-    def save_state(self, last_time_epoch):
+    def save_state(self, last_time_epoch, granularity=None, series_watermarks=None):
         key = self.get_key()
-        obj = {"last_time_epoch": last_time_epoch}
+        obj = self._build_measurement_state(last_time_epoch, granularity, series_watermarks)
         self.kvstore.set(key, obj)
 
+    def init_state(self):
+        self.save_state(self.DEFAULT_START_TIME_EPOCH)
+
     def get_state(self):
         key = self.get_key()
         if not self.kvstore.has_key(key):
-            self.save_state(self.DEFAULT_START_TIME_EPOCH)
+            self.init_state()
         obj = self.kvstore.get(key)
+        self.last_time_epoch = obj["last_time_epoch"]
+        self.granularity_coverage = dict(obj.get("granularity_coverage", {}))
+        self.series_watermarks = dict(obj.get("series_watermarks", {}))
         return obj
 
-    # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Monitoring-and-Logs/operation/getHostMeasurements
+    def get_metric_granularity(self, metric_family):
+        # Atlas aggregates the datapoints when a coarser granularity than PT1M is requested
+        granularity_config = self.api_config.get("METRIC_GRANULARITY") or {}
+        return granularity_config.get(metric_family) or "PT1M"
+
+    def get_metric_rollup(self, metric_family, granularity=None):
+        rollup_config = (self.api_config.get("METRIC_ROLLUPS") or {}).get(metric_family)
+        if not rollup_config:
+            return None
+        granularity = granularity or self.get_metric_granularity(metric_family)
+        if granularity_to_seconds(granularity) >= int(rollup_config["BUCKET_MINUTES"]) * 60:
+            # datapoints are already as coarse as the bucket ex during backfill
+            return None
+        return MetricRollup(rollup_config["BUCKET_MINUTES"], rollup_config.get("AGGREGATIONS"), granularity)
+
+    def get_backfill_tiers(self):
+        tiers = self.collection_config.get("MEASUREMENT_BACKFILL_TIERS") or []
+        return sorted(tiers, key=lambda tier: tier["LAG_SECONDS"], reverse=True)
+
+    def is_measurement_dedup_enabled(self):
+        return self.collection_config.get("MEASUREMENT_DEDUP", True)
+
+    def get_measurement_window_overlap(self):
+        # overlapping windows are only safe when already sent datapoints are dropped using the series watermarks
+        if not self.is_measurement_dedup_enabled():
+            return 0
+        return self.collection_config.get("MEASUREMENT_WINDOW_OVERLAP_SECONDS", 0)
+
+    def get_measurement_window(self, last_time_epoch, metric_family):
+        # older history is fetched with a coarser granularity in larger windows, the family granularity is used near real time
+        last_time_epoch -= self.get_measurement_window_overlap()
+        granularity = self.get_metric_granularity(metric_family)
+        start_time_epoch = last_time_epoch + self.MOVING_WINDOW_DELTA
+        current_end_epoch = get_current_timestamp() - self.collection_config["END_TIME_EPOCH_OFFSET_SECONDS"]
+        for tier in self.get_backfill_tiers():
+            tier_granularity = max(tier["GRANULARITY"], granularity, key=granularity_to_seconds)
+            end_time_epoch = min(
+                start_time_epoch + tier["MAX_REQUEST_WINDOW_LENGTH"],
+                current_end_epoch - tier["LAG_SECONDS"],
+            )
+            if end_time_epoch - start_time_epoch > max(self.MIN_REQUEST_WINDOW_LENGTH, granularity_to_seconds(tier_granularity)):
+                return start_time_epoch, end_time_epoch, tier_granularity
+
+        start_time_epoch, end_time_epoch = self.get_window(last_time_epoch)
+        return start_time_epoch, end_time_epoch, granularity
+
+    def _build_measurement_state(self, last_time_epoch, granularity=None, series_watermarks=None):
+        # granularity_coverage tracks till which timestamp each granularity has been collected
+        if granularity:
+            self.granularity_coverage[granularity] = last_time_epoch
+        if series_watermarks is not None:
+            # watermarks older than the next window start can no longer match any datapoint
+            min_timestamp = last_time_epoch - self.get_measurement_window_overlap()
+            self.series_watermarks = {
+                series: timestamp for series, timestamp in series_watermarks.items() if timestamp >= min_timestamp
+            }
+        state = {"last_time_epoch": last_time_epoch}
+        if self.granularity_coverage:
+            state["granularity_coverage"] = dict(self.granularity_coverage)
+        if self.series_watermarks:
+            state["series_watermarks"] = dict(self.series_watermarks)
+        return state
+
+    def _iter_datapoints(self, measurement, rollup=None, series_watermarks=None, complete_before=None):
+        # yields (rollup_tag, value, timestamp, last_timestamp) in a single pass over the measurement datapoints
+        # series_watermarks maps series -> last timestamp sent, datapoints at or before it are dropped and it is advanced in place
+        datapoints = (
+            (convert_utc_date_to_epoch(datapoint["timestamp"], date_format=self.date_format), datapoint["value"])
+            for datapoint in measurement["dataPoints"]
+            if datapoint["value"] is not None
+        )
+        if rollup is None:
+            rows = (("", measurement["name"], value, current_timestamp, current_timestamp) for current_timestamp, value in datapoints)
+        else:
+            rows = (
+                (f" rollup={aggregation}", f"{measurement['name']}:{aggregation}", value, bucket_timestamp, last_timestamp)
+                for aggregation, value, bucket_timestamp, last_timestamp in rollup.rollup(datapoints, complete_before)
+            )
+        for rollup_tag, series, value, current_timestamp, last_timestamp in rows:
+            if series_watermarks is not None:
+                if current_timestamp <= series_watermarks.get(series, 0):
+                    continue
+                series_watermarks[series] = current_timestamp
+            yield rollup_tag, value, current_timestamp, last_timestamp
+
     def build_fetch_params(self):
-        start_time_epoch, end_time_epoch = self.get_window(
-            self.get_state()["last_time_epoch"]
+        start_time_epoch, end_time_epoch, granularity = self.get_measurement_window(
+            self.get_state()["last_time_epoch"], self.metric_family
         )
+        self.window_end_epoch = end_time_epoch
         start_time_date = convert_epoch_to_utc_date(
             start_time_epoch, date_format=self.isoformat
         )
@@ -423,113 +776,67 @@ class ProcessMetricsAPI(FetchMixin):
             end_time_epoch, date_format=self.isoformat
         )
         return (
-            f"""{self.api_config['BASE_URL']}/groups/{self.api_config['PROJECT_ID']}/processes/{self.process_id}/measurements""",
+            f"""{self.api_config['BASE_URL']}/groups/{self.api_config['PROJECT_ID']}/{self.descriptor['path'].format(**self.resource_ids)}""",
             {
                 "auth": self.digestauth,
                 "params": {
                     "itemsPerPage": self.api_config["PAGINATION_LIMIT"],
-                    "granularity": "PT1M",
+                    "granularity": granularity,
                     "start": start_time_date,
                     "end": end_time_date,
-                    "m": self.api_config["METRIC_TYPES"]["PROCESS_METRICS"],
+                    "m": self.api_config["METRIC_TYPES"][self.metric_family],
                 },
             },
         )
 
-    def build_send_params(self):
-        return {
-            "extra_headers": {"Content-Type": "application/vnd.sumologic.carbon2"},
-            "endpoint_key": "HTTP_METRICS_ENDPOINT",
-            "jsondump": False,
-        }
-
-    def check_move_fetch_window(self, kwargs):
-        # https://www.mongodb.com/docs/atlas/reference/api/process-measurements/
-        # Atlas retrieves database metrics every 20 minutes by default. Results include data points with 20 minute intervals.
-        data_availablity_max_endDate = get_current_timestamp() - 20 * 60
-        api_endDate = convert_utc_date_to_epoch(
-            kwargs["params"]["end"], date_format=self.isoformat
-        )
-        if api_endDate < data_availablity_max_endDate:
-            return True, {"last_time_epoch": api_endDate}
-        else:
-            return False, {}
-
-    def transform_data(self, data):
-        metrics = []
-        last_time_epoch = self.DEFAULT_START_TIME_EPOCH
-        for measurement in data["measurements"]:
-            for datapoints in measurement["dataPoints"]:
-                if datapoints["value"] is None:
-                    continue
-                current_timestamp = convert_utc_date_to_epoch(
-                    datapoints["timestamp"], date_format=self.date_format
-                )
-                host_id = self._replace_cluster_name(
-                    data["hostId"], self.cluster_mapping
-                )
-                process_id = self._replace_cluster_name(
-                    data["processId"], self.cluster_mapping
-                )
-                cluster_name = self._get_cluster_name(host_id)
-                metrics.append(
-                    f"""projectId={data['groupId']} hostId={host_id} processId={process_id} metric={measurement['name']}  units={measurement['units']} cluster_name={cluster_name} {datapoints['value']} {current_timestamp}"""
-                )
-                last_time_epoch = max(current_timestamp, last_time_epoch)
-        return metrics, {"last_time_epoch": last_time_epoch}
-
-
-class DiskMetricsAPI(FetchMixin):
-    isoformat = "%Y-%m-%dT%H:%M:%S.%fZ"
-    date_format = "%Y-%m-%dT%H:%M:%SZ"
-    pathname = "disk_metrics.log"
+    def get_metric_groups(self, metric_names):
+        metrics_per_request = self.collection_config.get("METRICS_PER_REQUEST", 0)
+        if not metrics_per_request or len(metric_names) <= metrics_per_request:
+            return [metric_names]
+        return [metric_names[idx:idx + metrics_per_request] for idx in range(0, len(metric_names), metrics_per_request)]
+
+    def split_fetch_request(self, url, kwargs):
+        # the metric list is partitioned into groups fetched concurrently for the same window and merged into one response
+        return [
+            dict(kwargs, params=dict(kwargs["params"], m=metric_names))
+            for metric_names in self.get_metric_groups(kwargs["params"]["m"])
+        ]
+
+    def merge_fetch_responses(self, request_kwargs, responses):
+        self.failed_metric_groups = []
+        if len(responses) == 1:
+            return responses[0]
+
+        merged_content = None
+        errors = []
+        for group_kwargs, (fetch_success, content) in zip(request_kwargs, responses):
+            metric_names = group_kwargs["params"]["m"]
+            if not fetch_success:
+                self.failed_metric_groups.append(metric_names)
+                errors.append(content)
+                self.log.error(f"""Failed to fetch LogType: {self.get_key()} metrics: {metric_names} reason: {content}""")
+            elif merged_content is None:
+                merged_content = content
+            else:
+                merged_content["measurements"].extend(content.get("measurements", []))
 
-    def __init__(self, kvstore, process_id, disk_name, config, cluster_mapping):
-        super(DiskMetricsAPI, self).__init__(kvstore, config)
-        self.process_id = process_id
-        self.disk_name = disk_name
-        self.cluster_mapping = cluster_mapping
+        if merged_content is None or (self.failed_metric_groups and not self.is_measurement_dedup_enabled()):
+            return False, errors
+        return True, merged_content
 
-    def get_key(self):
-        key = f"""{self.api_config['PROJECT_ID']}-{self.process_id}-{self.disk_name}-diskmetrics"""
-        return key
+    def make_fetch_request(self, url, kwargs):
+        request_kwargs = self.split_fetch_request(url, kwargs)
 
-    def save_state(self, last_time_epoch):
-        key = self.get_key()
-        obj = {"last_time_epoch": last_time_epoch}
-        self.kvstore.set(key, obj)
+        def fetch_metric_group(group_kwargs):
+            return super(MeasurementsAPI, self).make_fetch_request(url, group_kwargs)
 
-    def get_state(self):
-        key = self.get_key()
-        if not self.kvstore.has_key(key):
-            self.save_state(self.DEFAULT_START_TIME_EPOCH)
-        obj = self.kvstore.get(key)
-        return obj
-
-    # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Monitoring-and-Logs/operation/getDiskMeasurements
-    def build_fetch_params(self):
-        start_time_epoch, end_time_epoch = self.get_window(
-            self.get_state()["last_time_epoch"]
-        )
-        start_time_date = convert_epoch_to_utc_date(
-            start_time_epoch, date_format=self.isoformat
-        )
-        end_time_date = convert_epoch_to_utc_date(
-            end_time_epoch, date_format=self.isoformat
-        )
-        return (
-            f"""{self.api_config['BASE_URL']}/groups/{self.api_config['PROJECT_ID']}/processes/{self.process_id}/disks/{self.disk_name}/measurements""",
-            {
-                "auth": self.digestauth,
-                "params": {
-                    "itemsPerPage": self.api_config["PAGINATION_LIMIT"],
-                    "granularity": "PT1M",
-                    "start": start_time_date,
-                    "end": end_time_date,
-                    "m": self.api_config["METRIC_TYPES"]["DISK_METRICS"],
-                },
-            },
-        )
+        num_workers = min(self.collection_config.get("MEASUREMENT_FETCH_WORKERS", 4), len(request_kwargs))
+        if num_workers <= 1:
+            responses = [fetch_metric_group(group_kwargs) for group_kwargs in request_kwargs]
+        else:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                responses = list(executor.map(fetch_metric_group, request_kwargs))
+        return self.merge_fetch_responses(request_kwargs, responses)
 
     def build_send_params(self):
         return {
@@ -539,134 +846,99 @@ class DiskMetricsAPI(FetchMixin):
         }
 
     def check_move_fetch_window(self, kwargs):
-        # hhttps://www.mongodb.com/docs/atlas/reference/api/process-disks-measurements/
+        # https://www.mongodb.com/docs/atlas/reference/api/process-measurements/
         # Atlas retrieves database metrics every 20 minutes by default. Results include data points with 20 minute intervals.
         data_availablity_max_endDate = get_current_timestamp() - 20 * 60
         api_endDate = convert_utc_date_to_epoch(
             kwargs["params"]["end"], date_format=self.isoformat
         )
-        if api_endDate < data_availablity_max_endDate:
-            return True, {"last_time_epoch": api_endDate}
+        if api_endDate < data_availablity_max_endDate and not self.failed_metric_groups:
+            last_time_epoch = self._hold_back_for_pending_rollup(api_endDate)
+            if self.last_time_epoch is not None and last_time_epoch <= self.last_time_epoch:
+                return False, {}
+            return True, {"last_time_epoch": last_time_epoch, "granularity": kwargs["params"]["granularity"]}
         else:
             return False, {}
 
+    def _is_backfill_granularity(self, granularity):
+        if not granularity:
+            return False
+        return granularity_to_seconds(granularity) > granularity_to_seconds(self.get_metric_granularity(self.metric_family))
+
+    def _hold_back_for_pending_rollup(self, last_time_epoch):
+        # incomplete rollup buckets are re-read by the next window instead of being skipped
+        if self.pending_rollup_start is None:
+            return last_time_epoch
+        last_time_epoch = min(last_time_epoch, self.pending_rollup_start - self.MOVING_WINDOW_DELTA)
+        if self.last_time_epoch is not None:
+            last_time_epoch = max(last_time_epoch, self.last_time_epoch)
+        return last_time_epoch
+
     def transform_data(self, data):
         metrics = []
         last_time_epoch = self.DEFAULT_START_TIME_EPOCH
+        rollup = self.get_metric_rollup(self.metric_family, data.get("granularity"))
+        complete_before = None
+        if self.window_end_epoch is not None:
+            # Atlas may still add datapoints to the last 20 minutes
+            complete_before = min(self.window_end_epoch, get_current_timestamp() - 20 * 60)
+        series_watermarks = dict(self.series_watermarks) if self.is_measurement_dedup_enabled() else None
+        dimensions = {}
+        for tag, field, is_aliased in self.descriptor["dimensions"]:
+            dimensions[tag] = self._replace_cluster_name(data[field], self.cluster_mapping) if is_aliased else data[field]
+        cluster_name = self._get_cluster_name(dimensions[self.descriptor["cluster_name_field"]])
+        # tags common to the whole response are formatted once instead of per datapoint
+        prefix = " ".join(f"{tag}={value}" for tag, value in dimensions.items())
         for measurement in data["measurements"]:
-            for datapoints in measurement["dataPoints"]:
-                if datapoints["value"] is None:
-                    continue
-                current_timestamp = convert_utc_date_to_epoch(
-                    datapoints["timestamp"], date_format=self.date_format
-                )
-                host_id = self._replace_cluster_name(
-                    data["hostId"], self.cluster_mapping
-                )
-                process_id = self._replace_cluster_name(
-                    data["processId"], self.cluster_mapping
-                )
-                cluster_name = self._get_cluster_name(host_id)
-                metrics.append(
-                    f"""projectId={data['groupId']} partitionName={data['partitionName']} hostId={host_id} processId={process_id} metric={measurement['name']}  units={measurement['units']} cluster_name={cluster_name} {datapoints['value']} {current_timestamp}"""
-                )
-                last_time_epoch = max(current_timestamp, last_time_epoch)
-        return metrics, {"last_time_epoch": last_time_epoch}
-
+            suffix = f"""  units={measurement['units']} cluster_name={cluster_name}"""
+            for rollup_tag, value, current_timestamp, last_timestamp in self._iter_datapoints(measurement, rollup, series_watermarks, complete_before):
+                metrics.append(f"""{prefix} metric={measurement['name']}{rollup_tag}{suffix} {value} {current_timestamp}""")
+                last_time_epoch = max(last_timestamp, last_time_epoch)
+        self.pending_rollup_start = rollup.pending_bucket_start if rollup is not None else None
+        if metrics and self._is_backfill_granularity(data.get("granularity")):
+            # a backfill datapoint is stamped with the start of its bucket but covers the whole bucket, the next
+            # (finer) tier starts after it instead of sending the last bucket again at its own granularity
+            last_time_epoch += granularity_to_seconds(data["granularity"]) - self.MOVING_WINDOW_DELTA
+        if metrics:
+            last_time_epoch = self._hold_back_for_pending_rollup(last_time_epoch)
+        state = {"last_time_epoch": last_time_epoch, "granularity": data.get("granularity")}
+        if series_watermarks is not None:
+            state["series_watermarks"] = series_watermarks
+        if self.failed_metric_groups:
+            # groups fetched successfully are sent and remembered in the watermarks but the window is retried
+            state.update({"last_time_epoch": self.last_time_epoch, "granularity": None})
+        return metrics, state
+
+
+class ProcessMetricsAPI(MeasurementsAPI):
 
-class DatabaseMetricsAPI(FetchMixin):
-    isoformat = "%Y-%m-%dT%H:%M:%S.%fZ"
-    date_format = "%Y-%m-%dT%H:%M:%SZ"
-    pathname = "database_metrics.log"
-
-    def __init__(self, kvstore, process_id, database_name, config, cluster_mapping):
-        super(DatabaseMetricsAPI, self).__init__(kvstore, config)
+    def __init__(self, kvstore, process_id, config, cluster_mapping):
+        super(ProcessMetricsAPI, self).__init__(kvstore, config, cluster_mapping, "PROCESS_METRICS", process_id=process_id)
         self.process_id = process_id
-        self.database_name = database_name
-        self.cluster_mapping = cluster_mapping
 
-    def get_key(self):
-        key = f"""{self.api_config['PROJECT_ID']}-{self.process_id}-{self.database_name}-dbmetrics"""
-        return key
-
-    def save_state(self, last_time_epoch):
-        key = self.get_key()
-        obj = {"last_time_epoch": last_time_epoch}
-        self.kvstore.set(key, obj)
 
-    def get_state(self):
-        key = self.get_key()
-        if not self.kvstore.has_key(key):
-            self.save_state(self.DEFAULT_START_TIME_EPOCH)
-        obj = self.kvstore.get(key)
-        return obj
+class DiskMetricsAPI(MeasurementsAPI):
 
-    # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Monitoring-and-Logs/operation/getDatabaseMeasurements
-    def build_fetch_params(self):
-        start_time_epoch, end_time_epoch = self.get_window(
-            self.get_state()["last_time_epoch"]
-        )
-        start_time_date = convert_epoch_to_utc_date(
-            start_time_epoch, date_format=self.isoformat
-        )
-        end_time_date = convert_epoch_to_utc_date(
-            end_time_epoch, date_format=self.isoformat
-        )
-        return (
-            f"""{self.api_config['BASE_URL']}/groups/{self.api_config['PROJECT_ID']}/processes/{self.process_id}/databases/{self.database_name}/measurements""",
-            {
-                "auth": self.digestauth,
-                "params": {
-                    "itemsPerPage": self.api_config["PAGINATION_LIMIT"],
-                    "granularity": "PT1M",
-                    "start": start_time_date,
-                    "end": end_time_date,
-                    "m": self.api_config["METRIC_TYPES"]["DATABASE_METRICS"],
-                },
-            },
+    def __init__(self, kvstore, process_id, disk_name, config, cluster_mapping):
+        super(DiskMetricsAPI, self).__init__(
+            kvstore, config, cluster_mapping, "DISK_METRICS", process_id=process_id, disk_name=disk_name
         )
+        self.process_id = process_id
+        self.disk_name = disk_name
 
-    def build_send_params(self):
-        return {
-            "extra_headers": {"Content-Type": "application/vnd.sumologic.carbon2"},
-            "endpoint_key": "HTTP_METRICS_ENDPOINT",
-            "jsondump": False,
-        }
 
-    def check_move_fetch_window(self, kwargs):
-        # https://www.mongodb.com/docs/atlas/reference/api/process-databases-measurements/
-        # Atlas retrieves database metrics every 20 minutes by default. Results include data points with 20 minute intervals.
-        data_availablity_max_endDate = get_current_timestamp() - 20 * 60
-        api_endDate = convert_utc_date_to_epoch(
-            kwargs["params"]["end"], date_format=self.isoformat
-        )
-        if api_endDate < data_availablity_max_endDate:
-            return True, {"last_time_epoch": api_endDate}
-        else:
-            return False, {}
+class DatabaseMetricsAPI(MeasurementsAPI):
 
-    def transform_data(self, data):
-        metrics = []
-        last_time_epoch = self.DEFAULT_START_TIME_EPOCH
-        for measurement in data["measurements"]:
-            for datapoints in measurement["dataPoints"]:
-                if datapoints["value"] is None:
-                    continue
-                current_timestamp = convert_utc_date_to_epoch(
-                    datapoints["timestamp"], date_format=self.date_format
-                )
-                process_id = self._replace_cluster_name(
-                    data["processId"], self.cluster_mapping
-                )
-                cluster_name = self._get_cluster_name(process_id)
-                metrics.append(
-                    f"""projectId={data['groupId']} databaseName={data['databaseName']} hostId={data['hostId']} processId={process_id} metric={measurement['name']}  units={measurement['units']} cluster_name={cluster_name} {datapoints['value']} {current_timestamp}"""
-                )
-                last_time_epoch = max(current_timestamp, last_time_epoch)
-        return metrics, {"last_time_epoch": last_time_epoch}
+    def __init__(self, kvstore, process_id, database_name, config, cluster_mapping):
+        super(DatabaseMetricsAPI, self).__init__(
+            kvstore, config, cluster_mapping, "DATABASE_METRICS", process_id=process_id, database_name=database_name
+        )
+        self.process_id = process_id
+        self.database_name = database_name
 
 
 class ProjectEventsAPI(PaginatedFetchMixin):
+    log_type = "EVENTS_PROJECT"
     pathname = "projectevents.json"
 
     def __init__(self, kvstore, config):
@@ -678,15 +950,20 @@ class ProjectEventsAPI(PaginatedFetchMixin):
 
     def save_state(self, state):
         key = self.get_key()
+        state = dict(state, sent_event_ids=self.sent_event_ids.to_list())
         self.kvstore.set(key, state)
 
+    def init_state(self):
+        self.save_state(
+            {"last_time_epoch": self.DEFAULT_START_TIME_EPOCH, "page_num": 0}
+        )
+
     def get_state(self):
         key = self.get_key()
         if not self.kvstore.has_key(key):
-            self.save_state(
-                {"last_time_epoch": self.DEFAULT_START_TIME_EPOCH, "page_num": 0}
-            )
+            self.init_state()
         obj = self.kvstore.get(key)
+        self.sent_event_ids = self.load_sent_event_ids(obj)
         return obj
 
     # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Events/operation/listProjectEvents
@@ -715,6 +992,7 @@ class ProjectEventsAPI(PaginatedFetchMixin):
                     "minDate": start_time_date,
                     "maxDate": end_time_date,
                     "pageNum": page_num,
+                    **self.get_event_type_params(),
                 },
             },
         )
@@ -747,12 +1025,14 @@ class ProjectEventsAPI(PaginatedFetchMixin):
         for obj in data["results"]:
             current_timestamp = convert_date_to_epoch(obj["created"])
             last_time_epoch = max(current_timestamp, last_time_epoch)
+        for obj in self.filter_sent_events(self.filter_event_types(data["results"])):
             event_logs.append(obj)
 
         return event_logs, {"last_time_epoch": last_time_epoch}
 
 
 class OrgEventsAPI(PaginatedFetchMixin):
+    log_type = "EVENTS_ORG"
     pathname = "orgevents.json"
 
     def __init__(self, kvstore, config):
@@ -764,15 +1044,20 @@ class OrgEventsAPI(PaginatedFetchMixin):
 
     def save_state(self, state):
         key = self.get_key()
+        state = dict(state, sent_event_ids=self.sent_event_ids.to_list())
         self.kvstore.set(key, state)
 
+    def init_state(self):
+        self.save_state(
+            {"last_time_epoch": self.DEFAULT_START_TIME_EPOCH, "page_num": 0}
+        )
+
     def get_state(self):
         key = self.get_key()
         if not self.kvstore.has_key(key):
-            self.save_state(
-                {"last_time_epoch": self.DEFAULT_START_TIME_EPOCH, "page_num": 0}
-            )
+            self.init_state()
         obj = self.kvstore.get(key)
+        self.sent_event_ids = self.load_sent_event_ids(obj)
         return obj
 
     # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Events/operation/listOrganizationEvents
@@ -801,6 +1086,7 @@ class OrgEventsAPI(PaginatedFetchMixin):
                     "minDate": start_time_date,
                     "maxDate": end_time_date,
                     "pageNum": page_num,
+                    **self.get_event_type_params(),
                 },
             },
         )
@@ -833,6 +1119,7 @@ class OrgEventsAPI(PaginatedFetchMixin):
         for obj in data["results"]:
             current_timestamp = convert_date_to_epoch(obj["created"])
             last_time_epoch = max(current_timestamp, last_time_epoch)
+        for obj in self.filter_sent_events(self.filter_event_types(data["results"])):
             event_logs.append(obj)
 
         return event_logs, {"last_time_epoch": last_time_epoch}
@@ -840,11 +1127,19 @@ class OrgEventsAPI(PaginatedFetchMixin):
 
 class AlertsAPI(MongoDBAPI):
     # In Alerts API assumption is that no new new alerts will be inserted in previous pages
+    # Alerts are deduplicated using the (id, updated) pairs kept in seen_alerts, only alerts which can be fetched
+    # again (active ones and the ones on the pages walked in the run) are retained so that the state stays compact.
+    # Status changes of active alerts are picked up by listing the active statuses on every run.
 
+    log_type = "ALERTS"
     pathname = "alerts.json"
+    ACTIVE_STATUSES = ("OPEN", "TRACKING")
 
     def __init__(self, kvstore, config):
         super(AlertsAPI, self).__init__(kvstore, config)
+        self.seen_alerts = {}
+        self.active_alert_ids = set()
+        self.walked_alert_ids = set()
 
     def get_key(self):
         key = f"""{self.api_config['PROJECT_ID']}-alerts"""
@@ -854,13 +1149,27 @@ class AlertsAPI(MongoDBAPI):
         key = self.get_key()
         self.kvstore.set(key, state)
 
+    def init_state(self):
+        self.save_state({"page_num": 0, "last_page_offset": 0, "seen_alerts": {}, "active_alert_ids": []})
+
     def get_state(self):
         key = self.get_key()
         if not self.kvstore.has_key(key):
-            self.save_state({"page_num": 0, "last_page_offset": 0})
+            self.init_state()
         obj = self.kvstore.get(key)
         return obj
 
+    def _build_alerts_state(self, page_num, last_page_offset):
+        retained_alert_ids = self.active_alert_ids | self.walked_alert_ids
+        return {
+            "page_num": page_num,
+            "last_page_offset": last_page_offset,
+            "seen_alerts": {
+                alert_id: updated for alert_id, updated in self.seen_alerts.items() if alert_id in retained_alert_ids
+            },
+            "active_alert_ids": sorted(self.active_alert_ids),
+        }
+
     # API Ref: https://www.mongodb.com/docs/atlas/reference/api-resources-spec/v1/#tag/Alerts/operation/listAlerts
     def build_fetch_params(self):
         state = self.get_state()
@@ -886,30 +1195,87 @@ class AlertsAPI(MongoDBAPI):
             "endpoint_key": "HTTP_LOGS_ENDPOINT",
         }
 
+    def make_alerts_request(self, sess, url, kwargs):
+        return self.make_atlas_request(url, kwargs, session=sess)
+
+    def get_changed_alerts(self, alerts):
+        return [alert for alert in alerts if self.seen_alerts.get(alert["id"]) != alert.get("updated")]
+
+    def send_alerts(self, output_handler, alerts):
+        if not alerts:
+            return True
+        send_success = output_handler.send(alerts, **self.build_send_params())
+        if send_success:
+            for alert in alerts:
+                self.seen_alerts[alert["id"]] = alert.get("updated")
+        return send_success
+
     def transform_data(self, data):
         # assuming file content is small so inmemory possible
         # https://stackoverflow.com/questions/11914472/stringio-in-python3
         # https://stackoverflow.com/questions/8858414/using-python-how-do-you-untar-purely-in-memory
 
-        event_logs = []
-        for obj in data["results"]:
-            event_logs.append(obj)
+        event_logs = self.get_changed_alerts(data["results"])
+        self.walked_alert_ids.update(alert["id"] for alert in data["results"])
 
         return event_logs, {
             "last_page_offset": len(data["results"])
             % self.api_config["PAGINATION_LIMIT"]
         }
 
+    def sync_active_alerts(self, sess, output_handler, url, kwargs):
+        """
+        Lists the alerts in ACTIVE_STATUSES and sends the new or changed ones. Alerts which were active in the
+        previous run and are not listed anymore got closed in the meantime, they are fetched individually.
+        Returns False if an alert could not be fetched or sent, these are checked again in the next run.
+        """
+        active_alert_ids = set()
+        try:
+            for status in self.ACTIVE_STATUSES:
+                page_num = 1
+                while True:
+                    params = dict(kwargs["params"], status=status, pageNum=page_num)
+                    fetch_success, data = self.make_alerts_request(sess, url, dict(kwargs, params=params))
+                    if not (fetch_success and "results" in data):
+                        self.log.error(
+                            f"""Unable to fetch Project: {self.api_config['PROJECT_ID']} Alerts Status: {status} Page: {page_num} Reason: {data} """
+                        )
+                        return False
+                    active_alert_ids.update(alert["id"] for alert in data["results"])
+                    if not self.send_alerts(output_handler, self.get_changed_alerts(data["results"])):
+                        self.log.error(f"""Unable to send Project: {self.api_config['PROJECT_ID']} Alerts Status: {status} Page: {page_num} """)
+                        return False
+                    if len(data["results"]) < self.api_config["PAGINATION_LIMIT"]:
+                        break
+                    page_num += 1
+
+            is_synced = True
+            for alert_id in sorted(self.active_alert_ids - active_alert_ids):
+                fetch_success, alert = self.make_alerts_request(sess, f"{url}/{alert_id}", {"auth": kwargs["auth"]})
+                if not (fetch_success and "id" in alert):
+                    self.log.error(f"""Unable to fetch Project: {self.api_config['PROJECT_ID']} Alert: {alert_id} Reason: {alert} """)
+                    active_alert_ids.add(alert_id)
+                    is_synced = False
+                    continue
+                if not self.send_alerts(output_handler, self.get_changed_alerts([alert])):
+                    self.log.error(f"""Unable to send Project: {self.api_config['PROJECT_ID']} Alert: {alert_id} """)
+                    active_alert_ids.add(alert_id)
+                    is_synced = False
+            self.active_alert_ids = active_alert_ids
+            return is_synced
+        finally:
+            # alerts which are not confirmed as inactive are checked again in the next run
+            self.active_alert_ids |= active_alert_ids
+
     def fetch(self):
         current_state = self.get_state()
-        output_handler = OutputHandlerFactory.get_handler(
-            self.collection_config["OUTPUT_HANDLER"],
-            path=self.pathname,
-            config=self.config,
-        )
+        self.seen_alerts = dict(current_state.get("seen_alerts", {}))
+        self.active_alert_ids = set(current_state.get("active_alert_ids", []))
+        self.walked_alert_ids = set()
+        output_handler = self.get_output_handler()
         url, kwargs = self.build_fetch_params()
         next_request = True
-        sess = ClientMixin.get_new_session()
+        sess = self.get_atlas_session()
         log_type = self.get_key()
         count = 0
         self.log.info(
@@ -918,16 +1284,7 @@ class AlertsAPI(MongoDBAPI):
         try:
             while next_request:
                 send_success = has_next_page = False
-                status, data = ClientMixin.make_request(
-                    url,
-                    method="get",
-                    session=sess,
-                    logger=self.log,
-                    TIMEOUT=self.collection_config["TIMEOUT"],
-                    MAX_RETRY=self.collection_config["MAX_RETRY"],
-                    BACKOFF_FACTOR=self.collection_config["BACKOFF_FACTOR"],
-                    **kwargs,
-                )
+                status, data = self.make_alerts_request(sess, url, kwargs)
                 if count < 4 or (count % 5 == 0):
                     self.log.info(f'''Fetched LogType: {log_type} kwargs: {kwargs} url: {url}''')
                 fetch_success = status and "results" in data
@@ -935,9 +1292,7 @@ class AlertsAPI(MongoDBAPI):
                     has_next_page = len(data["results"]) > 0
                     if has_next_page:
                         payload, updated_state = self.transform_data(data)
-                        send_success = output_handler.send(
-                            payload, **self.build_send_params()
-                        )
+                        send_success = self.send_alerts(output_handler, payload)
                         if send_success:
                             count += 1
                             if count < 4 or (count % 5 == 0):
@@ -950,28 +1305,23 @@ class AlertsAPI(MongoDBAPI):
                                 kwargs["params"]["pageNum"] += 1
                             else:
                                 has_next_page = False
+                            if not has_next_page and self.is_time_remaining():
+                                # the alerts not synced keep their seen entries and stay active in the saved state
+                                send_success = self.sync_active_alerts(sess, output_handler, url, kwargs)
                             # time not available save current state new page num else continue
                             if (not self.is_time_remaining()) or (not has_next_page):
-                                self.save_state(
-                                    {
-                                        "page_num": kwargs["params"]["pageNum"],
-                                        "last_page_offset": current_state[
-                                            "last_page_offset"
-                                        ],
-                                    }
+                                self.save_state_after_send(
+                                    output_handler,
+                                    self._build_alerts_state(kwargs["params"]["pageNum"], current_state["last_page_offset"])
                                 )
                         else:
                             # show err unable to send save current state
                             self.log.error(
                                 f"""Unable to send Project: {self.api_config['PROJECT_ID']} Alerts Page: {kwargs['params']['pageNum']} """
                             )
-                            self.save_state(
-                                {
-                                    "page_num": kwargs["params"]["pageNum"],
-                                    "last_page_offset": current_state[
-                                        "last_page_offset"
-                                    ],
-                                }
+                            self.save_state_after_send(
+                                output_handler,
+                                self._build_alerts_state(kwargs["params"]["pageNum"], current_state["last_page_offset"])
                             )
                     else:
                         self.log.debug(
@@ -980,11 +1330,11 @@ class AlertsAPI(MongoDBAPI):
                         # here send success is false
                         # genuine no result window no change
                         # page_num has finished increase window calc last_time_epoch  and add 1
-                        self.save_state(
-                            {
-                                "page_num": kwargs["params"]["pageNum"],
-                                "last_page_offset": current_state["last_page_offset"],
-                            }
+                        if self.is_time_remaining():
+                            send_success = self.sync_active_alerts(sess, output_handler, url, kwargs)
+                        self.save_state_after_send(
+                            output_handler,
+                            self._build_alerts_state(kwargs["params"]["pageNum"], current_state["last_page_offset"])
                         )
                 else:
                     self.log.error(
@@ -992,7 +1342,7 @@ class AlertsAPI(MongoDBAPI):
                     )
                 next_request = (fetch_success and send_success and has_next_page and self.is_time_remaining())
         finally:
-            sess.close()
+            output_handler.close()
             self.log.info(
                 f"""Completed LogType: {log_type} Count: {count} Page: {kwargs['params']['pageNum']}"""
             )
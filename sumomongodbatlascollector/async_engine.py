@@ -0,0 +1,178 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+try:
+    import httpx
+except ImportError:  # optional dependency installed with the async extra
+    httpx = None
+
+from time_and_memory_tracker import TimeAndMemoryTracker
+from rate_limiter import get_atlas_rate_limiter, parse_retry_after
+
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+
+def is_async_fetch_supported(task):
+    # single request apis (FetchMixin) expose the request split/merge hooks, paginated apis keep using threads
+    return hasattr(task, "split_fetch_request") and hasattr(task, "handle_fetch_response")
+
+
+class AsyncFetchEngine:
+    """
+    Runs FetchMixin tasks concurrently on one event loop using httpx with digest auth.
+    Requests to Atlas are bounded by a semaphore per host and per endpoint (api type), the blocking steps
+    (kvstore reads in build_fetch_params, transform, send and save_state) run on a small thread pool.
+    The duration of every task is recorded in the scheduler history when a scheduler is given, the engine calls
+    the task hooks directly so TimedTask.fetch does not run for these tasks.
+    """
+
+    def __init__(self, config, logger, scheduler=None):
+        if httpx is None:
+            raise ImportError("ASYNC_FETCH_ENGINE requires httpx, install it with pip install sumologic-mongodb-atlas[async]")
+        self.collection_config = config["Collection"]
+        self.log = logger
+        self.scheduler = scheduler
+        self.max_concurrent_tasks = self.collection_config.get("ASYNC_MAX_CONCURRENT_TASKS", 200)
+        self.max_requests_per_host = self.collection_config.get("ASYNC_MAX_REQUESTS_PER_HOST", 50)
+        self.max_requests_per_endpoint = self.collection_config.get("ASYNC_MAX_REQUESTS_PER_ENDPOINT", 20)
+        self.num_send_workers = self.collection_config.get("ASYNC_SEND_WORKERS", 4)
+        self.rate_limiter = get_atlas_rate_limiter(config)
+        self.host_semaphores = {}
+        self.endpoint_semaphores = {}
+        # one DigestAuth per credential pair so that the nonce is reused across the requests
+        self.digest_auths = {}
+
+    def run(self, tasks):
+        """
+        returns list of (task, exception) for the tasks which raised an exception
+        """
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.num_send_workers, thread_name_prefix="async-send")
+        loop.set_default_executor(executor)
+        try:
+            return loop.run_until_complete(self._run_tasks(tasks))
+        finally:
+            loop.close()
+            executor.shutdown(wait=True)
+
+    async def _run_tasks(self, tasks):
+        # semaphores are created inside the running loop
+        self.host_semaphores = {}
+        self.endpoint_semaphores = {}
+        task_semaphore = asyncio.Semaphore(self.max_concurrent_tasks)
+        limits = httpx.Limits(max_connections=self.max_requests_per_host, max_keepalive_connections=self.max_requests_per_host)
+        async with httpx.AsyncClient(limits=limits) as client:
+
+            async def run_task(task):
+                async with task_semaphore:
+                    await self._run_task(client, task)
+
+            results = await asyncio.gather(*[run_task(task) for task in tasks], return_exceptions=True)
+
+        failed_tasks = []
+        for task, result in zip(tasks, results):
+            if isinstance(result, Exception):
+                self.log.error(f"""Async task: {task} failed reason: {repr(result)}""")
+                failed_tasks.append((task, result))
+        return failed_tasks
+
+    async def _run_task(self, client, task):
+        loop = asyncio.get_event_loop()
+        start_time = time.time()
+        try:
+            url, kwargs = await loop.run_in_executor(None, task.build_fetch_params)
+            request_kwargs = task.split_fetch_request(url, kwargs)
+            responses = await asyncio.gather(*[self._make_request(client, task, url, group_kwargs) for group_kwargs in request_kwargs])
+            fetch_success, content = task.merge_fetch_responses(request_kwargs, list(responses))
+            await loop.run_in_executor(None, self._handle_response, task, url, kwargs, fetch_success, content)
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.record_duration(task.get_key(), time.time() - start_time)
+
+    def _handle_response(self, task, url, kwargs, fetch_success, content):
+        output_handler = task.get_output_handler()
+        try:
+            with TimeAndMemoryTracker(activate=self.collection_config.get("ACTIVATE_TIME_AND_MEMORY_TRACKING", False)) as tracker:
+                task.handle_fetch_response(url, kwargs, fetch_success, content, output_handler, tracker)
+        finally:
+            output_handler.close()
+
+    def _get_semaphores(self, task, url):
+        host = urlparse(url).netloc
+        endpoint = f"{host}/{task.pathname}"
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.max_requests_per_host)
+        if endpoint not in self.endpoint_semaphores:
+            self.endpoint_semaphores[endpoint] = asyncio.Semaphore(self.max_requests_per_endpoint)
+        return self.host_semaphores[host], self.endpoint_semaphores[endpoint]
+
+    def _get_digest_auth(self, auth):
+        if auth is None:
+            return None
+        credentials = (auth.username, auth.password)
+        if credentials not in self.digest_auths:
+            self.digest_auths[credentials] = httpx.DigestAuth(*credentials)
+        return self.digest_auths[credentials]
+
+    async def _make_request(self, client, task, url, kwargs):
+        """
+        async counterpart of ClientMixin.make_request, returns (is_success, json or bytes for is_file or error message)
+        """
+        digestauth = self._get_digest_auth(kwargs.get("auth"))
+        host_semaphore, endpoint_semaphore = self._get_semaphores(task, url)
+        max_retry = self.collection_config["MAX_RETRY"]
+        backoff_factor = self.collection_config["BACKOFF_FACTOR"]
+        err_msg = ""
+        for attempt in range(max_retry + 1):
+            wait = self.rate_limiter.reserve(url)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                async with host_semaphore, endpoint_semaphore:
+                    response = await client.get(
+                        url,
+                        params=kwargs.get("params"),
+                        headers=kwargs.get("headers"),
+                        auth=digestauth,
+                        timeout=self.collection_config["TIMEOUT"],
+                    )
+                if 200 <= response.status_code < 300:
+                    return True, response.content if kwargs.get("is_file") else response.json()
+                err_msg = f"""status_code: {response.status_code} reason: {response.text}"""
+                if response.status_code == 429:
+                    # the limiter slows down and applies Retry-After before the next attempt
+                    self.rate_limiter.throttle(url, parse_retry_after(response.headers.get("Retry-After")))
+                    continue
+                if response.status_code not in RETRY_STATUS_CODES:
+                    break
+            except httpx.HTTPError as e:
+                err_msg = repr(e)
+            if attempt < max_retry:
+                self.log.warning(f"""Retrying url: {url} attempt: {attempt + 1} reason: {err_msg}""")
+                await asyncio.sleep(backoff_factor * (2 ** attempt))
+        return False, err_msg
+
+
+class AsyncFetchTaskGroup:
+    """
+    Runs a group of tasks with the AsyncFetchEngine from a single worker of the collector thread pool.
+    """
+
+    def __init__(self, tasks, engine):
+        self.tasks = tasks
+        self.engine = engine
+
+    def __str__(self):
+        return f"AsyncFetchTaskGroup({len(self.tasks)} tasks)"
+
+    def fetch(self):
+        failed_tasks = self.engine.run(self.tasks)
+        if failed_tasks:
+            raise Exception(f"{len(failed_tasks)} of {len(self.tasks)} async tasks failed")
+
+    def close(self):
+        for task in self.tasks:
+            task.close()
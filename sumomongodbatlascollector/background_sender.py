@@ -0,0 +1,258 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sumoappclient.common.logger import get_logger
+from sumoappclient.sumoclient.utils import get_body
+
+
+SIZE_SAMPLE_RECORDS = 16
+
+
+def estimate_body_size(data, jsondump=True):
+    """
+    Size of the body get_body builds for the data, the payload is serialized once by the send so the size of a
+    list of records is extrapolated from an evenly spaced sample of them.
+    """
+    if not isinstance(data, list):
+        return len(get_body(data, jsondump))
+    if not jsondump:
+        return sum(len(record) for record in data) + max(len(data) - 1, 0)
+    if len(data) <= SIZE_SAMPLE_RECORDS:
+        return len(get_body(data, jsondump))
+    step = len(data) / SIZE_SAMPLE_RECORDS
+    sample = [data[int(idx * step)] for idx in range(SIZE_SAMPLE_RECORDS)]
+    return (len(get_body(sample, jsondump)) + 1) * len(data) // SIZE_SAMPLE_RECORDS
+
+
+class StateWriteRecorder:
+    """
+    Stands in for the kvstore while a task builds its state so that the writes can be replayed later,
+    reads go to the real kvstore.
+    """
+
+    def __init__(self, kvstore):
+        self.kvstore = kvstore
+        self.writes = []
+
+    def __getattr__(self, name):
+        return getattr(self.kvstore, name)
+
+    def set(self, key, value):
+        self.writes.append((key, value))
+
+    def replay(self):
+        for key, value in self.writes:
+            self.kvstore.set(key, value)
+
+
+class QueuedOutputHandler:
+    """
+    Output handler of a task fetch with the background sender. send enqueues the payload and returns, the
+    checkpoints deferred with defer_checkpoint are committed in order once every payload enqueued before them
+    is acknowledged. After a failed send the later checkpoints are dropped, the payloads of the handler still
+    queued in the sender are cancelled and send returns False so that the task stops, the next invocation resumes
+    from the last committed checkpoint.
+    """
+
+    defers_checkpoints = True
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.pending = deque()
+        self.failed = False
+        # set on the first failed send, the acknowledgements before it may still be outstanding
+        self.cancelled = False
+        self.lock = threading.RLock()
+
+    def send(self, data, *args, endpoint_key="SUMO_ENDPOINT", **kwargs):
+        if self.failed or self.cancelled:
+            return False
+        if not data:
+            return True
+        entry = {"done": False, "success": False, "checkpoints": []}
+        with self.lock:
+            self.pending.append(entry)
+        self.sender.submit(
+            data, args, dict(kwargs, endpoint_key=endpoint_key), lambda success: self._acknowledge(entry, success),
+            is_cancelled=self.is_cancelled,
+        )
+        return True
+
+    def is_cancelled(self):
+        return self.cancelled
+
+    def defer_checkpoint(self, checkpoint):
+        with self.lock:
+            if self.pending:
+                self.pending[-1]["checkpoints"].append(checkpoint)
+                return
+            if self.failed:
+                return
+            checkpoint()
+
+    def _acknowledge(self, entry, success):
+        # checkpoints run under the lock so that concurrent acknowledgements commit them in order
+        with self.lock:
+            entry["done"], entry["success"] = True, success
+            if not success:
+                self.cancelled = True
+            while self.pending and self.pending[0]["done"]:
+                entry = self.pending.popleft()
+                if not entry["success"]:
+                    self.failed = True
+                if not self.failed:
+                    for checkpoint in entry["checkpoints"]:
+                        checkpoint()
+
+    def close(self):
+        # the sender is drained when the collector stops
+        pass
+
+
+class BackgroundSender:
+    """
+    Sends the payloads of all the tasks from a pool of sender threads so that the fetch workers do not wait
+    for Sumo Logic. Payloads are queued per endpoint key and picked round robin, the queued and in flight
+    payloads are bounded by SENDER_QUEUE_MAX_BYTES and submit blocks (backpressure) while the budget is used up.
+    Payloads of the COALESCE_ENDPOINT_KEYS with the same send params are merged across tasks into batches of up to
+    MAX_PAYLOAD_BYTESIZE, a batch is queued once it is full or COALESCE_LINGER_SECONDS after it was opened.
+    Payloads whose is_cancelled returns True when a worker picks them up are acknowledged as failed without a send.
+    """
+
+    def __init__(self, send, config):
+        self.send = send
+        self.collection_config = config["Collection"]
+        self.log = get_logger(__name__, **config["Logging"])
+        self.max_queue_bytes = self.collection_config.get("SENDER_QUEUE_MAX_BYTES", 32 * 1024 * 1024)
+        self.num_workers = self.collection_config.get("SENDER_WORKERS", 4)
+        self.coalesce_endpoint_keys = self.collection_config.get("COALESCE_ENDPOINT_KEYS") or []
+        self.coalesce_linger_seconds = self.collection_config.get("COALESCE_LINGER_SECONDS", 1)
+        self.max_batch_bytes = self.collection_config.get("MAX_PAYLOAD_BYTESIZE", 1024 * 1024)
+        self.batches = OrderedDict()
+        self.queues = OrderedDict()
+        self.queued_bytes = 0
+        self.in_flight = 0
+        self.workers = []
+        self.is_closed = False
+        self.condition = threading.Condition()
+        self.metrics = {"sent": 0, "failed": 0, "cancelled": 0, "sent_bytes": 0, "blocked": 0, "blocked_seconds": 0.0, "coalesced": 0}
+
+    def _start_workers(self):
+        for _ in range(self.num_workers - len(self.workers)):
+            worker = threading.Thread(target=self._run_worker, name=f"sender-{len(self.workers)}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, data, args, kwargs, callback, is_cancelled=None):
+        size = estimate_body_size(data, kwargs.get("jsondump", True))
+        endpoint_key = kwargs["endpoint_key"]
+        with self.condition:
+            if self.is_closed:
+                raise RuntimeError("Background sender is closed")
+            self._start_workers()
+            # a payload larger than the budget is still accepted once everything before it is sent
+            if self.queued_bytes > 0 and self.queued_bytes + size > self.max_queue_bytes:
+                start_time = time.time()
+                self.condition.wait_for(lambda: self.queued_bytes == 0 or self.queued_bytes + size <= self.max_queue_bytes)
+                self.metrics["blocked"] += 1
+                self.metrics["blocked_seconds"] += time.time() - start_time
+            self.queued_bytes += size
+            part = (data, callback, is_cancelled)
+            if endpoint_key in self.coalesce_endpoint_keys and not args and isinstance(data, list):
+                self._add_to_batch(part, kwargs, size)
+            else:
+                self.queues.setdefault(endpoint_key, deque()).append(([part], args, kwargs, size))
+            self.condition.notify_all()
+
+    def _add_to_batch(self, part, kwargs, size):
+        batch_key = repr(sorted(kwargs.items()))
+        batch = self.batches.get(batch_key)
+        if batch is not None and batch["size"] + size > self.max_batch_bytes:
+            self._queue_batch(batch_key)
+            batch = None
+        if batch is None:
+            batch = self.batches[batch_key] = {"parts": [], "kwargs": kwargs, "size": 0, "opened_at": time.monotonic()}
+        # the parts are merged when the batch is sent so that the cancelled ones can still be left out
+        batch["parts"].append(part)
+        batch["size"] += size
+        if batch["size"] >= self.max_batch_bytes:
+            self._queue_batch(batch_key)
+
+    def _queue_batch(self, batch_key):
+        batch = self.batches.pop(batch_key)
+        self.metrics["coalesced"] += len(batch["parts"])
+        self.queues.setdefault(batch["kwargs"]["endpoint_key"], deque()).append((batch["parts"], (), batch["kwargs"], batch["size"]))
+
+    def _queue_expired_batches(self, linger_seconds):
+        now = time.monotonic()
+        for batch_key in [key for key, batch in self.batches.items() if now - batch["opened_at"] >= linger_seconds]:
+            self._queue_batch(batch_key)
+
+    def _next_item(self):
+        for endpoint_key, items in self.queues.items():
+            if items:
+                # the endpoint goes to the back so that the endpoints take turns
+                self.queues.move_to_end(endpoint_key)
+                return items.popleft()
+        return None
+
+    def _run_worker(self):
+        while True:
+            with self.condition:
+                while True:
+                    self._queue_expired_batches(self.coalesce_linger_seconds)
+                    item = self._next_item()
+                    if item is not None or self.is_closed:
+                        break
+                    # open batches are checked again once their linger time is over
+                    self.condition.wait(self.coalesce_linger_seconds if self.batches else None)
+                if item is None:
+                    return
+                self.in_flight += 1
+            parts, args, kwargs, size = item
+            sent_parts, cancelled_parts = [], []
+            for part in parts:
+                (cancelled_parts if part[2] is not None and part[2]() else sent_parts).append(part)
+            success = None
+            if sent_parts:
+                data = sent_parts[0][0] if len(sent_parts) == 1 else [record for part in sent_parts for record in part[0]]
+                try:
+                    success = self.send(data, *args, **kwargs)
+                except Exception as e:
+                    self.log.error(f"""Failed to send endpoint: {kwargs['endpoint_key']} reason: {repr(e)}""")
+                    success = False
+            acknowledgements = [(part[1], bool(success)) for part in sent_parts] + [(part[1], False) for part in cancelled_parts]
+            for callback, is_sent in acknowledgements:
+                try:
+                    callback(is_sent)
+                except Exception as e:
+                    self.log.error(f"""Failed to save checkpoint endpoint: {kwargs['endpoint_key']} reason: {repr(e)}""")
+            with self.condition:
+                self.in_flight -= 1
+                self.queued_bytes -= size
+                self.metrics["cancelled"] += len(cancelled_parts)
+                if success is not None:
+                    self.metrics["sent" if success else "failed"] += 1
+                if success:
+                    self.metrics["sent_bytes"] += size
+                self.condition.notify_all()
+
+    def flush(self):
+        with self.condition:
+            self._queue_expired_batches(0)
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: not self.workers or (self.in_flight == 0 and not any(self.queues.values())))
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        self.log.info(f"""Background sender metrics: {self.metrics}""")
+        # the collector process is reused across invocations (aws lambda)
+        with self.condition:
+            self.workers = []
+            self.is_closed = False
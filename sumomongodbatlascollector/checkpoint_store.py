@@ -0,0 +1,213 @@
+import copy
+import shelve
+import threading
+import time
+from contextlib import contextmanager
+
+from sumoappclient.common.logger import get_logger
+
+
+class CheckpointStore:
+    """
+    Write-behind layer over the kvstore for the task checkpoints. set keeps the latest value of every key in
+    memory and the pending keys are written together, with a batch write on DynamoDB (aws) and within a single
+    open of the shelve db (onprem). Writes are flushed once CHECKPOINT_FLUSH_MAX_KEYS keys are pending or
+    CHECKPOINT_FLUSH_INTERVAL_SECONDS after the last flush, and when the collector stops. Reads of a pending key
+    are served from memory, everything else (locks included) goes to the kvstore.
+
+    A crash loses the checkpoints written since the last flush, the tasks then fetch that data again. Without
+    write_behind set writes right away except within deferred_writes.
+
+    preload reads the given keys in bulk (DynamoDB batch get, single open of the shelve db) and keeps them in
+    memory, the later reads of these keys, including the ones of keys found missing, are served from memory.
+    """
+
+    DYNAMODB_BATCH_GET_MAX_KEYS = 100
+
+    def __init__(self, kvstore, config, write_behind=True):
+        self.kvstore = kvstore
+        self.write_behind = write_behind
+        self.collection_config = config["Collection"]
+        self.log = get_logger(__name__, **config["Logging"])
+        self.max_pending_keys = self.collection_config.get("CHECKPOINT_FLUSH_MAX_KEYS", 100)
+        self.flush_interval_seconds = self.collection_config.get("CHECKPOINT_FLUSH_INTERVAL_SECONDS", 30)
+        self.pending = {}
+        self.cache = {}
+        self.missing = set()
+        self.defer_depth = 0
+        self.last_flush_time = time.monotonic()
+        self.lock = threading.Lock()
+        # flushes are serialized so that an older batch never overwrites a newer one
+        self.flush_lock = threading.Lock()
+        self.metrics = {"sets": 0, "coalesced": 0, "flushes": 0, "flushed_keys": 0, "failed_flushes": 0, "preloaded_keys": 0, "missing_keys": 0}
+
+    def __getattr__(self, name):
+        return getattr(self.kvstore, name)
+
+    def set(self, key, value):
+        # copied like the kvstore would so that later changes of the caller are not saved
+        value = copy.deepcopy(value)
+        with self.lock:
+            self.metrics["sets"] += 1
+            if key in self.cache or key in self.missing:
+                self.cache[key] = value
+                self.missing.discard(key)
+            is_write_through = not self.write_behind and self.defer_depth == 0
+            if not is_write_through:
+                if key in self.pending:
+                    self.metrics["coalesced"] += 1
+                self.pending[key] = value
+                is_flush_due = len(self.pending) >= self.max_pending_keys \
+                    or time.monotonic() - self.last_flush_time >= self.flush_interval_seconds
+        if is_write_through:
+            self.kvstore.set(key, value)
+        elif is_flush_due:
+            self.flush()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.pending:
+                return copy.deepcopy(self.pending[key])
+            if key in self.cache:
+                return copy.deepcopy(self.cache[key])
+            if key in self.missing:
+                return default
+        return self.kvstore.get(key, default)
+
+    def has_key(self, key):
+        with self.lock:
+            if key in self.pending or key in self.cache:
+                return True
+            if key in self.missing:
+                return False
+        return self.kvstore.has_key(key)
+
+    def delete(self, key):
+        with self.flush_lock:
+            with self.lock:
+                self.pending.pop(key, None)
+                if self.cache.pop(key, None) is not None:
+                    self.missing.add(key)
+            self.kvstore.delete(key)
+
+    def _read_batch(self, keys):
+        values = {}
+        env = getattr(self.kvstore, "env", None)
+        if env == "aws":
+            table_name, key_col = self.kvstore.table_name, self.kvstore.KEY_COL
+            for idx in range(0, len(keys), self.DYNAMODB_BATCH_GET_MAX_KEYS):
+                request = {table_name: {"Keys": [{key_col: key} for key in keys[idx:idx + self.DYNAMODB_BATCH_GET_MAX_KEYS]], "ConsistentRead": True}}
+                attempt = 0
+                while request:
+                    response = self.kvstore.dynamodbcli.batch_get_item(RequestItems=request)
+                    for item in response["Responses"].get(table_name, []):
+                        values[item[key_col]] = self.kvstore._replace_decimals(item[self.kvstore.VALUE_COL])
+                    # keys are left unprocessed when the read capacity is exceeded
+                    request = response.get("UnprocessedKeys")
+                    if request:
+                        time.sleep(min(0.05 * 2 ** attempt, 1))
+                        attempt += 1
+        elif env == "onprem":
+            with self.kvstore.lock:
+                db = shelve.open(self.kvstore.file_path, flag="r")
+                try:
+                    for key in keys:
+                        actual_key = self.kvstore._get_actual_key(key)
+                        if actual_key in db:
+                            values[key] = db[actual_key]
+                finally:
+                    db.close()
+        else:
+            for key in keys:
+                if self.kvstore.has_key(key):
+                    values[key] = self.kvstore.get(key)
+        return values
+
+    def preload(self, keys):
+        """
+        returns the keys which do not exist in the kvstore
+        """
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            unknown_keys = [key for key in keys if key not in self.pending and key not in self.cache and key not in self.missing]
+        values = self._read_batch(unknown_keys)
+        with self.lock:
+            for key in unknown_keys:
+                if key in self.pending or key in self.cache or key in self.missing:
+                    continue
+                if key in values:
+                    self.cache[key] = values[key]
+                else:
+                    self.missing.add(key)
+            self.metrics["preloaded_keys"] += len(values)
+            self.metrics["missing_keys"] += len(unknown_keys) - len(values)
+            missing_keys = [key for key in keys if key in self.missing]
+        self.log.info(f"""Preloaded states keys: {len(keys)} read: {len(unknown_keys)} missing: {len(missing_keys)}""")
+        return missing_keys
+
+    @contextmanager
+    def deferred_writes(self):
+        # the writes within are written together when it exits, also without write_behind
+        with self.lock:
+            self.defer_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.defer_depth -= 1
+            self.flush()
+
+    def _write_batch(self, items):
+        env = getattr(self.kvstore, "env", None)
+        if env == "aws":
+            table = self.kvstore.dynamodbcli.Table(self.kvstore.table_name)
+            # batch_writer sends 25 items per request and resends the unprocessed ones
+            with table.batch_writer(overwrite_by_pkeys=[self.kvstore.KEY_COL]) as batch:
+                for key, value in items.items():
+                    batch.put_item(Item={self.kvstore.KEY_COL: key, self.kvstore.VALUE_COL: self.kvstore._put_decimals(copy.deepcopy(value))})
+        elif env == "onprem":
+            with self.kvstore.lock:
+                db = shelve.open(self.kvstore.file_path)
+                try:
+                    for key, value in items.items():
+                        db[self.kvstore._get_actual_key(key)] = value
+                finally:
+                    db.close()
+        else:
+            for key, value in items.items():
+                self.kvstore.set(key, value)
+
+    def flush(self):
+        """
+        returns False if the pending writes could not be saved, they are kept for the next flush
+        """
+        with self.flush_lock:
+            with self.lock:
+                items, self.pending = self.pending, {}
+                self.last_flush_time = time.monotonic()
+            if not items:
+                return True
+            try:
+                self._write_batch(items)
+            except Exception as e:
+                with self.lock:
+                    # newer values set during the flush win over the failed ones
+                    for key, value in items.items():
+                        self.pending.setdefault(key, value)
+                    self.metrics["failed_flushes"] += 1
+                self.log.error(f"""Failed to flush checkpoints keys: {len(items)} reason: {repr(e)}""")
+                return False
+            with self.lock:
+                self.metrics["flushes"] += 1
+                self.metrics["flushed_keys"] += len(items)
+            self.log.debug(f"""Flushed checkpoints keys: {len(items)}""")
+            return True
+
+    def get_metrics(self):
+        with self.lock:
+            return dict(self.metrics, pending=len(self.pending))
+
+    def close(self):
+        self.flush()
+        self.log.info(f"""Checkpoint store metrics: {self.get_metrics()}""")
+        self.kvstore.close()
@@ -0,0 +1,99 @@
+import threading
+
+from sumoappclient.common.logger import get_logger
+
+
+# tuned chunk sizes by endpoint key and urls, kept across the invocations of a reused process (warm lambda)
+_tuned_chunk_sizes = {}
+_tuned_chunk_sizes_lock = threading.Lock()
+
+
+class AdaptiveChunkSizer:
+    """
+    Tunes the chunk size (before compression) of the Sumo Logic sends per endpoint key. The size is halved after
+    a failed send and otherwise moves towards the size expected to be posted in ADAPTIVE_CHUNK_TARGET_LATENCY_SECONDS,
+    which is derived from the observed wire throughput and compression ratio. It stays between
+    MIN_PAYLOAD_BYTESIZE and MAX_PAYLOAD_BYTESIZE and does not grow while the error rate is high.
+
+    The tuned sizes are saved in a process wide cache on close and are the starting sizes of the sizers created
+    later in the same process.
+    """
+
+    SMOOTHING_FACTOR = 0.3
+    MAX_GROWTH_FACTOR = 2.0
+    MAX_ERROR_RATE_FOR_GROWTH = 0.1
+
+    def __init__(self, config):
+        self.collection_config = config["Collection"]
+        self.sumo_config = config.get("SumoLogic") or {}
+        self.log = get_logger(__name__, **config["Logging"])
+        self.max_size = self.collection_config.get("MAX_PAYLOAD_BYTESIZE", 1024 * 1024)
+        self.min_size = min(self.collection_config.get("MIN_PAYLOAD_BYTESIZE", 64 * 1024), self.max_size)
+        self.target_latency = self.collection_config.get("ADAPTIVE_CHUNK_TARGET_LATENCY_SECONDS", 2)
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def _get_cache_key(self, endpoint_key):
+        # sizes tuned for other urls do not apply
+        return endpoint_key, str(self.sumo_config.get(endpoint_key))
+
+    def _get_endpoint(self, endpoint_key, initial_size):
+        if endpoint_key not in self.endpoints:
+            with _tuned_chunk_sizes_lock:
+                initial_size = _tuned_chunk_sizes.get(self._get_cache_key(endpoint_key), initial_size)
+            self.endpoints[endpoint_key] = {
+                "chunk_size": max(min(initial_size, self.max_size), self.min_size), "latency": None, "error_rate": 0.0,
+                "ratio": None, "wire_bytes_per_second": None, "sends": 0, "failures": 0, "raw_bytes": 0, "seconds": 0.0,
+            }
+        return self.endpoints[endpoint_key]
+
+    def _smooth(self, previous, value):
+        if previous is None:
+            return value
+        return self.SMOOTHING_FACTOR * value + (1 - self.SMOOTHING_FACTOR) * previous
+
+    def get_chunk_size(self, endpoint_key, initial_size):
+        with self.lock:
+            return int(self._get_endpoint(endpoint_key, initial_size)["chunk_size"])
+
+    def record(self, endpoint_key, raw_bytes, wire_bytes, latency, success):
+        with self.lock:
+            endpoint = self._get_endpoint(endpoint_key, self.max_size)
+            endpoint["sends"] += 1
+            endpoint["seconds"] += latency
+            endpoint["error_rate"] = self._smooth(endpoint["error_rate"], 0.0 if success else 1.0)
+            if not success:
+                endpoint["failures"] += 1
+                endpoint["chunk_size"] = max(endpoint["chunk_size"] / 2.0, self.min_size)
+                return
+            endpoint["raw_bytes"] += raw_bytes
+            endpoint["latency"] = self._smooth(endpoint["latency"], latency)
+            endpoint["ratio"] = self._smooth(endpoint["ratio"], raw_bytes / float(max(wire_bytes, 1)))
+            endpoint["wire_bytes_per_second"] = self._smooth(endpoint["wire_bytes_per_second"], wire_bytes / max(latency, 0.001))
+            target_size = self.target_latency * endpoint["wire_bytes_per_second"] * endpoint["ratio"]
+            if target_size > endpoint["chunk_size"] and endpoint["error_rate"] > self.MAX_ERROR_RATE_FOR_GROWTH:
+                return
+            target_size = min(target_size, endpoint["chunk_size"] * self.MAX_GROWTH_FACTOR)
+            endpoint["chunk_size"] = max(min(self._smooth(endpoint["chunk_size"], target_size), self.max_size), self.min_size)
+
+    def get_metrics(self):
+        metrics = {}
+        with self.lock:
+            for endpoint_key, endpoint in self.endpoints.items():
+                metrics[endpoint_key] = {
+                    "chunk_size": int(endpoint["chunk_size"]),
+                    "latency": round(endpoint["latency"], 3) if endpoint["latency"] is not None else None,
+                    "error_rate": round(endpoint["error_rate"], 3),
+                    "ratio": round(endpoint["ratio"], 2) if endpoint["ratio"] is not None else None,
+                    "sends": endpoint["sends"],
+                    "failures": endpoint["failures"],
+                    "mb_per_second": round(endpoint["raw_bytes"] / (1024.0 * 1024.0) / endpoint["seconds"], 2) if endpoint["seconds"] else None,
+                }
+        return metrics
+
+    def close(self):
+        with self.lock:
+            tuned_chunk_sizes = {self._get_cache_key(endpoint_key): endpoint["chunk_size"] for endpoint_key, endpoint in self.endpoints.items()}
+        with _tuned_chunk_sizes_lock:
+            _tuned_chunk_sizes.update(tuned_chunk_sizes)
+        self.log.info(f"""Adaptive chunk sizing metrics: {self.get_metrics()}""")
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+from sumoappclient.common.logger import get_logger
+
+
+def gzip_compress(body, level):
+    # zlib releases the GIL while compressing so the chunks of a payload compress in parallel on threads
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+class PayloadCompressor:
+    """
+    Gzip compression stage of the Sumo Logic sends. The chunks of a payload are compressed on a pool of
+    COMPRESSION_WORKERS threads (or processes with COMPRESSION_EXECUTOR: process), 0 compresses them on the
+    sending thread. Processes need the shared memory of /dev/shm which AWS Lambda does not provide, threads are
+    used there instead. The compression ratio and throughput are tracked per endpoint key.
+    """
+
+    def __init__(self, config):
+        self.collection_config = config["Collection"]
+        self.log = get_logger(__name__, **config["Logging"])
+        self.level = self.collection_config.get("COMPRESSION_LEVEL", 6)
+        self.num_workers = self.collection_config.get("COMPRESSION_WORKERS", 0)
+        self.executor_type = self.collection_config.get("COMPRESSION_EXECUTOR", "thread")
+        if self.executor_type == "process" and (self.collection_config.get("ENVIRONMENT") == "aws" or not os.path.isdir("/dev/shm")):
+            self.log.warning("COMPRESSION_EXECUTOR process is not supported without /dev/shm (aws lambda), using threads")
+            self.executor_type = "thread"
+        self.executor = None
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                if self.executor_type == "process":
+                    self.executor = ProcessPoolExecutor(max_workers=self.num_workers)
+                else:
+                    self.executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="compress")
+            return self.executor
+
+    def compress(self, endpoint_key, bodies):
+        start_time = time.time()
+        if self.num_workers > 0 and len(bodies) > 1:
+            compressed_bodies = list(self._get_executor().map(gzip_compress, bodies, repeat(self.level)))
+        else:
+            compressed_bodies = [gzip_compress(body, self.level) for body in bodies]
+        self.record(endpoint_key, len(bodies), sum(len(body) for body in bodies), sum(len(body) for body in compressed_bodies), time.time() - start_time)
+        return compressed_bodies
+
+    def record(self, endpoint_key, chunks, raw_bytes, compressed_bytes, seconds):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint_key, {"chunks": 0, "raw_bytes": 0, "compressed_bytes": 0, "seconds": 0.0})
+            stats["chunks"] += chunks
+            stats["raw_bytes"] += raw_bytes
+            stats["compressed_bytes"] += compressed_bytes
+            stats["seconds"] += seconds
+
+    def get_compression_ratio(self, endpoint_key):
+        with self.lock:
+            stats = self.stats.get(endpoint_key)
+            if not stats or not stats["compressed_bytes"]:
+                return None
+            return stats["raw_bytes"] / float(stats["compressed_bytes"])
+
+    def get_metrics(self):
+        metrics = {}
+        with self.lock:
+            for endpoint_key, stats in self.stats.items():
+                metrics[endpoint_key] = dict(
+                    stats,
+                    ratio=round(stats["raw_bytes"] / float(stats["compressed_bytes"]), 2) if stats["compressed_bytes"] else None,
+                    mb_per_second=round(stats["raw_bytes"] / (1024.0 * 1024.0) / stats["seconds"], 2) if stats["seconds"] else None,
+                )
+        return metrics
+
+    def close(self):
+        self.log.info(f"""Compression metrics: {self.get_metrics()}""")
+        with self.lock:
+            self.stats = {}
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
@@ -0,0 +1,129 @@
+import threading
+import time
+
+from sumoappclient.common.logger import get_logger
+
+
+class EndpointBalancer:
+    """
+    Spreads the Sumo Logic sends of an endpoint key over all its urls, the endpoint key can be configured with a
+    list (or a comma separated string) of HTTP source urls. Each send goes to the healthy url with the least
+    outstanding requests. A url failing CIRCUIT_BREAKER_FAILURE_THRESHOLD sends in a row is taken out (circuit open)
+    for CIRCUIT_BREAKER_RESET_SECONDS, after which a single trial send (half open) decides whether it is put back.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, config):
+        self.sumo_config = config["SumoLogic"]
+        self.collection_config = config["Collection"]
+        self.log = get_logger(__name__, **config["Logging"])
+        self.failure_threshold = self.collection_config.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", 3)
+        self.reset_seconds = self.collection_config.get("CIRCUIT_BREAKER_RESET_SECONDS", 30)
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse_urls(value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = value.split(",")
+        return [url.strip() for url in value if url and url.strip()]
+
+    @classmethod
+    def get_balanced_endpoint_keys(cls, sumo_config):
+        # only the endpoint keys with several urls are balanced, a single url has nothing to fail over to
+        return [
+            endpoint_key for endpoint_key, value in sumo_config.items()
+            if isinstance(value, (str, list, tuple)) and len(cls.parse_urls(value)) > 1
+        ]
+
+    def _get_endpoints(self, endpoint_key):
+        if endpoint_key not in self.endpoints:
+            self.endpoints[endpoint_key] = [
+                {"url": url, "state": self.CLOSED, "outstanding": 0, "consecutive_failures": 0, "opened_at": None,
+                 "sent": 0, "failed": 0, "latency": None}
+                for url in self.parse_urls(self.sumo_config.get(endpoint_key))
+            ]
+        return self.endpoints[endpoint_key]
+
+    def _is_available(self, endpoint, now):
+        if endpoint["state"] == self.OPEN and now - endpoint["opened_at"] >= self.reset_seconds:
+            endpoint["state"] = self.HALF_OPEN
+        if endpoint["state"] == self.HALF_OPEN:
+            # only one trial send at a time while half open
+            return endpoint["outstanding"] == 0
+        return endpoint["state"] == self.CLOSED
+
+    def acquire(self, endpoint_key, exclude=()):
+        """
+        returns the url for the next send or None if every url is excluded or has its circuit open
+        """
+        with self.lock:
+            now = time.monotonic()
+            candidates = [
+                endpoint for endpoint in self._get_endpoints(endpoint_key)
+                if endpoint["url"] not in exclude and self._is_available(endpoint, now)
+            ]
+            if not candidates:
+                return None
+            # min keeps the configured order on ties so that an idle collector sticks to the first url
+            endpoint = min(candidates, key=lambda endpoint: endpoint["outstanding"])
+            endpoint["outstanding"] += 1
+            return endpoint["url"]
+
+    def release(self, endpoint_key, url, success, latency):
+        with self.lock:
+            endpoint = next(endpoint for endpoint in self._get_endpoints(endpoint_key) if endpoint["url"] == url)
+            endpoint["outstanding"] -= 1
+            endpoint["latency"] = latency if endpoint["latency"] is None else 0.3 * latency + 0.7 * endpoint["latency"]
+            if success:
+                endpoint["sent"] += 1
+                endpoint["consecutive_failures"] = 0
+                if endpoint["state"] != self.CLOSED:
+                    self.log.info(f"""Circuit closed for endpoint: {endpoint_key} url index: {self._get_endpoints(endpoint_key).index(endpoint)}""")
+                endpoint["state"] = self.CLOSED
+                return
+            endpoint["failed"] += 1
+            endpoint["consecutive_failures"] += 1
+            if endpoint["state"] == self.HALF_OPEN or endpoint["consecutive_failures"] >= self.failure_threshold:
+                if endpoint["state"] != self.OPEN:
+                    self.log.warning(f"""Circuit opened for endpoint: {endpoint_key} url index: {self._get_endpoints(endpoint_key).index(endpoint)} consecutive failures: {endpoint['consecutive_failures']}""")
+                endpoint["state"] = self.OPEN
+                endpoint["opened_at"] = time.monotonic()
+
+    def get_metrics(self):
+        # urls carry the source token so the metrics refer to them by position
+        with self.lock:
+            return {
+                endpoint_key: [
+                    {
+                        "state": endpoint["state"], "outstanding": endpoint["outstanding"], "sent": endpoint["sent"],
+                        "failed": endpoint["failed"],
+                        "latency": round(endpoint["latency"], 3) if endpoint["latency"] is not None else None,
+                    }
+                    for endpoint in endpoints
+                ]
+                for endpoint_key, endpoints in self.endpoints.items()
+            }
+
+    def close(self):
+        self.log.info(f"""Endpoint balancer metrics: {self.get_metrics()}""")
+
+
+def get_single_url_config(config):
+    """
+    returns the config with the first url of the endpoint keys configured with a list (or a comma separated string)
+    of urls, for the output handlers which send to a single url
+    """
+    sumo_config = config["SumoLogic"]
+    first_urls = {
+        endpoint_key: (EndpointBalancer.parse_urls(value) or [None])[0] for endpoint_key, value in sumo_config.items()
+        if isinstance(value, (list, tuple)) or (isinstance(value, str) and "," in value)
+    }
+    if not first_urls:
+        return config
+    return dict(config, SumoLogic=dict(sumo_config, **first_urls))
@@ -0,0 +1,32 @@
+from collections import OrderedDict
+
+
+class RecentIdCache:
+    """
+    Size bounded cache of recently sent ids with O(1) membership checks.
+    When the cache is full the oldest ids are evicted first, the insertion order is kept when it is
+    serialized so that the eviction order survives across invocations.
+    """
+
+    def __init__(self, max_size, ids=None):
+        self.max_size = max(int(max_size), 0)
+        self._ids = OrderedDict()
+        self.add_all(ids or [])
+
+    def __contains__(self, item_id):
+        return item_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add_all(self, ids):
+        if self.max_size == 0:
+            return
+        for item_id in ids:
+            self._ids.pop(item_id, None)
+            self._ids[item_id] = None
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def to_list(self):
+        return list(self._ids)
@@ -1,10 +1,20 @@
 import traceback
 import os
-from requests.auth import HTTPDigestAuth
+from concurrent import futures
+from contextlib import contextmanager
+from itertools import zip_longest
+from random import shuffle
 from time_and_memory_tracker import TimeAndMemoryTracker
-
-from sumoappclient.sumoclient.base import BaseCollector
-from sumoappclient.sumoclient.httputils import ClientMixin
+from async_engine import AsyncFetchEngine, AsyncFetchTaskGroup, is_async_fetch_supported
+from scheduler import LagPriorityScheduler
+from rate_limiter import get_atlas_rate_limiter
+from session_pool import get_atlas_session_pool
+from output_pool import OutputHandlerPool
+from checkpoint_store import CheckpointStore
+
+from sumoappclient.sumoclient.base import BaseCollector, ExecutionState, getProcessSize
+from sumoappclient.common.ctocstatus import SourceHealthStatus
+from sumoappclient.common.errors import AuthException, ErrorType, InValidConfigException, SendDataException, StoreException
 from sumoappclient.common.utils import get_current_timestamp
 from api import (
     ProcessMetricsAPI,
@@ -26,25 +36,107 @@ class MongoDBAtlasCollector(BaseCollector):
     SINGLE_PROCESS_LOCK_KEY = "is_mongodbatlascollector_running"
     CONFIG_FILENAME = "mongodbatlas.yaml"
     DATA_REFRESH_TIME = 60 * 60 * 1000
+    checkpoint_store = None
 
     def __init__(self):
         self.project_dir = self.get_current_dir()
         super(MongoDBAtlasCollector, self).__init__(self.project_dir)
         self.api_config = self.config["MongoDBAtlas"]
+        if self.collection_config.get("CHECKPOINT_WRITE_BEHIND", False) or self._is_preload_task_states():
+            # the single instance lock is taken on the kvstore itself, only the state reads and writes go through the store
+            self.checkpoint_store = self.kvstore = CheckpointStore(
+                self.kvstore, self.config, write_behind=self.collection_config.get("CHECKPOINT_WRITE_BEHIND", False)
+            )
 
-        self.digestauth = HTTPDigestAuth(
+        self.rate_limiter = get_atlas_rate_limiter(self.config)
+        # discovery shares the keep-alive session and the digest nonce with the tasks
+        self.session_pool = get_atlas_session_pool(self.config)
+        self.digestauth = self.session_pool.get_auth(
+            self.api_config.get("BASE_URL"),
             username=self.api_config["PUBLIC_API_KEY"],
             password=self.api_config["PRIVATE_API_KEY"],
         )
-        self.mongosess = ClientMixin.get_new_session(
-            MAX_RETRY=self.collection_config["MAX_RETRY"],
-            BACKOFF_FACTOR=self.collection_config["BACKOFF_FACTOR"],
-        )
+        self.mongosess = self.session_pool.get_session(self.api_config["BASE_URL"])
+        # tasks borrow the sumo connections from the pool instead of opening their own
+        self.output_handler_pool = OutputHandlerPool(self.config)
+        self.scheduler = None
         # removing redundant handlers since AWS Lambda also sets up a handler, on the root logger
         if self.collection_config["ENVIRONMENT"] == "aws":
             for hdlr in self.log.handlers:
                 self.log.removeHandler(hdlr)
 
+    def run(self):
+        """
+        BaseCollector.run without its shuffle of the task list, with IS_SHUFFLE_TASKS the tasks are shuffled within
+        each project and interleaved across projects in build_task_params and that order is kept.
+        """
+        has_any_error = False
+        if not self.is_another_instance_running:
+            task_params = []
+            try:
+                task_params = self.build_task_params()
+                all_futures = {}
+                current_num_workers = min(self.num_workers, len(task_params))
+                self.log.debug(f"spawning {current_num_workers} workers {getProcessSize()} for {self.COLLECTOR_PROCESS_NAME}")
+                with futures.ThreadPoolExecutor(max_workers=current_num_workers) as executor:
+                    all_futures.update({executor.submit(apiobj.fetch): apiobj for apiobj in task_params})
+
+                for future in futures.as_completed(all_futures):
+                    api_type = str(all_futures[future])
+                    try:
+                        future.result()
+                    except (AuthException, InValidConfigException) as e:
+                        # invalid config errors are not recoverable
+                        self.log.error(f'''Thread: {api_type} {repr(e)}''', exc_info=True, extra={
+                            "status": SourceHealthStatus.StatusError, "errorCode": e.error_code, "errorType": ErrorType.ERROR_CONFIG,
+                        })
+                        self.execution_state = ExecutionState.STOP
+                    except (StoreException, SendDataException) as e:
+                        self.log.error(f'''Thread: {api_type} {repr(e)}''', extra={
+                            "status": SourceHealthStatus.StatusError, "errorCode": e.error_code, "errorType": ErrorType.ERROR_FRAMEWORK,
+                        })
+                        has_any_error = True
+                    except Exception as e:
+                        self.log.error(f'''Thread: {api_type} {repr(e)}''', exc_info=True, extra={
+                            "status": SourceHealthStatus.StatusError, "errorType": ErrorType.ERROR_GENERIC,
+                        })
+                        has_any_error = True
+                    else:
+                        if self.is_first_fetch:
+                            self.log.info(f"Authentication successful for {self.COLLECTOR_PROCESS_NAME}", extra={"status": SourceHealthStatus.StatusAuthenticated})
+                            self.is_first_fetch = False
+                        self.log.info(f"Thread: {api_type} completed successfully for {self.COLLECTOR_PROCESS_NAME}")
+            except Exception as e:
+                self.log.error(f'''{repr(e)}''', exc_info=True, extra={"status": SourceHealthStatus.StatusError, "errorType": ErrorType.ERROR_GENERIC})
+                has_any_error = True
+            finally:
+                # cleaning up the api objects (sessions/connections)
+                for apiobj in task_params:
+                    apiobj.close()
+            if self.execution_state != ExecutionState.STOP:
+                if has_any_error:
+                    self.execution_state = ExecutionState.BACKOFF
+                else:
+                    self.execution_state = ExecutionState.POLLING
+                    self.log.info(f"All Threads completed successfully {getProcessSize()} for {self.COLLECTOR_PROCESS_NAME}", extra={"status": SourceHealthStatus.StatusCollecting})
+            self.stop_running()
+        else:
+            if not self.is_process_running([self.COLLECTOR_PROCESS_NAME]):
+                self.kvstore.release_lock_on_expired_key(self.SINGLE_PROCESS_LOCK_KEY)
+
+    def stop_running(self):
+        self.log.info(f'''Atlas rate limiter metrics: {self.rate_limiter.get_metrics()}''')
+        self.log.info(f'''Atlas session pool metrics: {self.session_pool.get_metrics()}''')
+        # task durations are saved before the single instance lock is released
+        if self.scheduler is not None:
+            self.scheduler.save_history()
+            self.scheduler = None
+        self.output_handler_pool.close()
+        # the checkpoints saved by the background sender on close are flushed too
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.flush()
+        return super(MongoDBAtlasCollector, self).stop_running()
+
     def get_current_dir(self):
         cur_dir = os.path.dirname(__file__)
         return cur_dir
@@ -55,9 +147,8 @@ class MongoDBAtlasCollector(BaseCollector):
 
         while True:
             page_num += 1
-            status, data = ClientMixin.make_request(
+            status, data = self.rate_limiter.make_request(
                 url,
-                method="get",
                 session=self.mongosess,
                 logger=self.log,
                 TIMEOUT=self.collection_config["TIMEOUT"],
@@ -74,6 +165,82 @@ class MongoDBAtlasCollector(BaseCollector):
 
         return all_data
 
+    def _get_project_key(self, name):
+        # keys of the configured PROJECT_ID are kept unprefixed for compatibility with the existing state
+        project_id = self.api_config["PROJECT_ID"]
+        if project_id == self.config["MongoDBAtlas"].get("PROJECT_ID"):
+            return name
+        return f"{project_id}-{name}"
+
+    def _get_project_config(self, project_id):
+        if project_id == self.config["MongoDBAtlas"].get("PROJECT_ID"):
+            return self.config
+        return dict(self.config, MongoDBAtlas=dict(self.config["MongoDBAtlas"], PROJECT_ID=project_id))
+
+    @contextmanager
+    def _project_scope(self, project_id):
+        # discovery helpers read PROJECT_ID from api_config, build_task_params runs before the workers are spawned
+        api_config, config = self.api_config, self._get_project_config(project_id)
+        self.api_config = config["MongoDBAtlas"]
+        try:
+            yield config
+        finally:
+            self.api_config = api_config
+
+    def _get_all_projects_from_organization(self):
+        url = f"{self.api_config['BASE_URL']}/orgs/{self.api_config['ORGANIZATION_ID']}/groups"
+        kwargs = {
+            "auth": self.digestauth,
+            "params": {"itemsPerPage": self.api_config["PAGINATION_LIMIT"]},
+        }
+        all_data = self.getpaginateddata(url, **kwargs)
+        return sorted({obj["id"] for data in all_data for obj in data["results"]})
+
+    def _set_project_ids(self):
+        project_ids = self._get_all_projects_from_organization()
+        self.kvstore.set(
+            "project_ids",
+            {
+                "last_set_date": get_current_timestamp(milliseconds=True),
+                "values": project_ids,
+            },
+        )
+
+    def _get_project_ids(self):
+        if self.api_config.get("DISCOVER_PROJECTS"):
+            if not self.kvstore.has_key("project_ids"):
+                self._set_project_ids()
+
+            current_timestamp = get_current_timestamp(milliseconds=True)
+            projects = self.kvstore.get("project_ids")
+            if current_timestamp - projects["last_set_date"] > self.DATA_REFRESH_TIME or (
+                len(projects["values"]) == 0
+            ):
+                self._set_project_ids()
+
+            return self.kvstore.get("project_ids")["values"]
+
+        if self.api_config.get("PROJECT_IDS"):
+            return list(dict.fromkeys(self.api_config["PROJECT_IDS"]))
+
+        return [self.api_config["PROJECT_ID"]]
+
+    def _interleave_tasks(self, task_groups):
+        # round robin across projects so that the workers do not drain one big project before starting the others
+        if self.collection_config.get("IS_SHUFFLE_TASKS", True):
+            for tasks in task_groups:
+                shuffle(tasks)
+        return [task for tasks in zip_longest(*task_groups) for task in tasks if task is not None]
+
+    def _group_async_tasks(self, tasks):
+        # single request tasks run concurrently on one event loop, paginated ones stay on the thread pool
+        async_tasks = [task for task in tasks if is_async_fetch_supported(task)]
+        if not async_tasks:
+            return tasks
+        sync_tasks = [task for task in tasks if not is_async_fetch_supported(task)]
+        self.log.info(f'''Running {len(async_tasks)} Tasks with the async fetch engine''')
+        return [AsyncFetchTaskGroup(async_tasks, AsyncFetchEngine(self.config, self.log, self.scheduler))] + sync_tasks
+
     def _get_all_databases(self, process_ids):
         database_names = []
         for process_id in process_ids:
@@ -152,7 +319,7 @@ class MongoDBAtlasCollector(BaseCollector):
     def _set_database_names(self, process_ids):
         database_names = self._get_all_databases(process_ids)
         self.kvstore.set(
-            "database_names",
+            self._get_project_key("database_names"),
             {
                 "last_set_date": get_current_timestamp(milliseconds=True),
                 "values": database_names,
@@ -162,7 +329,7 @@ class MongoDBAtlasCollector(BaseCollector):
     def _set_processes(self):
         process_ids, hostnames, cluster_mapping = self._get_all_processes_from_project()
         self.kvstore.set(
-            "processes",
+            self._get_project_key("processes"),
             {
                 "last_set_date": get_current_timestamp(milliseconds=True),
                 "process_ids": process_ids,
@@ -170,7 +337,7 @@ class MongoDBAtlasCollector(BaseCollector):
             },
         )
         self.kvstore.set(
-            "cluster_mapping",
+            self._get_project_key("cluster_mapping"),
             {
                 "last_set_date": get_current_timestamp(milliseconds=True),
                 "values": cluster_mapping,
@@ -180,7 +347,7 @@ class MongoDBAtlasCollector(BaseCollector):
     def _set_disk_names(self, process_ids):
         disks = self._get_all_disks_from_host(process_ids)
         self.kvstore.set(
-            "disk_names",
+            self._get_project_key("disk_names"),
             {
                 "last_set_date": get_current_timestamp(milliseconds=True),
                 "values": disks,
@@ -188,61 +355,59 @@ class MongoDBAtlasCollector(BaseCollector):
         )
 
     def _get_database_names(self):
-        if not self.kvstore.has_key("database_names"):
+        if not self.kvstore.has_key(self._get_project_key("database_names")):
             process_ids, _ = self._get_process_names()
             self._set_database_names(process_ids)
 
         current_timestamp = get_current_timestamp(milliseconds=True)
-        databases = self.kvstore.get("database_names")
+        databases = self.kvstore.get(self._get_project_key("database_names"))
         if current_timestamp - databases["last_set_date"] > self.DATA_REFRESH_TIME or (
             len(databases["values"]) == 0
         ):
             process_ids, _ = self._get_process_names()
             self._set_database_names(process_ids)
 
-        database_names = self.kvstore.get("database_names")["values"]
+        database_names = self.kvstore.get(self._get_project_key("database_names"))["values"]
         return database_names
 
     def _get_disk_names(self):
-        if not self.kvstore.has_key("disk_names"):
+        if not self.kvstore.has_key(self._get_project_key("disk_names")):
             process_ids, _ = self._get_process_names()
             self._set_disk_names(process_ids)
 
         current_timestamp = get_current_timestamp(milliseconds=True)
-        disks = self.kvstore.get("disk_names")
+        disks = self.kvstore.get(self._get_project_key("disk_names"))
         if current_timestamp - disks["last_set_date"] > self.DATA_REFRESH_TIME or (
             len(disks["values"]) == 0
         ):
             process_ids, _ = self._get_process_names()
             self._set_disk_names(process_ids)
 
-        disk_names = self.kvstore.get("disk_names")["values"]
+        disk_names = self.kvstore.get(self._get_project_key("disk_names"))["values"]
         return disk_names
 
     def _get_process_names(self):
-        if not self.kvstore.has_key("processes"):
+        if not self.kvstore.has_key(self._get_project_key("processes")):
             self._set_processes()
 
         current_timestamp = get_current_timestamp(milliseconds=True)
-        processes = self.kvstore.get("processes")
+        processes = self.kvstore.get(self._get_project_key("processes"))
         if current_timestamp - processes["last_set_date"] > self.DATA_REFRESH_TIME or (
             len(processes["process_ids"]) == 0
         ):
             self._set_processes()
 
-        processes = self.kvstore.get("processes")
+        processes = self.kvstore.get(self._get_project_key("processes"))
         process_ids, hostnames = processes["process_ids"], processes["hostnames"]
         return process_ids, hostnames
 
-    def build_task_params(self):
-        with TimeAndMemoryTracker(activate=self.collection_config.get("ACTIVATE_TIME_AND_MEMORY_TRACKING", False)) as tracker:
-            start_message = tracker.start("self.build_task_params")
+    def _build_project_tasks(self, config):
         audit_files = ["mongodb-audit-log.gz", "mongos-audit-log.gz"]
         dblog_files = ["mongodb.gz", "mongos.gz"]
         filenames = []
         tasks = []
         process_ids, hostnames = self._get_process_names()
-        cluster_mapping = self.kvstore.get("cluster_mapping", {}).get("values", {})
+        cluster_mapping = self.kvstore.get(self._get_project_key("cluster_mapping"), {}).get("values", {})
 
         if "LOG_TYPES" in self.api_config:
             if "DATABASE" in self.api_config["LOG_TYPES"]:
@@ -257,26 +422,23 @@ class MongoDBAtlasCollector(BaseCollector):
                             self.kvstore,
                             hostname,
                             filename,
-                            self.config,
+                            config,
                             cluster_mapping,
                         )
                     )
 
             if "EVENTS_PROJECT" in self.api_config["LOG_TYPES"]:
-                tasks.append(ProjectEventsAPI(self.kvstore, self.config))
-
-            if "EVENTS_ORG" in self.api_config["LOG_TYPES"]:
-                tasks.append(OrgEventsAPI(self.kvstore, self.config))
+                tasks.append(ProjectEventsAPI(self.kvstore, config))
 
             if "ALERTS" in self.api_config["LOG_TYPES"]:
-                tasks.append(AlertsAPI(self.kvstore, self.config))
+                tasks.append(AlertsAPI(self.kvstore, config))
 
         if "METRIC_TYPES" in self.api_config:
             if self.api_config["METRIC_TYPES"].get("PROCESS_METRICS", []):
                 for process_id in process_ids:
                     tasks.append(
                         ProcessMetricsAPI(
-                            self.kvstore, process_id, self.config, cluster_mapping
+                            self.kvstore, process_id, config, cluster_mapping
                         )
                     )
 
@@ -289,7 +451,7 @@ class MongoDBAtlasCollector(BaseCollector):
                                 self.kvstore,
                                 process_id,
                                 disk_name,
-                                self.config,
+                                config,
                                 cluster_mapping,
                             )
                         )
@@ -303,13 +465,57 @@ class MongoDBAtlasCollector(BaseCollector):
                                 self.kvstore,
                                 process_id,
                                 database_name,
-                                self.config,
+                                config,
                                 cluster_mapping,
                             )
                         )
+        return tasks
+
+    def _is_preload_task_states(self):
+        # the lag of every task is read while scheduling so the states are preloaded in bulk for it as well
+        return self.collection_config.get("PRELOAD_TASK_STATES", False) or self.collection_config.get("PRIORITISE_TASKS_BY_LAG", False)
+
+    def _preload_task_states(self, tasks):
+        # one bulk read of the task states instead of a has_key/get per task when it starts
+        keys = [task.get_key() for task in tasks]
+        if self.collection_config.get("PRIORITISE_TASKS_BY_LAG", False):
+            keys.extend(LagPriorityScheduler.get_history_keys(self.config))
+        missing_keys = set(self.checkpoint_store.preload(keys))
+        with self.checkpoint_store.deferred_writes():
+            for task in tasks:
+                if task.get_key() in missing_keys:
+                    task.init_state()
+                    missing_keys.discard(task.get_key())
 
+    def build_task_params(self):
+        with TimeAndMemoryTracker(activate=self.collection_config.get("ACTIVATE_TIME_AND_MEMORY_TRACKING", False)) as tracker:
+            start_message = tracker.start("self.build_task_params")
+        # payloads queued by the previous runs are sent before new data is fetched
+        self.output_handler_pool.replay_retry_queue()
+        task_groups = []
+        for project_id in self._get_project_ids():
+            with self._project_scope(project_id) as config:
+                task_groups.append(self._build_project_tasks(config))
+
+        # org events are collected once per organization and not per project
+        if "EVENTS_ORG" in self.api_config.get("LOG_TYPES", []):
+            task_groups.append([OrgEventsAPI(self.kvstore, self.config)])
+
+        tasks = self._interleave_tasks(task_groups)
+        for task in tasks:
+            task.output_handler_pool = self.output_handler_pool
+        if self.checkpoint_store is not None and self._is_preload_task_states():
+            self._preload_task_states(tasks)
+        if self.collection_config.get("PRIORITISE_TASKS_BY_LAG", False):
+            self.scheduler = LagPriorityScheduler(self.kvstore, self.config, self.log)
+            tasks = self.scheduler.schedule(tasks, self.collection_config.get("NUM_WORKERS", 1))
+        if self.collection_config.get("ASYNC_FETCH_ENGINE", False):
+            tasks = self._group_async_tasks(tasks)
+        # discovery state is saved before the workers start
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.flush()
         end_message = tracker.end("self.build_task_params")
-        self.log.info(f'''{len(tasks)} Tasks Generated {start_message} {end_message}''')
+        self.log.info(f'''{len(tasks)} Tasks Generated for {len(task_groups)} task groups {start_message} {end_message}''')
         if len(tasks) == 0:
             raise Exception("No tasks Generated")
         return tasks
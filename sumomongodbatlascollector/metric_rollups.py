@@ -0,0 +1,76 @@
+import re
+
+
+GRANULARITY_PATTERN = re.compile(r"^PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?$")
+
+
+def granularity_to_seconds(granularity):
+    """Converts an ISO 8601 duration used by the Atlas measurements api (PT1M, PT5M, PT1H, P1D) into seconds."""
+    if granularity == "P1D":
+        return 24 * 60 * 60
+    match = GRANULARITY_PATTERN.match(granularity or "")
+    if not match or not any(match.groups()):
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    hours, minutes, seconds = (int(group or 0) for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+class MetricRollup:
+    """
+    Rolls up the datapoints of a single measurement series into fixed size buckets in one streaming pass.
+    Only one bucket is held in memory at a time. The trailing bucket is emitted only when it is complete
+    so that the next window can re-read it instead of sending a partial aggregate, the start of the earliest
+    trailing bucket held back is kept in pending_bucket_start.
+    """
+
+    SUPPORTED_AGGREGATIONS = ("min", "max", "avg", "last")
+
+    def __init__(self, bucket_minutes, aggregations=None, granularity="PT1M"):
+        self.bucket_seconds = int(bucket_minutes) * 60
+        if self.bucket_seconds <= 0:
+            raise ValueError(f"BUCKET_MINUTES should be a positive integer got: {bucket_minutes}")
+        self.aggregations = [agg.lower() for agg in (aggregations or self.SUPPORTED_AGGREGATIONS)]
+        unsupported = set(self.aggregations) - set(self.SUPPORTED_AGGREGATIONS)
+        if unsupported:
+            raise ValueError(f"Unsupported AGGREGATIONS: {','.join(sorted(unsupported))}")
+        self.step_seconds = granularity_to_seconds(granularity)
+        self.pending_bucket_start = None
+
+    def rollup(self, datapoints, complete_before=None):
+        """
+        datapoints are (timestamp, value) tuples in ascending timestamp order.
+        yields (aggregation, value, bucket_start_timestamp, last_timestamp_in_bucket)
+        buckets ending at or before complete_before get no more datapoints and are emitted even with gaps
+        """
+        bucket_start = None
+        count = 0
+        total = minimum = maximum = last = 0.0
+        last_timestamp = 0
+        for timestamp, value in datapoints:
+            current_bucket = timestamp - timestamp % self.bucket_seconds
+            if current_bucket != bucket_start:
+                if bucket_start is not None:
+                    yield from self._emit(bucket_start, count, total, minimum, maximum, last, last_timestamp)
+                bucket_start = current_bucket
+                count = 0
+                total = 0.0
+                minimum = maximum = value
+            count += 1
+            total += value
+            minimum = min(minimum, value)
+            maximum = max(maximum, value)
+            last = value
+            last_timestamp = timestamp
+
+        if bucket_start is None:
+            return
+        bucket_end = bucket_start + self.bucket_seconds
+        if last_timestamp + self.step_seconds >= bucket_end or (complete_before is not None and bucket_end <= complete_before):
+            yield from self._emit(bucket_start, count, total, minimum, maximum, last, last_timestamp)
+        elif self.pending_bucket_start is None or bucket_start < self.pending_bucket_start:
+            self.pending_bucket_start = bucket_start
+
+    def _emit(self, bucket_start, count, total, minimum, maximum, last, last_timestamp):
+        values = {"min": minimum, "max": maximum, "avg": total / count, "last": last}
+        for aggregation in self.aggregations:
+            yield aggregation, values[aggregation], bucket_start, last_timestamp
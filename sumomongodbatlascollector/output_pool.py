@@ -0,0 +1,223 @@
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from sumoappclient.common.logger import get_logger
+from sumoappclient.sumoclient.httputils import ClientMixin
+from sumoappclient.sumoclient.outputhandlers import HTTPHandler
+from sumoappclient.sumoclient.utils import get_body
+
+from background_sender import BackgroundSender, QueuedOutputHandler
+from compression import PayloadCompressor
+from chunk_sizing import AdaptiveChunkSizer
+from endpoint_balancer import EndpointBalancer, get_single_url_config
+from outputhandlers import OutputHandlerFactory
+from retry_queue import DiskRetryQueue
+
+
+class PooledHTTPHandler(HTTPHandler):
+    """
+    HTTPHandler of the pool, payloads are split into chunks of COMPRESSION_CHUNK_BYTESIZE (before compression)
+    which are gzip compressed by the shared compression stage before they are posted. The chunks are compressed
+    together only with COMPRESSION_WORKERS, otherwise they are built, compressed and posted one at a time. With a chunk sizer the
+    chunk size is tuned per endpoint from the observed sends. With a balancer each chunk goes to the url picked
+    by the balancer and a failed chunk is sent again to the next available url of the endpoint key. send_chunks
+    stops at the first chunk which could not be sent and returns it with the chunks after it.
+    """
+
+    def setUp(self, config, compressor=None, chunk_sizer=None, balancer=None, *args, **kwargs):
+        super(PooledHTTPHandler, self).setUp(config, *args, **kwargs)
+        self.compressor = compressor or PayloadCompressor(config)
+        self.chunk_sizer = chunk_sizer
+        self.balancer = balancer
+
+    def get_chunk_size(self, endpoint_key):
+        max_payload_bytesize = self.collection_config.get("MAX_PAYLOAD_BYTESIZE", self.MaxBundleSize)
+        chunk_size = min(self.collection_config.get("COMPRESSION_CHUNK_BYTESIZE") or max_payload_bytesize, max_payload_bytesize)
+        if self.chunk_sizer is not None:
+            chunk_size = self.chunk_sizer.get_chunk_size(endpoint_key, chunk_size)
+        return chunk_size
+
+    def post(self, endpoint_key, body, headers):
+        fetch_success, respjson, status_code, tried_urls = False, f"no available url for {endpoint_key}", None, []
+        while True:
+            if self.balancer is not None:
+                url = self.balancer.acquire(endpoint_key, exclude=tried_urls)
+            else:
+                url = None if tried_urls else self.sumo_config[endpoint_key]
+            if url is None:
+                return fetch_success, respjson, status_code
+            start_time = time.time()
+            fetch_success, respjson, status_code = ClientMixin.make_request_with_status(
+                url, method="post", session=self.sumosession, data=body,
+                TIMEOUT=self.collection_config["TIMEOUT"], headers=headers, logger=self.log
+            )
+            latency = time.time() - start_time
+            if self.balancer is not None:
+                self.balancer.release(endpoint_key, url, fetch_success, latency)
+            if fetch_success:
+                return fetch_success, respjson, status_code
+            tried_urls.append(url)
+
+    def send(self, data, extra_headers=None, jsondump=True, endpoint_key="SUMO_ENDPOINT", **kwargs):
+        return not self.send_chunks(data, extra_headers=extra_headers, jsondump=jsondump, endpoint_key=endpoint_key, **kwargs)
+
+    def send_chunks(self, data, extra_headers=None, jsondump=True, endpoint_key="SUMO_ENDPOINT", **kwargs):
+        """
+        returns the chunks (lists of records) which were not sent, an empty list once everything is sent
+        """
+        if not data:
+            return []
+        headers = {
+            "content-type": "application/json",
+            "accept": "application/json",
+            "X-Sumo-Client": self.deploy_config["PACKAGENAME"]
+        }
+        if extra_headers:
+            headers.update(extra_headers)
+
+        is_compressed = self.collection_config.get("COMPRESSED", True)
+        if is_compressed:
+            headers.update({"Content-Encoding": "gzip"})
+        batches = self.bytesize_chunking(data, self.get_chunk_size(endpoint_key), jsondump)
+        if not (is_compressed and self.compressor.num_workers > 0):
+            # without compression workers a single chunk is encoded (and compressed) at a time
+            for idx, batch in enumerate(batches, start=1):
+                body = get_body(batch, jsondump).encode("utf-8")
+                raw_size = len(body)
+                if is_compressed:
+                    body = self.compressor.compress(endpoint_key, [body])[0]
+                if not self._post_chunk(endpoint_key, idx, raw_size, body, headers):
+                    return [batch] + list(batches)
+            return []
+
+        batches = list(batches)
+        bodies = [get_body(batch, jsondump).encode("utf-8") for batch in batches]
+        raw_sizes = [len(body) for body in bodies]
+        bodies = self.compressor.compress(endpoint_key, bodies)
+        for idx, (raw_size, body) in enumerate(zip(raw_sizes, bodies), start=1):
+            if not self._post_chunk(endpoint_key, idx, raw_size, body, headers):
+                return batches[idx - 1:]
+        return []
+
+    def _post_chunk(self, endpoint_key, idx, raw_size, body, headers):
+        self.log.debug(f"""Sending batch {idx} len: {len(body)}""")
+        start_time = time.time()
+        fetch_success, respjson, status_code = self.post(endpoint_key, body, headers)
+        if self.chunk_sizer is not None:
+            self.chunk_sizer.record(endpoint_key, raw_size, len(body), time.time() - start_time, fetch_success)
+        if not fetch_success:
+            self.log.error(f"""Error in Sending to Sumo {respjson} status_code: {status_code}""")
+        return fetch_success
+
+
+class PooledOutputHandler:
+    """
+    Output handler borrowed by a task, sends go to the shared handler of the endpoint key.
+    close is a no-op since the connections are owned by the pool.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def send(self, data, *args, endpoint_key="SUMO_ENDPOINT", **kwargs):
+        return self.pool.send(data, *args, endpoint_key=endpoint_key, **kwargs)
+
+    def close(self):
+        pass
+
+
+class OutputHandlerPool:
+    """
+    Collector scoped output handlers, one per endpoint key (HTTP_LOGS_ENDPOINT, HTTP_METRICS_ENDPOINT), which are
+    shared by all the tasks so that the connections to Sumo Logic are kept alive across tasks. The handlers are
+    created on first use and closed when the collector stops. Only the HTTP and FILE_SINK handlers are pooled,
+    other output handlers are created per task as before. With BACKGROUND_SEND the payloads are sent by the background sender
+    and with RETRY_QUEUE_ENABLED the payloads Sumo Logic does not accept are queued on disk and sent again at
+    the start of the next run. The sends of an endpoint key configured with several urls are spread over them by
+    the endpoint balancer, the handlers themselves are given the first url of every endpoint key.
+    """
+
+    POOLED_HANDLER_TYPES = ("HTTP", "FILE_SINK")
+
+    def __init__(self, config):
+        self.config = config
+        self.collection_config = config["Collection"]
+        self.log = get_logger(__name__, **config["Logging"])
+        self.handler_type = self.collection_config["OUTPUT_HANDLER"]
+        self.pool_size = self.collection_config.get("SUMO_CONNECTION_POOL_SIZE", 10)
+        self.handlers = {}
+        self.lock = threading.Lock()
+        self.compressor = PayloadCompressor(config)
+        self.chunk_sizer = AdaptiveChunkSizer(config) if self.collection_config.get("ADAPTIVE_CHUNK_SIZING", False) else None
+        self.handler_config = get_single_url_config(config)
+        self.balanced_endpoint_keys = EndpointBalancer.get_balanced_endpoint_keys(config["SumoLogic"])
+        self.balancer = EndpointBalancer(config) if self.balanced_endpoint_keys else None
+        self.sender = None
+        self.retry_queue = None
+        if self.handler_type in self.POOLED_HANDLER_TYPES and self.collection_config.get("RETRY_QUEUE_ENABLED", False):
+            if self.collection_config.get("ENVIRONMENT") == "aws" and not self.collection_config.get("RETRY_QUEUE_DIR"):
+                # the lambda filesystem is read only apart from /tmp which does not outlive the execution environment
+                self.log.warning("RETRY_QUEUE_ENABLED is ignored on aws without RETRY_QUEUE_DIR set to a durable mount (EFS)")
+            else:
+                self.retry_queue = DiskRetryQueue(config)
+        if self.handler_type in self.POOLED_HANDLER_TYPES and self.collection_config.get("BACKGROUND_SEND", False):
+            self.sender = BackgroundSender(self.send, config)
+
+    def get_handler(self, path=None):
+        if self.handler_type not in self.POOLED_HANDLER_TYPES:
+            return OutputHandlerFactory.get_handler(self.handler_type, path=path, config=self.handler_config)
+        if self.sender is not None:
+            return QueuedOutputHandler(self.sender)
+        return PooledOutputHandler(self)
+
+    def get_endpoint_handler(self, endpoint_key):
+        with self.lock:
+            if endpoint_key not in self.handlers and self.handler_type != "HTTP":
+                # handlers writing locally are thread safe and only have to be shared
+                self.handlers[endpoint_key] = OutputHandlerFactory.get_handler(self.handler_type, config=self.handler_config)
+            if endpoint_key not in self.handlers:
+                balancer = self.balancer if endpoint_key in self.balanced_endpoint_keys else None
+                handler = PooledHTTPHandler(self.handler_config, compressor=self.compressor, chunk_sizer=self.chunk_sizer, balancer=balancer)
+                # the default adapter keeps 10 connections, enough for one task but not for all the workers
+                for prefix, adapter in list(handler.sumosession.adapters.items()):
+                    handler.sumosession.mount(prefix, HTTPAdapter(max_retries=adapter.max_retries, pool_maxsize=self.pool_size))
+                self.handlers[endpoint_key] = handler
+            return self.handlers[endpoint_key]
+
+    def send_to_endpoint(self, data, *args, endpoint_key="SUMO_ENDPOINT", **kwargs):
+        # HTTPHandler.send keeps no state between calls and the session is safe to share between threads
+        return self.get_endpoint_handler(endpoint_key).send(data, *args, endpoint_key=endpoint_key, **kwargs)
+
+    def send(self, data, *args, endpoint_key="SUMO_ENDPOINT", **kwargs):
+        if self.retry_queue is None or args:
+            return self.send_to_endpoint(data, *args, endpoint_key=endpoint_key, **kwargs)
+        handler = self.get_endpoint_handler(endpoint_key)
+        if isinstance(handler, PooledHTTPHandler):
+            # only the chunks Sumo Logic did not accept are queued so that the replay does not send duplicates
+            unsent_chunks = handler.send_chunks(data, endpoint_key=endpoint_key, **kwargs)
+        else:
+            unsent_chunks = [] if handler.send(data, endpoint_key=endpoint_key, **kwargs) else [data]
+        # the payload counts as sent once it is durably queued so that the task checkpoint moves on
+        return all([self.retry_queue.append(chunk, dict(kwargs, endpoint_key=endpoint_key)) for chunk in unsent_chunks])
+
+    def replay_retry_queue(self):
+        if self.retry_queue is None:
+            return True
+        return self.retry_queue.replay(self.send_to_endpoint)
+
+    def close(self):
+        # pending payloads are sent and their checkpoints saved before the connections are closed
+        if self.sender is not None:
+            self.sender.close()
+        if self.retry_queue is not None:
+            self.retry_queue.close()
+        with self.lock:
+            for handler in self.handlers.values():
+                handler.close()
+            self.handlers = {}
+        self.compressor.close()
+        if self.chunk_sizer is not None:
+            self.chunk_sizer.close()
+        if self.balancer is not None:
+            self.balancer.close()
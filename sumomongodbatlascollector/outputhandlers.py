@@ -0,0 +1,115 @@
+import gzip
+import itertools
+import os
+import threading
+import time
+
+from sumoappclient.common.utils import get_normalized_path
+from sumoappclient.sumoclient.base import BaseOutputHandler
+from sumoappclient.sumoclient.factory import OutputHandlerFactory as BaseOutputHandlerFactory
+from sumoappclient.sumoclient.utils import get_body
+
+
+class FileSinkHandler(BaseOutputHandler):
+    """
+    Writes the payloads to local files instead of Sumo Logic, for measuring the fetch and transform pipeline
+    without an endpoint and for air-gapped runs. Each endpoint key gets its own file which is rotated after
+    FILE_SINK_MAX_FILE_BYTES, writes are buffered in memory and flushed FILE_SINK_BUFFER_BYTES at a time and with
+    FILE_SINK_COMPRESSED the files are gzip compressed. The byte and record counts and the write throughput are
+    tracked per file.
+    """
+
+    file_counter = itertools.count()
+
+    def setUp(self, config, *args, **kwargs):
+        self.collection_config = config["Collection"]
+        default_dir = os.path.join(self.collection_config.get("DB_DIR") or "~/sumo", "file_sink")
+        self.sink_dir = get_normalized_path(self.collection_config.get("FILE_SINK_DIR") or default_dir)
+        self.max_file_bytes = self.collection_config.get("FILE_SINK_MAX_FILE_BYTES", 64 * 1024 * 1024)
+        self.buffer_bytes = self.collection_config.get("FILE_SINK_BUFFER_BYTES", 4 * 1024 * 1024)
+        self.compressed = self.collection_config.get("FILE_SINK_COMPRESSED", False)
+        self.compression_level = self.collection_config.get("COMPRESSION_LEVEL", 6)
+        self.files = {}
+        self.closed_files = []
+        self.lock = threading.Lock()
+        os.makedirs(self.sink_dir, exist_ok=True)
+
+    def _open_file(self, endpoint_key):
+        suffix = ".log.gz" if self.compressed else ".log"
+        # the counter keeps the names unique across the handlers of the same process
+        path = os.path.join(self.sink_dir, f"{endpoint_key.lower()}-{time.time_ns():020d}-{os.getpid()}-{next(self.file_counter)}{suffix}")
+        fp = gzip.open(path, "wb", compresslevel=self.compression_level) if self.compressed else open(path, "wb")
+        self.log.debug(f"""Opened sink file: {path}""")
+        return {"path": path, "fp": fp, "buffer": [], "buffered_bytes": 0, "bytes": 0, "records": 0, "write_seconds": 0.0}
+
+    def _flush_buffer(self, sink_file):
+        if not sink_file["buffer"]:
+            return
+        start_time = time.time()
+        sink_file["fp"].write(b"".join(sink_file["buffer"]))
+        sink_file["write_seconds"] += time.time() - start_time
+        sink_file["buffer"], sink_file["buffered_bytes"] = [], 0
+
+    def _close_file(self, endpoint_key):
+        sink_file = self.files.pop(endpoint_key)
+        self._flush_buffer(sink_file)
+        start_time = time.time()
+        sink_file["fp"].close()
+        sink_file["write_seconds"] += time.time() - start_time
+        self.closed_files.append(self._get_file_metrics(sink_file))
+
+    def send(self, data, extra_headers=None, jsondump=True, endpoint_key="SUMO_ENDPOINT", **kwargs):
+        if not data:
+            return True
+        body = (get_body(data, jsondump) + "\n").encode("utf-8")
+        with self.lock:
+            if endpoint_key in self.files and self.files[endpoint_key]["bytes"] + len(body) > self.max_file_bytes:
+                self._close_file(endpoint_key)
+            if endpoint_key not in self.files:
+                self.files[endpoint_key] = self._open_file(endpoint_key)
+            sink_file = self.files[endpoint_key]
+            sink_file["buffer"].append(body)
+            sink_file["buffered_bytes"] += len(body)
+            sink_file["bytes"] += len(body)
+            sink_file["records"] += len(data) if isinstance(data, list) else 1
+            if sink_file["buffered_bytes"] >= self.buffer_bytes:
+                self._flush_buffer(sink_file)
+        return True
+
+    @staticmethod
+    def _get_file_metrics(sink_file):
+        return {
+            "path": sink_file["path"],
+            "bytes": sink_file["bytes"],
+            "records": sink_file["records"],
+            "mb_per_second": round(sink_file["bytes"] / (1024.0 * 1024.0) / sink_file["write_seconds"], 2) if sink_file["write_seconds"] else None,
+        }
+
+    def get_metrics(self):
+        with self.lock:
+            return self.closed_files + [self._get_file_metrics(sink_file) for sink_file in self.files.values()]
+
+    def close(self):
+        with self.lock:
+            for endpoint_key in list(self.files):
+                self._close_file(endpoint_key)
+            metrics, self.closed_files = self.closed_files, []
+        self.log.info(f"""File sink metrics: {metrics}""")
+
+
+class OutputHandlerFactory(BaseOutputHandlerFactory):
+    """
+    Adds the output handlers of this package to the ones of sumoappclient, which only loads the handlers of
+    its own package.
+    """
+
+    collector_handlers = {
+        "FILE_SINK": "outputhandlers.FileSinkHandler",
+    }
+
+    @classmethod
+    def get_handler(cls, handler_type, *args, **kwargs):
+        if handler_type in cls.collector_handlers:
+            module_class = cls.load_class(cls.collector_handlers[handler_type], __name__)
+            return module_class(*args, **kwargs)
+        return super(OutputHandlerFactory, cls).get_handler(handler_type, *args, **kwargs)
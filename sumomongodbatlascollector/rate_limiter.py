@@ -0,0 +1,203 @@
+import re
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from sumoappclient.sumoclient.httputils import ClientMixin
+
+
+# Atlas enforces the limits per project and per organization
+SCOPE_PATTERN = re.compile(r"/(groups|orgs)/([^/?]+)")
+
+
+def parse_retry_after(value):
+    """Returns the Retry-After header (delay seconds or http date) in seconds, None if it is missing or invalid."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket with an adaptive rate (requests per second), rate None means unlimited until the first 429.
+    Tokens are reserved so concurrent callers queue up behind each other instead of waking up together.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.decreased_at = 0.0
+        self.request_times = deque()
+
+    def get_observed_rate(self, now, window):
+        while self.request_times and now - self.request_times[0] > window:
+            self.request_times.popleft()
+        if not self.request_times:
+            return None
+        return len(self.request_times) / max(now - self.request_times[0], 1.0)
+
+    def reserve(self, now, max_rate, increase_per_second, window):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.request_times.append(now)
+        wait = max(self.blocked_until - now, 0)
+        if self.rate is None:
+            return wait
+        # additive increase while no 429 is received
+        self.rate = min(self.rate + increase_per_second * elapsed, max_rate or float("inf"))
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate) - 1
+        if self.tokens < 0:
+            wait = max(wait, -self.tokens / self.rate)
+        return wait
+
+    def throttle(self, now, retry_after, min_rate, window):
+        # multiplicative decrease, once per second so that the 429s of concurrent requests count as one signal
+        if now - self.decreased_at >= 1:
+            current_rate = self.rate or self.get_observed_rate(now, window) or min_rate
+            self.rate = max(current_rate / 2.0, min_rate)
+            self.tokens = min(self.tokens, 0)
+            self.decreased_at = now
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+class AtlasRateLimiter:
+    """
+    Process wide limiter which every Atlas api call goes through. Each project and organization gets its own
+    bucket, the rate adapts to the 429 responses (halved on throttling, increased linearly otherwise) and the
+    Retry-After header pauses the bucket. Wait times are tracked for the run summary.
+    """
+
+    OBSERVATION_WINDOW_SECONDS = 60
+
+    def __init__(self, config):
+        collection_config = config["Collection"]
+        self.max_rate = collection_config.get("ATLAS_MAX_REQUESTS_PER_SECOND") or None
+        self.min_rate = collection_config.get("ATLAS_MIN_REQUESTS_PER_SECOND", 0.1)
+        self.increase_per_second = collection_config.get("ATLAS_RATE_INCREASE_PER_SECOND", 0.02)
+        self.burst = collection_config.get("ATLAS_RATE_LIMIT_BURST", 10)
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self.metrics = {"requests": 0, "throttled": 0, "waits": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    @staticmethod
+    def get_scope(url):
+        match = SCOPE_PATTERN.search(url or "")
+        return f"{match.group(1)}/{match.group(2)}" if match else "global"
+
+    def _get_bucket(self, scope):
+        if scope not in self.buckets:
+            self.buckets[scope] = TokenBucket(self.max_rate, self.burst)
+        return self.buckets[scope]
+
+    def reserve(self, url):
+        """Reserves a request slot and returns the seconds the caller has to wait before sending it."""
+        with self.lock:
+            bucket = self._get_bucket(self.get_scope(url))
+            wait = bucket.reserve(time.monotonic(), self.max_rate, self.increase_per_second, self.OBSERVATION_WINDOW_SECONDS)
+            self.metrics["requests"] += 1
+            if wait > 0:
+                self.metrics["waits"] += 1
+                self.metrics["total_wait_seconds"] += wait
+                self.metrics["max_wait_seconds"] = max(self.metrics["max_wait_seconds"], wait)
+        return wait
+
+    def acquire(self, url):
+        wait = self.reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttle(self, url, retry_after=None):
+        with self.lock:
+            self._get_bucket(self.get_scope(url)).throttle(time.monotonic(), retry_after, self.min_rate, self.OBSERVATION_WINDOW_SECONDS)
+            self.metrics["throttled"] += 1
+        self._local.throttled = True
+
+    def observe_response(self, resp, *args, **kwargs):
+        if resp.status_code == 429:
+            self.throttle(resp.url, parse_retry_after(resp.headers.get("Retry-After")))
+
+    def get_session(self, MAX_RETRY=3, BACKOFF_FACTOR=0.1, pool_maxsize=10):
+        # 429 is not retried by urllib3, make_request retries it after the limiter wait
+        sess = requests.Session()
+        status_forcelist = [code for code in ClientMixin.RETRIED_STATUS_CODES if code != 429]
+        if hasattr(Retry.DEFAULT, "allowed_methods"):
+            retries = Retry(total=MAX_RETRY, backoff_factor=BACKOFF_FACTOR, status_forcelist=status_forcelist,
+                            allowed_methods=ClientMixin.METHOD_TO_RETRY)
+        else:
+            retries = Retry(total=MAX_RETRY, backoff_factor=BACKOFF_FACTOR, status_forcelist=status_forcelist,
+                            method_whitelist=ClientMixin.METHOD_TO_RETRY)
+        sess.mount("https://", HTTPAdapter(max_retries=retries, pool_maxsize=pool_maxsize))
+        sess.mount("http://", HTTPAdapter(max_retries=retries, pool_maxsize=pool_maxsize))
+        sess.hooks["response"].append(self.observe_response)
+        return sess
+
+    def make_request(self, url, session=None, logger=None, TIMEOUT=5, MAX_RETRY=3, BACKOFF_FACTOR=0.1, **kwargs):
+        sess = session if session else self.get_session(MAX_RETRY, BACKOFF_FACTOR)
+        try:
+            for attempt in range(MAX_RETRY + 1):
+                self.acquire(url)
+                self._local.throttled = False
+                fetch_success, data = ClientMixin.make_request(
+                    url,
+                    method="get",
+                    session=sess,
+                    logger=logger,
+                    TIMEOUT=TIMEOUT,
+                    MAX_RETRY=MAX_RETRY,
+                    BACKOFF_FACTOR=BACKOFF_FACTOR,
+                    **kwargs,
+                )
+                if not self._local.throttled:
+                    break
+                if logger:
+                    logger.warning(f"""Throttled by Atlas url: {url} attempt: {attempt + 1}""")
+            return fetch_success, data
+        finally:
+            if not session:
+                sess.close()
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+            metrics["rates"] = {scope: bucket.rate for scope, bucket in self.buckets.items()}
+        return metrics
+
+
+_rate_limiters = {}
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter_key(config):
+    collection_config = config["Collection"]
+    return (
+        collection_config.get("ATLAS_MAX_REQUESTS_PER_SECOND") or None,
+        collection_config.get("ATLAS_MIN_REQUESTS_PER_SECOND", 0.1),
+        collection_config.get("ATLAS_RATE_INCREASE_PER_SECOND", 0.02),
+        collection_config.get("ATLAS_RATE_LIMIT_BURST", 10),
+    )
+
+
+def get_atlas_rate_limiter(config):
+    # one limiter per rate settings so that a config with other limits does not get the limiter of the first one
+    key = get_rate_limiter_key(config)
+    with _rate_limiter_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = AtlasRateLimiter(config)
+        return _rate_limiters[key]
@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+from sumoappclient.common.logger import get_logger
+from sumoappclient.common.utils import get_normalized_path
+
+
+class DiskRetryQueue:
+    """
+    Durable queue of the payloads Sumo Logic did not accept. Records are appended as json lines to segment files
+    of up to RETRY_QUEUE_SEGMENT_BYTES, each record carries a crc32 of its payload so that torn or corrupted
+    records are skipped on replay. The queue is replayed oldest segment first at the start of every run, records
+    older than RETRY_QUEUE_MAX_AGE_SECONDS are dropped and the oldest segments are evicted once the queue grows
+    over RETRY_QUEUE_MAX_BYTES. The queue directory is created with the first queued payload.
+    """
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".jsonl"
+
+    def __init__(self, config):
+        self.collection_config = config["Collection"]
+        self.log = get_logger(__name__, **config["Logging"])
+        default_dir = os.path.join(self.collection_config.get("DB_DIR") or "~/sumo", "retry_queue")
+        self.queue_dir = get_normalized_path(self.collection_config.get("RETRY_QUEUE_DIR") or default_dir)
+        self.max_bytes = self.collection_config.get("RETRY_QUEUE_MAX_BYTES", 256 * 1024 * 1024)
+        self.max_age_seconds = self.collection_config.get("RETRY_QUEUE_MAX_AGE_SECONDS", 24 * 60 * 60)
+        self.segment_bytes = self.collection_config.get("RETRY_QUEUE_SEGMENT_BYTES", 8 * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.active_segment = None
+        self.metrics = {"queued": 0, "replayed": 0, "expired": 0, "corrupted": 0, "evicted_segments": 0}
+
+    @staticmethod
+    def get_checksum(body):
+        return zlib.crc32(body.encode("utf-8")) & 0xFFFFFFFF
+
+    def get_segments(self):
+        # segment names start with the creation time in nanoseconds so the name order is the age order
+        if not os.path.isdir(self.queue_dir):
+            return []
+        return sorted(
+            os.path.join(self.queue_dir, filename) for filename in os.listdir(self.queue_dir)
+            if filename.startswith(self.SEGMENT_PREFIX) and filename.endswith(self.SEGMENT_SUFFIX)
+        )
+
+    def get_size(self):
+        return sum(os.path.getsize(segment) for segment in self.get_segments())
+
+    def _new_segment_path(self):
+        return os.path.join(self.queue_dir, f"{self.SEGMENT_PREFIX}{time.time_ns():020d}{self.SEGMENT_SUFFIX}")
+
+    def _evict_segments(self, incoming_bytes):
+        segments = self.get_segments()
+        size = sum(os.path.getsize(segment) for segment in segments)
+        while segments and size + incoming_bytes > self.max_bytes:
+            segment = segments.pop(0)
+            size -= os.path.getsize(segment)
+            os.remove(segment)
+            if segment == self.active_segment:
+                self.active_segment = None
+            self.metrics["evicted_segments"] += 1
+            self.log.warning(f"""Retry queue is over {self.max_bytes} bytes, evicted oldest segment: {segment}""")
+
+    def append(self, data, send_kwargs):
+        """
+        returns True once the payload is durably queued
+        """
+        body = json.dumps({"data": data, "send_kwargs": send_kwargs}, ensure_ascii=False)
+        record = json.dumps({"created": time.time(), "crc32": self.get_checksum(body), "body": body}, ensure_ascii=False) + "\n"
+        record_bytes = len(record.encode("utf-8"))
+        try:
+            with self.lock:
+                os.makedirs(self.queue_dir, exist_ok=True)
+                self._evict_segments(record_bytes)
+                if self.active_segment is None or not os.path.exists(self.active_segment) \
+                        or os.path.getsize(self.active_segment) + record_bytes > self.segment_bytes:
+                    self.active_segment = self._new_segment_path()
+                with open(self.active_segment, "a", encoding="utf-8") as fp:
+                    fp.write(record)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                self.metrics["queued"] += 1
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            self.log.error(f"""Unable to queue payload for retry endpoint: {send_kwargs.get('endpoint_key')} reason: {repr(e)}""")
+            return False
+
+    def _read_records(self, segment):
+        records = []
+        with open(segment, "r", encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                    if record["crc32"] != self.get_checksum(record["body"]):
+                        raise ValueError("checksum mismatch")
+                    records.append(record)
+                except (KeyError, TypeError, ValueError) as e:
+                    self.metrics["corrupted"] += 1
+                    self.log.warning(f"""Skipping corrupted retry queue record segment: {segment} reason: {repr(e)}""")
+        return records
+
+    def replay(self, send):
+        """
+        Sends the queued payloads with send(data, **send_kwargs) in the order they were queued. Replay stops at
+        the first failed send and the remaining records are kept for the next run.
+        """
+        with self.lock:
+            # new records go to a new segment so that the replayed ones can be removed
+            self.active_segment = None
+            now = time.time()
+            for segment in self.get_segments():
+                records = self._read_records(segment)
+                for idx, record in enumerate(records):
+                    if now - record["created"] > self.max_age_seconds:
+                        self.metrics["expired"] += 1
+                        continue
+                    payload = json.loads(record["body"])
+                    if not send(payload["data"], **payload["send_kwargs"]):
+                        self._rewrite_segment(segment, records[idx:])
+                        self.log.warning(f"""Retry queue replay stopped at segment: {segment} remaining records: {len(records) - idx}""")
+                        return False
+                    self.metrics["replayed"] += 1
+                os.remove(segment)
+            return True
+
+    def _rewrite_segment(self, segment, records):
+        tmp_path = f"{segment}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            for record in records:
+                fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, segment)
+
+    def close(self):
+        with self.lock:
+            self.active_segment = None
+        self.log.info(f"""Retry queue metrics: {self.metrics} size: {self.get_size()}""")
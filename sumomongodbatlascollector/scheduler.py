@@ -0,0 +1,128 @@
+import threading
+import time
+import zlib
+
+from sumoappclient.common.utils import get_current_timestamp
+
+
+class TimedTask:
+    """
+    Delegates to the wrapped task and records the duration of its fetch in the scheduler history.
+    """
+
+    def __init__(self, task, scheduler):
+        self.task = task
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        return getattr(self.task, name)
+
+    def __str__(self):
+        return str(self.task)
+
+    def fetch(self):
+        start_time = time.time()
+        try:
+            return self.task.fetch()
+        finally:
+            self.scheduler.record_duration(self.task.get_key(), time.time() - start_time)
+
+
+class LagPriorityScheduler:
+    """
+    Orders the tasks of an invocation by lag (now - last_time_epoch of the task state) times the priority weight
+    of the task log type, per second of the task duration estimated from the previous runs. Tasks are packed
+    greedily into the invocation budget of all the workers, the ones not expected to fit are kept at the end.
+
+    The durations are kept in TASK_HISTORY_SHARDS kvstore items by hash of the task key, each capped to the
+    MAX_ENTRIES_PER_SHARD most recently run tasks so that an item stays well under the DynamoDB item size limit.
+    """
+
+    HISTORY_KEY = "task_durations"
+    HISTORY_RETENTION_SECONDS = 7 * 24 * 60 * 60
+    MAX_ENTRIES_PER_SHARD = 1000
+    SMOOTHING_FACTOR = 0.3
+
+    def __init__(self, kvstore, config, logger):
+        self.kvstore = kvstore
+        self.collection_config = config["Collection"]
+        self.log = logger
+        self.priority_weights = self.collection_config.get("TASK_PRIORITY_WEIGHTS") or {}
+        self.default_duration = self.collection_config.get("DEFAULT_TASK_DURATION_SECONDS", 10)
+        self.num_shards = max(int(self.collection_config.get("TASK_HISTORY_SHARDS", 16)), 1)
+        self.history = {}
+        for history_key in self.get_history_keys(config):
+            self.history.update(self.kvstore.get(history_key, {}) or {})
+        self.changed_shards = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_history_keys(cls, config):
+        num_shards = max(int(config["Collection"].get("TASK_HISTORY_SHARDS", 16)), 1)
+        return [f"{cls.HISTORY_KEY}_{shard}" for shard in range(num_shards)]
+
+    def get_shard(self, task_key):
+        # crc32 and not hash since the shard of a key has to be the same across processes
+        return zlib.crc32(task_key.encode("utf-8")) % self.num_shards
+
+    def get_estimated_duration(self, task_key):
+        return self.history.get(task_key, {}).get("duration", self.default_duration)
+
+    def get_priority_weight(self, task):
+        return self.priority_weights.get(getattr(task, "log_type", None), 1)
+
+    def get_lag(self, task, now):
+        state = self.kvstore.get(task.get_key(), {}) or {}
+        last_time_epoch = state.get("last_time_epoch")
+        if last_time_epoch is None:
+            # tasks without a time based checkpoint (alerts) lag by the time since their last run
+            last_time_epoch = self.history.get(task.get_key(), {}).get("last_run", task.DEFAULT_START_TIME_EPOCH)
+        return max(now - last_time_epoch, 0)
+
+    def schedule(self, tasks, num_workers):
+        if not tasks:
+            return tasks
+        now = get_current_timestamp()
+        budget = (tasks[0].get_function_timeout() - tasks[0].STOP_TIME_OFFSET_SECONDS) * max(num_workers, 1)
+        scored_tasks = []
+        for task in tasks:
+            duration = max(self.get_estimated_duration(task.get_key()), 0.1)
+            priority = self.get_lag(task, now) * self.get_priority_weight(task)
+            scored_tasks.append((priority / duration, duration, task))
+        # sorted is stable so tasks with the same score keep the interleaved order
+        scored_tasks.sort(key=lambda scored_task: scored_task[0], reverse=True)
+
+        scheduled_tasks, deferred_tasks = [], []
+        used_budget = 0
+        for _, duration, task in scored_tasks:
+            if used_budget + duration <= budget:
+                used_budget += duration
+                scheduled_tasks.append(TimedTask(task, self))
+            else:
+                deferred_tasks.append(TimedTask(task, self))
+        self.log.info(f"""Scheduled {len(scheduled_tasks)} Tasks in budget: {budget} estimated: {used_budget:.1f} deferred: {len(deferred_tasks)}""")
+        return scheduled_tasks + deferred_tasks
+
+    def record_duration(self, task_key, duration):
+        with self.lock:
+            previous = self.history.get(task_key, {}).get("duration")
+            if previous is not None:
+                duration = self.SMOOTHING_FACTOR * duration + (1 - self.SMOOTHING_FACTOR) * previous
+            self.history[task_key] = {"duration": round(duration, 3), "last_run": get_current_timestamp()}
+            self.changed_shards.add(self.get_shard(task_key))
+
+    def save_history(self):
+        # only the shards with a task run in this invocation are written
+        now = get_current_timestamp()
+        with self.lock:
+            shards = {shard: {} for shard in self.changed_shards}
+            for task_key, entry in self.history.items():
+                shard = self.get_shard(task_key)
+                if shard in shards and now - entry.get("last_run", now) <= self.HISTORY_RETENTION_SECONDS:
+                    shards[shard][task_key] = entry
+            for shard, entries in shards.items():
+                if len(entries) > self.MAX_ENTRIES_PER_SHARD:
+                    recent_keys = sorted(entries, key=lambda task_key: entries[task_key].get("last_run", 0), reverse=True)
+                    entries = {task_key: entries[task_key] for task_key in recent_keys[:self.MAX_ENTRIES_PER_SHARD]}
+                self.kvstore.set(f"{self.HISTORY_KEY}_{shard}", entries)
+            self.changed_shards.clear()
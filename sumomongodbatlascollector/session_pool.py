@@ -0,0 +1,216 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from functools import partial
+from urllib.parse import urlparse
+
+from requests.auth import AuthBase
+from requests.cookies import RequestsCookieJar, extract_cookies_to_jar, get_cookie_header
+from requests.utils import parse_dict_header
+
+from rate_limiter import get_atlas_rate_limiter, get_rate_limiter_key
+
+
+class SharedDigestAuth(AuthBase):
+    """
+    Digest auth (RFC 2617, qop auth) whose challenge (nonce) is shared by all the threads. HTTPDigestAuth keeps
+    the challenge per thread so every worker and every task pays the 401 round trip, here the nonce is reused
+    with an increasing nc across requests and a new challenge is only answered when Atlas rejects (expires) the
+    nonce. The challenge and the nonce count are owned by this class and only changed under its lock.
+    """
+
+    HASH_FUNCTIONS = {
+        "MD5": hashlib.md5,
+        "MD5-SESS": hashlib.md5,
+        "SHA": hashlib.sha1,
+        "SHA-256": hashlib.sha256,
+        "SHA-512": hashlib.sha512,
+    }
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.lock = threading.Lock()
+        self.challenges = 0
+        self.last_nonce = ""
+        self.nonce_count = 0
+        self.chal = {}
+
+    def _hash(self, algorithm, value):
+        return self.HASH_FUNCTIONS[algorithm](value.encode("utf-8")).hexdigest()
+
+    def build_digest_header(self, method, url):
+        """
+        returns None if the challenge is missing or uses an algorithm or qop which is not supported, must be
+        called with the lock held since nc has to be unique per nonce
+        """
+        realm = self.chal.get("realm")
+        nonce = self.chal.get("nonce")
+        if realm is None or nonce is None:
+            return None
+        algorithm = (self.chal.get("algorithm") or "MD5").upper()
+        qop = self.chal.get("qop")
+        if algorithm not in self.HASH_FUNCTIONS:
+            return None
+        if qop and "auth" not in [value.strip() for value in qop.split(",")]:
+            return None
+
+        parsed_url = urlparse(url)
+        path = parsed_url.path or "/"
+        if parsed_url.query:
+            path += f"?{parsed_url.query}"
+
+        if nonce == self.last_nonce:
+            self.nonce_count += 1
+        else:
+            self.nonce_count = 1
+            self.last_nonce = nonce
+        ncvalue = f"{self.nonce_count:08x}"
+        cnonce = hashlib.sha1(f"{self.nonce_count}:{nonce}:{time.ctime()}:{os.urandom(8).hex()}".encode("utf-8")).hexdigest()[:16]
+
+        ha1 = self._hash(algorithm, f"{self.username}:{realm}:{self.password}")
+        if algorithm == "MD5-SESS":
+            ha1 = self._hash(algorithm, f"{ha1}:{nonce}:{cnonce}")
+        ha2 = self._hash(algorithm, f"{method}:{path}")
+        if qop:
+            response = self._hash(algorithm, f"{ha1}:{nonce}:{ncvalue}:{cnonce}:auth:{ha2}")
+        else:
+            response = self._hash(algorithm, f"{ha1}:{nonce}:{ha2}")
+
+        header = f'username="{self.username}", realm="{realm}", nonce="{nonce}", uri="{path}", response="{response}"'
+        if self.chal.get("opaque"):
+            header += f', opaque="{self.chal["opaque"]}"'
+        header += f', algorithm="{algorithm}"'
+        if qop:
+            header += f', qop="auth", nc={ncvalue}, cnonce="{cnonce}"'
+        return f"Digest {header}"
+
+    def __call__(self, r):
+        # requests are authorized upfront once a challenge is known, the 401 round trip is only paid for a new one
+        with self.lock:
+            if self.chal:
+                digest_auth = self.build_digest_header(r.method, r.url)
+                if digest_auth:
+                    r.headers["Authorization"] = digest_auth
+        body_position = None
+        tell = getattr(r.body, "tell", None)
+        if tell is not None:
+            try:
+                body_position = tell()
+            except OSError:
+                pass
+        r.register_hook("response", partial(self.handle_401, body_position=body_position))
+        return r
+
+    def handle_401(self, r, body_position=None, **kwargs):
+        # the hook is not dispatched for the retried request, so a challenge is answered at most once per request
+        s_auth = r.headers.get("www-authenticate", "")
+        if r.status_code != 401 or "digest" not in s_auth.lower():
+            return r
+
+        if body_position is not None:
+            # rewind the body to resend the request
+            r.request.body.seek(body_position)
+        # consume content and release the original connection so that the retry can reuse it
+        r.content
+        r.close()
+        prep = r.request.copy()
+        # cookies set with the challenge are sent with the retry as well
+        cookies = RequestsCookieJar()
+        if r.raw is not None:
+            extract_cookies_to_jar(cookies, r.request, r.raw)
+        cookie_header = get_cookie_header(cookies, prep)
+        if cookie_header:
+            prep.headers["Cookie"] = "; ".join(filter(None, [prep.headers.get("Cookie"), cookie_header]))
+
+        with self.lock:
+            self.challenges += 1
+            self.chal = parse_dict_header(re.sub(r"digest ", "", s_auth, count=1, flags=re.IGNORECASE))
+            digest_auth = self.build_digest_header(prep.method, prep.url)
+        if digest_auth:
+            prep.headers["Authorization"] = digest_auth
+        _r = r.connection.send(prep, **kwargs)
+        _r.history.append(r)
+        _r.request = prep
+        return _r
+
+
+class AtlasSessionPool:
+    """
+    Process wide keep-alive sessions, one per Atlas host, shared by the collector and all the tasks so that
+    requests reuse the pooled connections instead of paying a new TCP and TLS handshake. Digest auth objects
+    are shared per host and api key for the nonce reuse.
+    """
+
+    def __init__(self, config):
+        self.collection_config = config["Collection"]
+        self.pool_size = self.collection_config.get("ATLAS_CONNECTION_POOL_SIZE", 50)
+        self.rate_limiter = get_atlas_rate_limiter(config)
+        self.sessions = {}
+        self.auths = {}
+        self.lock = threading.Lock()
+
+    def get_session(self, url):
+        host = urlparse(url or "").netloc
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = self.rate_limiter.get_session(
+                    MAX_RETRY=self.collection_config.get("MAX_RETRY", 3),
+                    BACKOFF_FACTOR=self.collection_config.get("BACKOFF_FACTOR", 0.1),
+                    pool_maxsize=self.pool_size,
+                )
+            return self.sessions[host]
+
+    def get_auth(self, url, username, password):
+        key = (urlparse(url or "").netloc, username)
+        with self.lock:
+            if key not in self.auths or self.auths[key].password != password:
+                self.auths[key] = SharedDigestAuth(username, password)
+            return self.auths[key]
+
+    def get_metrics(self):
+        requests = connections = 0
+        with self.lock:
+            for session in self.sessions.values():
+                for adapter in session.adapters.values():
+                    pools = adapter.poolmanager.pools
+                    for pool_key in pools.keys():
+                        pool = pools.get(pool_key)
+                        if pool is not None:
+                            requests += pool.num_requests
+                            connections += pool.num_connections
+            auth_challenges = sum(auth.challenges for auth in self.auths.values())
+        return {
+            "sessions": len(self.sessions),
+            "requests": requests,
+            "connections": connections,
+            "reused_connections": max(requests - connections, 0),
+            "auth_challenges": auth_challenges,
+        }
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+
+_session_pools = {}
+_session_pool_lock = threading.Lock()
+
+
+def get_atlas_session_pool(config):
+    # one pool per connection and rate settings, the sessions of a pool are built from the config it was created with
+    collection_config = config["Collection"]
+    key = (
+        collection_config.get("ATLAS_CONNECTION_POOL_SIZE", 50),
+        collection_config.get("MAX_RETRY", 3),
+        collection_config.get("BACKOFF_FACTOR", 0.1),
+        get_rate_limiter_key(config),
+    )
+    with _session_pool_lock:
+        if key not in _session_pools:
+            _session_pools[key] = AtlasSessionPool(config)
+        return _session_pools[key]
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+from unittest.mock import MagicMock
+
+from sumomongodbatlascollector.background_sender import BackgroundSender, QueuedOutputHandler, StateWriteRecorder
+
+
+@pytest.fixture
+def config():
+    return {"Collection": {"SENDER_WORKERS": 1}, "Logging": {}}
+
+
+def test_background_sender_commits_checkpoints_in_order(config):
+    release_first, third_started = threading.Event(), threading.Event()
+
+    def send(data, endpoint_key=None, **kwargs):
+        if data == ["first"]:
+            release_first.wait(5)
+        if data == ["second"]:
+            # the third payload is in flight before the second one fails, so it is not cancelled
+            third_started.wait(5)
+        if data == ["third"]:
+            third_started.set()
+        return data != ["second"]
+
+    config["Collection"]["SENDER_WORKERS"] = 3
+    sender = BackgroundSender(send, config)
+    output_handler = QueuedOutputHandler(sender)
+    kvstore = MagicMock()
+    for idx, payload in enumerate(["first", "second", "third"], start=1):
+        assert output_handler.send([payload], endpoint_key="HTTP_METRICS_ENDPOINT")
+        recorder = StateWriteRecorder(kvstore)
+        recorder.set("task", {"last_time_epoch": idx})
+        output_handler.defer_checkpoint(recorder.replay)
+
+    # the later payloads are acknowledged first but nothing is saved before the first one is sent
+    time.sleep(0.2)
+    kvstore.set.assert_not_called()
+    release_first.set()
+    sender.close()
+
+    assert [args[1]["last_time_epoch"] for args, _ in kvstore.set.call_args_list] == [1]
+    assert not output_handler.send(["fourth"], endpoint_key="HTTP_METRICS_ENDPOINT")
+    assert sender.metrics["sent"] == 2
+    assert sender.metrics["failed"] == 1
+    assert sender.queued_bytes == 0
+
+
+def test_background_sender_coalesces_payloads_across_tasks(config):
+    sent_batches = []
+
+    def send(data, endpoint_key=None, **kwargs):
+        sent_batches.append((endpoint_key, list(data)))
+        return True
+
+    config["Collection"].update({"SENDER_WORKERS": 2, "COALESCE_ENDPOINT_KEYS": ["HTTP_METRICS_ENDPOINT"], "COALESCE_LINGER_SECONDS": 0.1,
+                                 "MAX_PAYLOAD_BYTESIZE": 30})
+    sender = BackgroundSender(send, config)
+    checkpoints = []
+    for idx in range(3):
+        output_handler = QueuedOutputHandler(sender)
+        output_handler.send([f"metric{idx} 1 100"], endpoint_key="HTTP_METRICS_ENDPOINT", jsondump=False)
+        output_handler.defer_checkpoint(lambda idx=idx: checkpoints.append(idx))
+    output_handler.send([{"log": 1}], endpoint_key="HTTP_LOGS_ENDPOINT")
+
+    time.sleep(0.3)
+    # the first batch is full after two payloads, the last one is sent after the linger time
+    assert sorted(sent_batches) == [
+        ("HTTP_LOGS_ENDPOINT", [{"log": 1}]),
+        ("HTTP_METRICS_ENDPOINT", ["metric0 1 100", "metric1 1 100"]),
+        ("HTTP_METRICS_ENDPOINT", ["metric2 1 100"]),
+    ]
+    sender.close()
+    assert sorted(checkpoints) == [0, 1, 2]
+    assert sender.metrics["coalesced"] == 3
+
+
+def test_background_sender_cancels_queued_payloads_after_a_failed_send(config):
+    release_first = threading.Event()
+    sent_payloads = []
+
+    def send(data, endpoint_key=None, **kwargs):
+        if data == ["first"]:
+            release_first.wait(5)
+        sent_payloads.append(data)
+        return data != ["first"]
+
+    sender = BackgroundSender(send, config)
+    output_handler, other_output_handler = QueuedOutputHandler(sender), QueuedOutputHandler(sender)
+    checkpoints = []
+    for payload in ["first", "second", "third"]:
+        assert output_handler.send([payload], endpoint_key="HTTP_METRICS_ENDPOINT")
+        output_handler.defer_checkpoint(lambda payload=payload: checkpoints.append(payload))
+    other_output_handler.send(["other"], endpoint_key="HTTP_METRICS_ENDPOINT")
+    other_output_handler.defer_checkpoint(lambda: checkpoints.append("other"))
+    release_first.set()
+    sender.close()
+
+    # the payloads queued behind the failed one are not sent, the ones of the other handler are
+    assert sent_payloads == [["first"], ["other"]]
+    assert checkpoints == ["other"]
+    assert not output_handler.send(["fourth"], endpoint_key="HTTP_METRICS_ENDPOINT")
+    assert sender.metrics["cancelled"] == 2
+    assert sender.queued_bytes == 0
@@ -0,0 +1,109 @@
+import shelve
+
+import pytest
+from unittest.mock import MagicMock, call, patch
+
+from sumoappclient.omnistorage.onprem import OnPremKVStorage
+from sumomongodbatlascollector.checkpoint_store import CheckpointStore
+
+
+@pytest.fixture
+def config():
+    return {"Collection": {}, "Logging": {}}
+
+
+@pytest.fixture
+def onprem_kvstore(tmp_path):
+    return OnPremKVStorage("checkpoints", db_dir=str(tmp_path))
+
+
+@pytest.fixture
+def dynamodb_kvstore():
+    kvstore = MagicMock(env="aws", KEY_COL="key_col", VALUE_COL="value_col", table_name="mongodbatlas")
+    kvstore._put_decimals.side_effect = lambda value: value
+    kvstore._replace_decimals.side_effect = lambda value: value
+    return kvstore
+
+
+def test_checkpoint_store_coalesces_writes_in_one_transaction(onprem_kvstore, config):
+    config["Collection"].update({"CHECKPOINT_FLUSH_MAX_KEYS": 3, "CHECKPOINT_FLUSH_INTERVAL_SECONDS": 3600})
+    store = CheckpointStore(onprem_kvstore, config)
+
+    state = {"last_time_epoch": 1}
+    store.set("task1", state)
+    state["last_time_epoch"] = 2
+    store.set("task1", {"last_time_epoch": 3})
+    store.set("task2", {"last_time_epoch": 4})
+    # pending writes are served from memory
+    assert not onprem_kvstore.has_key("task1")
+    assert store.has_key("task1") and store.get("task1") == {"last_time_epoch": 3}
+
+    with patch("sumomongodbatlascollector.checkpoint_store.shelve.open", wraps=shelve.open) as mock_open:
+        store.set("task3", {"last_time_epoch": 5})
+    assert mock_open.call_count == 1
+    assert [onprem_kvstore.get(key) for key in ("task1", "task2", "task3")] == [{"last_time_epoch": 3}, {"last_time_epoch": 4}, {"last_time_epoch": 5}]
+    assert store.get_metrics() == {"sets": 4, "coalesced": 1, "flushes": 1, "flushed_keys": 3, "failed_flushes": 0,
+                                   "preloaded_keys": 0, "missing_keys": 0, "pending": 0}
+
+
+def test_checkpoint_store_batch_writes_to_dynamodb_and_keeps_failed_writes(dynamodb_kvstore, config):
+    batch = dynamodb_kvstore.dynamodbcli.Table.return_value.batch_writer.return_value.__enter__.return_value
+    batch.put_item.side_effect = [None, Exception("ProvisionedThroughputExceededException")]
+    store = CheckpointStore(dynamodb_kvstore, config)
+
+    store.set("task1", {"last_time_epoch": 1})
+    store.set("task2", {"last_time_epoch": 2})
+    assert not store.flush()
+    assert store.get_metrics()["pending"] == 2
+    dynamodb_kvstore.set.assert_not_called()
+
+    batch.put_item.side_effect = None
+    batch.put_item.reset_mock()
+    assert store.flush()
+    dynamodb_kvstore.dynamodbcli.Table.assert_called_with("mongodbatlas")
+    batch.put_item.assert_has_calls([
+        call(Item={"key_col": "task1", "value_col": {"last_time_epoch": 1}}),
+        call(Item={"key_col": "task2", "value_col": {"last_time_epoch": 2}}),
+    ])
+
+
+def test_checkpoint_store_preloads_states_in_bulk(onprem_kvstore, config):
+    onprem_kvstore.set("task1", {"last_time_epoch": 1})
+    onprem_kvstore.set("task2", {"last_time_epoch": 2})
+    store = CheckpointStore(onprem_kvstore, config, write_behind=False)
+
+    with patch("sumomongodbatlascollector.checkpoint_store.shelve.open", wraps=shelve.open) as mock_open:
+        assert store.preload(["task1", "task2", "task3", "task1"]) == ["task3"]
+    assert mock_open.call_count == 1
+
+    # reads of the preloaded keys do not go to the kvstore
+    with patch.object(onprem_kvstore, "get") as mock_get, patch.object(onprem_kvstore, "has_key") as mock_has_key:
+        assert store.has_key("task1") and store.get("task2") == {"last_time_epoch": 2}
+        assert not store.has_key("task3") and store.get("task3", {}) == {}
+    mock_get.assert_not_called()
+    mock_has_key.assert_not_called()
+
+    # missing keys are initialised together, other writes go straight to the kvstore
+    with store.deferred_writes():
+        store.set("task3", {"last_time_epoch": 0})
+        assert not onprem_kvstore.has_key("task3")
+    assert onprem_kvstore.get("task3") == {"last_time_epoch": 0} and store.get("task3") == {"last_time_epoch": 0}
+    store.set("task1", {"last_time_epoch": 5})
+    assert onprem_kvstore.get("task1") == {"last_time_epoch": 5} and store.get("task1") == {"last_time_epoch": 5}
+
+
+def test_checkpoint_store_preloads_dynamodb_states_with_batch_get(dynamodb_kvstore, config):
+    dynamodb_kvstore.dynamodbcli.batch_get_item.side_effect = [
+        {"Responses": {"mongodbatlas": [{"key_col": "task0", "value_col": {"last_time_epoch": 0}}]},
+         "UnprocessedKeys": {"mongodbatlas": {"Keys": [{"key_col": "task1"}], "ConsistentRead": True}}},
+        {"Responses": {"mongodbatlas": [{"key_col": "task1", "value_col": {"last_time_epoch": 1}}]}, "UnprocessedKeys": {}},
+        {"Responses": {"mongodbatlas": []}, "UnprocessedKeys": {}},
+    ]
+    store = CheckpointStore(dynamodb_kvstore, config)
+
+    keys = [f"task{idx}" for idx in range(150)]
+    assert store.preload(keys) == keys[2:]
+    request_keys = [request_call.kwargs["RequestItems"]["mongodbatlas"]["Keys"] for request_call in dynamodb_kvstore.dynamodbcli.batch_get_item.call_args_list]
+    assert [len(batch_keys) for batch_keys in request_keys] == [100, 1, 50]
+    assert store.get("task1") == {"last_time_epoch": 1}
+    dynamodb_kvstore.get.assert_not_called()
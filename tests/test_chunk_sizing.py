@@ -0,0 +1,49 @@
+import pytest
+
+from sumomongodbatlascollector import chunk_sizing
+from sumomongodbatlascollector.chunk_sizing import AdaptiveChunkSizer
+
+
+@pytest.fixture
+def config(monkeypatch):
+    # sizes tuned by the other tests are not carried over
+    monkeypatch.setattr(chunk_sizing, "_tuned_chunk_sizes", {})
+    return {"Collection": {"MAX_PAYLOAD_BYTESIZE": 4000000, "MIN_PAYLOAD_BYTESIZE": 100000}, "SumoLogic": {"HTTP_LOGS_ENDPOINT": "https://sumo/logs"}, "Logging": {}}
+
+
+def test_adaptive_chunk_sizer_tunes_size_per_endpoint(config):
+    config["Collection"]["ADAPTIVE_CHUNK_TARGET_LATENCY_SECONDS"] = 2
+    sizer = AdaptiveChunkSizer(config)
+    assert sizer.get_chunk_size("HTTP_LOGS_ENDPOINT", 1000000) == 1000000
+    assert sizer.get_chunk_size("HTTP_METRICS_ENDPOINT", 1000000) == 1000000
+
+    # slow log sends (1MB of raw data, 200KB on the wire in 4 seconds) shrink the chunks
+    for _ in range(5):
+        sizer.record("HTTP_LOGS_ENDPOINT", 1000000, 200000, 4.0, True)
+    logs_chunk_size = sizer.get_chunk_size("HTTP_LOGS_ENDPOINT", 1000000)
+    assert 500000 <= logs_chunk_size < 700000
+
+    # fast metric sends grow up to the maximum and a failure halves the size
+    for _ in range(10):
+        sizer.record("HTTP_METRICS_ENDPOINT", 1000000, 100000, 0.1, True)
+    assert sizer.get_chunk_size("HTTP_METRICS_ENDPOINT", 1000000) == 4000000
+    sizer.record("HTTP_METRICS_ENDPOINT", 4000000, 400000, 90, False)
+    assert sizer.get_chunk_size("HTTP_METRICS_ENDPOINT", 1000000) == 2000000
+
+    metrics = sizer.get_metrics()
+    assert metrics["HTTP_LOGS_ENDPOINT"]["chunk_size"] == logs_chunk_size
+    assert metrics["HTTP_METRICS_ENDPOINT"]["failures"] == 1
+    assert metrics["HTTP_METRICS_ENDPOINT"]["ratio"] == 10
+
+
+def test_adaptive_chunk_sizer_starts_from_the_sizes_tuned_in_the_process(config):
+    sizer = AdaptiveChunkSizer(config)
+    sizer.record("HTTP_LOGS_ENDPOINT", 1000000, 100000, 90, False)
+    sizer.record("HTTP_LOGS_ENDPOINT", 2000000, 200000, 90, False)
+    assert sizer.get_chunk_size("HTTP_LOGS_ENDPOINT", 3000000) == 1000000
+    sizer.close()
+
+    assert AdaptiveChunkSizer(config).get_chunk_size("HTTP_LOGS_ENDPOINT", 3000000) == 1000000
+    assert AdaptiveChunkSizer(config).get_chunk_size("HTTP_METRICS_ENDPOINT", 3000000) == 3000000
+    other_url_config = dict(config, SumoLogic={"HTTP_LOGS_ENDPOINT": "https://sumo/other"})
+    assert AdaptiveChunkSizer(other_url_config).get_chunk_size("HTTP_LOGS_ENDPOINT", 3000000) == 3000000
@@ -0,0 +1,54 @@
+import gzip
+
+import pytest
+from unittest.mock import patch
+
+from sumomongodbatlascollector.compression import PayloadCompressor
+from sumomongodbatlascollector.output_pool import PooledHTTPHandler
+
+
+@pytest.fixture
+def config():
+    return {
+        "Collection": {"MAX_RETRY": 1, "BACKOFF_FACTOR": 1, "TIMEOUT": 10, "COMPRESSED": True, "COMPRESSION_CHUNK_BYTESIZE": 60},
+        "SumoLogic": {"HTTP_METRICS_ENDPOINT": "https://sumo/metrics"},
+        "DeployMetaData": {"PACKAGENAME": "sumologic-mongodb-atlas"},
+        "Logging": {},
+    }
+
+
+@patch("sumomongodbatlascollector.output_pool.ClientMixin.make_request_with_status", return_value=(True, {}, 200))
+def test_pooled_http_handler_compresses_chunks_in_parallel(mock_make_request, config):
+    config["Collection"].update({"MAX_PAYLOAD_BYTESIZE": 4096, "COMPRESSION_WORKERS": 2, "COMPRESSION_LEVEL": 9})
+    compressor = PayloadCompressor(config)
+    handler = PooledHTTPHandler(config, compressor=compressor)
+    lines = [f"metric=CONNECTIONS host=host{idx} 1 1700000000" for idx in range(6)]
+
+    assert handler.send(lines, extra_headers={"Content-Type": "application/vnd.sumologic.carbon2"}, jsondump=False, endpoint_key="HTTP_METRICS_ENDPOINT")
+
+    assert mock_make_request.call_count == 6
+    bodies = [gzip.decompress(call.kwargs["data"]).decode("utf-8") for call in mock_make_request.call_args_list]
+    assert bodies == lines
+    assert mock_make_request.call_args.kwargs["headers"]["Content-Encoding"] == "gzip"
+    metrics = compressor.get_metrics()["HTTP_METRICS_ENDPOINT"]
+    assert metrics["chunks"] == 6
+    assert metrics["raw_bytes"] == sum(len(line) for line in lines)
+    handler.close()
+    compressor.close()
+
+
+@patch("sumomongodbatlascollector.output_pool.ClientMixin.make_request_with_status", return_value=(True, {}, 200))
+def test_pooled_http_handler_compresses_inline_one_chunk_at_a_time(mock_make_request, config):
+    config["Collection"].update({"COMPRESSION_WORKERS": 0, "ENVIRONMENT": "aws", "COMPRESSION_EXECUTOR": "process"})
+    compressor = PayloadCompressor(config)
+    # process pools need /dev/shm which aws lambda does not have
+    assert compressor.executor_type == "thread"
+    events = []
+    compress = compressor.compress
+    compressor.compress = lambda endpoint_key, bodies: events.append(("compress", len(bodies))) or compress(endpoint_key, bodies)
+    mock_make_request.side_effect = lambda *args, **kwargs: events.append(("post", 1)) or (True, {}, 200)
+    handler = PooledHTTPHandler(config, compressor=compressor)
+
+    assert handler.send([f"metric=CONNECTIONS host=host{idx} 1 1700000000" for idx in range(3)], jsondump=False, endpoint_key="HTTP_METRICS_ENDPOINT")
+
+    assert events == [("compress", 1), ("post", 1)] * 3
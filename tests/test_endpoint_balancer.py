@@ -0,0 +1,50 @@
+import time
+
+import pytest
+from unittest.mock import patch
+
+from sumomongodbatlascollector.endpoint_balancer import EndpointBalancer
+from sumomongodbatlascollector.output_pool import PooledHTTPHandler
+
+
+@pytest.fixture
+def config():
+    return {
+        "Collection": {"MAX_RETRY": 1, "BACKOFF_FACTOR": 1, "TIMEOUT": 10, "COMPRESSED": False, "MAX_PAYLOAD_BYTESIZE": 4096,
+                       "CIRCUIT_BREAKER_FAILURE_THRESHOLD": 2, "CIRCUIT_BREAKER_RESET_SECONDS": 0.2},
+        "SumoLogic": {"HTTP_LOGS_ENDPOINT": "https://sumo/logs1, https://sumo/logs2"},
+        "DeployMetaData": {"PACKAGENAME": "sumologic-mongodb-atlas"},
+        "Logging": {},
+    }
+
+
+@patch("sumomongodbatlascollector.output_pool.ClientMixin.make_request_with_status")
+def test_endpoint_balancer_fails_over_and_opens_circuit(mock_make_request, config):
+    down_urls = {"https://sumo/logs1"}
+    mock_make_request.side_effect = lambda url, **kwargs: (False, "down", 503) if url in down_urls else (True, {}, 200)
+    balancer = EndpointBalancer(config)
+    handler = PooledHTTPHandler(config, balancer=balancer)
+
+    # every send fails over to the second url until the circuit of the first one opens
+    for idx in range(3):
+        assert handler.send([{"log": idx}], endpoint_key="HTTP_LOGS_ENDPOINT")
+    urls = [call.args[0] for call in mock_make_request.call_args_list]
+    assert urls == ["https://sumo/logs1", "https://sumo/logs2", "https://sumo/logs1", "https://sumo/logs2", "https://sumo/logs2"]
+    assert [endpoint["state"] for endpoint in balancer.get_metrics()["HTTP_LOGS_ENDPOINT"]] == ["open", "closed"]
+
+    # once the reset time is over a successful trial send closes the circuit
+    busy_url = balancer.acquire("HTTP_LOGS_ENDPOINT")
+    assert busy_url == "https://sumo/logs2"
+    down_urls.clear()
+    time.sleep(0.25)
+    mock_make_request.reset_mock()
+    assert handler.send([{"log": 3}], endpoint_key="HTTP_LOGS_ENDPOINT")
+    assert mock_make_request.call_args.args[0] == "https://sumo/logs1"
+    assert [endpoint["state"] for endpoint in balancer.get_metrics()["HTTP_LOGS_ENDPOINT"]] == ["closed", "closed"]
+
+    # least outstanding requests picks the idle url
+    assert balancer.acquire("HTTP_LOGS_ENDPOINT") == "https://sumo/logs1"
+    assert balancer.acquire("HTTP_LOGS_ENDPOINT") == "https://sumo/logs1"
+    assert balancer.acquire("HTTP_LOGS_ENDPOINT") == "https://sumo/logs2"
+    assert [endpoint["outstanding"] for endpoint in balancer.get_metrics()["HTTP_LOGS_ENDPOINT"]] == [2, 2]
+    handler.close()
@@ -4,6 +4,7 @@ import tempfile
 import os
 from unittest.mock import patch, MagicMock, call
 from sumomongodbatlascollector.main import MongoDBAtlasCollector
+from sumomongodbatlascollector.scheduler import LagPriorityScheduler
 from sumoappclient.sumoclient.base import BaseCollector
 from requests.auth import HTTPDigestAuth
 
@@ -83,6 +84,7 @@ def mongodb_atlas_collector(mock_config, mock_provider, temp_config_dir):
         )
         collector.collection_config = collector.config["Collection"]
         collector.mongosess = MagicMock()
+        collector.output_handler_pool = MagicMock()
         collector.log = MagicMock()
         return collector
 
@@ -135,7 +137,7 @@ def test_getpaginateddata(mongodb_atlas_collector):
     url = "https://test.com/api"
     kwargs = {"auth": mongodb_atlas_collector.digestauth, "params": {"pageNum": 1}}
 
-    with patch("sumomongodbatlascollector.main.ClientMixin.make_request") as mock_make_request:
+    with patch("sumomongodbatlascollector.rate_limiter.ClientMixin.make_request") as mock_make_request:
         mock_make_request.side_effect = [
             (True, {"results": [{"id": 1}, {"id": 2}]}),
             (True, {"results": [{"id": 3}]}),
@@ -667,3 +669,158 @@ def test_get_disk_names_no_refresh_needed(
     mongodb_atlas_collector.kvstore.get.assert_has_calls(
         [call("disk_names"), call("disk_names")]
     )
+
+
+def make_task(*key_parts):
+    task = MagicMock()
+    task.get_key.return_value = "-".join(key_parts)
+    return task
+
+
+def test_build_task_params_interleaves_projects(mongodb_atlas_collector):
+    mongodb_atlas_collector.api_config.update({
+        "PROJECT_IDS": ["test_project_id", "project2"],
+        "ORGANIZATION_ID": "org1",
+        "LOG_TYPES": ["EVENTS_PROJECT", "EVENTS_ORG", "DATABASE"],
+    })
+    mongodb_atlas_collector.collection_config["IS_SHUFFLE_TASKS"] = False
+    hostnames = {"test_project_id": ["host1", "host2", "host3"], "project2": ["host4"]}
+
+    def get_process_names():
+        return [], hostnames[mongodb_atlas_collector.api_config["PROJECT_ID"]]
+
+    mongodb_atlas_collector._get_process_names = get_process_names
+    mongodb_atlas_collector.kvstore.get.return_value = {"values": {}}
+
+    with patch("sumomongodbatlascollector.main.LogAPI") as mock_log_api, \
+            patch("sumomongodbatlascollector.main.ProjectEventsAPI") as mock_project_events_api, \
+            patch("sumomongodbatlascollector.main.OrgEventsAPI") as mock_org_events_api:
+        mock_log_api.side_effect = lambda kvstore, hostname, filename, config, cluster_mapping: make_task(config["MongoDBAtlas"]["PROJECT_ID"], hostname, filename)
+        mock_project_events_api.side_effect = lambda kvstore, config: make_task(config["MongoDBAtlas"]["PROJECT_ID"], "events")
+        mock_org_events_api.side_effect = lambda kvstore, config: make_task("org1", "events")
+        tasks = mongodb_atlas_collector.build_task_params()
+
+    assert [task.get_key() for task in tasks[:3]] == [
+        "test_project_id-host1-mongodb.gz",
+        "project2-host4-mongodb.gz",
+        "org1-events",
+    ]
+    assert len(tasks) == 7 + 3 + 1
+    assert mongodb_atlas_collector.api_config["PROJECT_ID"] == "test_project_id"
+    mongodb_atlas_collector.kvstore.get.assert_any_call("project2-cluster_mapping", {})
+    mongodb_atlas_collector.kvstore.get.assert_any_call("cluster_mapping", {})
+    assert all(task.output_handler_pool is mongodb_atlas_collector.output_handler_pool for task in tasks)
+
+
+def test_run_keeps_the_interleaved_task_order(mongodb_atlas_collector):
+    mongodb_atlas_collector.collection_config["IS_SHUFFLE_TASKS"] = True
+    mongodb_atlas_collector.num_workers = 1
+    mongodb_atlas_collector.is_first_fetch = False
+    mongodb_atlas_collector.execution_state = None
+    mongodb_atlas_collector.is_another_instance_running = False
+    fetched = []
+    tasks = [make_task(f"task{idx}") for idx in range(20)]
+    for task in tasks:
+        task.fetch.side_effect = lambda task=task: fetched.append(task.get_key())
+
+    with patch.object(mongodb_atlas_collector, "build_task_params", return_value=list(tasks)), \
+            patch.object(mongodb_atlas_collector, "stop_running") as mock_stop_running:
+        mongodb_atlas_collector.run()
+
+    assert fetched == [task.get_key() for task in tasks]
+    assert all(task.close.called for task in tasks)
+    mock_stop_running.assert_called_once_with()
+    assert mongodb_atlas_collector.config["Collection"]["IS_SHUFFLE_TASKS"] is True
+
+
+class FakeKVStore(dict):
+    def has_key(self, key):
+        return key in self
+
+    def set(self, key, value):
+        self[key] = value
+
+
+def make_scheduled_task(key, log_type):
+    task = MagicMock(log_type=log_type, DEFAULT_START_TIME_EPOCH=0, STOP_TIME_OFFSET_SECONDS=60)
+    task.get_key.return_value = key
+    task.get_function_timeout.return_value = 120
+    return task
+
+
+@patch("sumomongodbatlascollector.scheduler.get_current_timestamp", return_value=10000)
+def test_lag_priority_scheduler(mock_get_current_timestamp, mock_config):
+    mock_config["Collection"]["TASK_PRIORITY_WEIGHTS"] = {"EVENTS_PROJECT": 3}
+    mock_config["Collection"]["TASK_HISTORY_SHARDS"] = 1
+    kvstore = FakeKVStore({
+        "fresh": {"last_time_epoch": 9900},
+        "stale": {"last_time_epoch": 5000},
+        "events": {"last_time_epoch": 9000},
+        "slow": {"last_time_epoch": 1000},
+        "task_durations_0": {"slow": {"duration": 100, "last_run": 9000}, "stale": {"duration": 20, "last_run": 9000}},
+    })
+    scheduler = LagPriorityScheduler(kvstore, mock_config, MagicMock())
+    tasks = [make_scheduled_task(key, log_type) for key, log_type in [
+        ("fresh", "PROCESS_METRICS"), ("stale", "PROCESS_METRICS"), ("events", "EVENTS_PROJECT"), ("slow", "DISK_METRICS")
+    ]]
+
+    scheduled_tasks = scheduler.schedule(tasks, num_workers=1)
+
+    # score per second: stale 5000/20, events 1000*3/10, fresh 100/10, slow 9000/100 does not fit in the 60 seconds budget
+    assert [str(task.get_key()) for task in scheduled_tasks] == ["events", "stale", "fresh", "slow"]
+    scheduled_tasks[0].fetch()
+    tasks[2].fetch.assert_called_once()
+    scheduler.save_history()
+    assert kvstore["task_durations_0"]["events"]["last_run"] == 10000
+    assert kvstore["task_durations_0"]["slow"]["duration"] == 100
+
+
+@patch("sumomongodbatlascollector.scheduler.get_current_timestamp", return_value=10000)
+def test_lag_priority_scheduler_history_is_sharded_and_capped(mock_get_current_timestamp, mock_config):
+    mock_config["Collection"]["TASK_HISTORY_SHARDS"] = 4
+    kvstore = FakeKVStore()
+    scheduler = LagPriorityScheduler(kvstore, mock_config, MagicMock())
+    scheduler.MAX_ENTRIES_PER_SHARD = 5
+    task_keys = [f"task{idx}" for idx in range(40)]
+    for idx, task_key in enumerate(task_keys):
+        scheduler.history[task_key] = {"duration": 1, "last_run": 9000 + idx}
+        scheduler.changed_shards.add(scheduler.get_shard(task_key))
+
+    scheduler.save_history()
+
+    assert sorted(kvstore) == LagPriorityScheduler.get_history_keys(mock_config)
+    for shard in range(4):
+        shard_keys = [task_key for task_key in task_keys if scheduler.get_shard(task_key) == shard]
+        assert sorted(kvstore[f"task_durations_{shard}"]) == sorted(shard_keys[-5:])
+    assert LagPriorityScheduler(kvstore, mock_config, MagicMock()).history.keys() == {
+        task_key for shard in range(4) for task_key in kvstore[f"task_durations_{shard}"]
+    }
+
+
+def test_preload_task_states_initialises_missing_states_in_bulk(mongodb_atlas_collector):
+    mongodb_atlas_collector.checkpoint_store = MagicMock()
+    mongodb_atlas_collector.checkpoint_store.preload.return_value = ["key2"]
+    tasks = [MagicMock(), MagicMock()]
+    tasks[0].get_key.return_value = "key1"
+    tasks[1].get_key.return_value = "key2"
+
+    mongodb_atlas_collector._preload_task_states(tasks)
+
+    mongodb_atlas_collector.checkpoint_store.preload.assert_called_once_with(["key1", "key2"])
+    mongodb_atlas_collector.checkpoint_store.deferred_writes.assert_called_once_with()
+    tasks[0].init_state.assert_not_called()
+    tasks[1].init_state.assert_called_once_with()
+
+
+def test_prioritise_tasks_by_lag_preloads_the_task_states(mongodb_atlas_collector):
+    mongodb_atlas_collector.collection_config["PRIORITISE_TASKS_BY_LAG"] = True
+    mongodb_atlas_collector.collection_config["TASK_HISTORY_SHARDS"] = 2
+    mongodb_atlas_collector.checkpoint_store = MagicMock()
+    mongodb_atlas_collector.checkpoint_store.preload.return_value = []
+    task = MagicMock()
+    task.get_key.return_value = "key1"
+
+    assert mongodb_atlas_collector._is_preload_task_states()
+    mongodb_atlas_collector._preload_task_states([task])
+
+    mongodb_atlas_collector.checkpoint_store.preload.assert_called_once_with(["key1", "task_durations_0", "task_durations_1"])
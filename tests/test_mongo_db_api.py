@@ -1,12 +1,24 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
 import pytest
+import requests
 from unittest.mock import MagicMock, patch
 # from datetime import datetime, timedelta
 # import time
-from requests.auth import HTTPDigestAuth
+from requests.auth import AuthBase
+from requests.utils import parse_dict_header
 
 from sumoappclient.sumoclient.base import BaseAPI
 # from sumoappclient.common.utils import get_current_timestamp
-from sumomongodbatlascollector.api import MongoDBAPI
+from sumomongodbatlascollector import async_engine
+from sumomongodbatlascollector.rate_limiter import AtlasRateLimiter, get_atlas_rate_limiter
+from sumomongodbatlascollector.session_pool import SharedDigestAuth, get_atlas_session_pool
+from sumomongodbatlascollector.api import MongoDBAPI, DatabaseMetricsAPI, DiskMetricsAPI, MeasurementsAPI, ProjectEventsAPI, AlertsAPI
 
 
 class ConcreteMongoDBAPI(MongoDBAPI):
@@ -59,7 +71,7 @@ def mongodb_api():
 
 
 def test_init(mongodb_api):
-    assert isinstance(mongodb_api.digestauth, HTTPDigestAuth)
+    assert isinstance(mongodb_api.digestauth, AuthBase)
     assert mongodb_api.digestauth.username == "public_key"
     assert mongodb_api.digestauth.password == "private_key"
     assert mongodb_api.MAX_REQUEST_WINDOW_LENGTH == 900
@@ -105,3 +117,726 @@ def test_get_window(mock_get_current_timestamp, mongodb_api):
     print(
         f"END_TIME_EPOCH_OFFSET_SECONDS: {mongodb_api.collection_config['END_TIME_EPOCH_OFFSET_SECONDS']}"
     )
+
+
+@pytest.fixture
+def measurements_config():
+    return {
+        "MongoDBAtlas": {
+            "PUBLIC_API_KEY": "public_key",
+            "PRIVATE_API_KEY": "private_key",
+            "BASE_URL": "https://cloud.mongodb.com/api/atlas/v1.0",
+            "PROJECT_ID": "project1",
+            "PAGINATION_LIMIT": 500,
+            "METRIC_TYPES": {
+                "PROCESS_METRICS": ["CONNECTIONS"],
+                "DISK_METRICS": ["DISK_PARTITION_IOPS_READ"],
+                "DATABASE_METRICS": ["DATABASE_AVERAGE_OBJECT_SIZE"],
+            },
+        },
+        "Collection": {
+            "END_TIME_EPOCH_OFFSET_SECONDS": 60,
+            "TIMEOUT": 300,
+            "BACKFILL_DAYS": 7,
+            "ENVIRONMENT": "aws",
+        },
+        "Logging": {},
+        "SumoLogic": {},
+    }
+
+
+@pytest.fixture
+def measurements_api(measurements_config):
+    return MeasurementsAPI(MagicMock(), measurements_config, {}, "PROCESS_METRICS", process_id="host-shard-00-00:27017")
+
+
+def test_get_metric_granularity(measurements_api):
+    assert measurements_api.get_metric_granularity("DISK_METRICS") == "PT1M"
+    measurements_api.api_config["METRIC_GRANULARITY"] = {"DISK_METRICS": "PT5M"}
+    assert measurements_api.get_metric_granularity("DISK_METRICS") == "PT5M"
+    assert measurements_api.get_metric_granularity("PROCESS_METRICS") == "PT1M"
+
+
+def test_iter_datapoints_with_rollup(measurements_api):
+    measurements_api.api_config["METRIC_ROLLUPS"] = {
+        "DISK_METRICS": {"BUCKET_MINUTES": 5, "AGGREGATIONS": ["min", "max", "avg", "last"]}
+    }
+    rollup = measurements_api.get_metric_rollup("DISK_METRICS")
+    assert measurements_api.get_metric_rollup("PROCESS_METRICS") is None
+    measurement = {
+        "name": "DISK_PARTITION_IOPS_READ",
+        "dataPoints": [
+            {"timestamp": f"2024-01-01T00:0{minute}:00Z", "value": value}
+            for minute, value in enumerate([1, 5, None, 3, 6, 10, 20])
+        ],
+    }
+
+    rows = list(measurements_api._iter_datapoints(measurement, rollup))
+
+    # only the first bucket (00:00 - 00:05) is complete, the trailing bucket is left for the next window
+    assert rows == [
+        (" rollup=min", 1, 1704067200, 1704067440),
+        (" rollup=max", 6, 1704067200, 1704067440),
+        (" rollup=avg", 3.75, 1704067200, 1704067440),
+        (" rollup=last", 6, 1704067200, 1704067440),
+    ]
+
+
+@patch("sumomongodbatlascollector.api.get_current_timestamp", return_value=1704067200 + 86400)
+def test_incomplete_rollup_buckets_hold_the_window_back(mock_get_current_timestamp, measurements_api):
+    measurements_api.api_config["METRIC_ROLLUPS"] = {"PROCESS_METRICS": {"BUCKET_MINUTES": 5}}
+    measurements_api.last_time_epoch = 1704067200 - 60
+    measurements_api.DEFAULT_START_TIME_EPOCH = 0
+    data = {
+        "granularity": "PT1M", "hostId": "host", "processId": "host:27017", "groupId": "project1",
+        "measurements": [{"name": "CONNECTIONS", "units": "SCALAR", "dataPoints": [
+            {"timestamp": f"2024-01-01T00:0{minute}:00Z", "value": minute} for minute in range(3)
+        ]}],
+    }
+
+    # the window ends within the bucket so nothing is sent and the window is not moved past the bucket
+    measurements_api.window_end_epoch = 1704067200 + 180
+    metrics, _ = measurements_api.transform_data(data)
+    assert metrics == []
+    assert measurements_api.pending_rollup_start == 1704067200
+    kwargs = {"params": {"end": "2024-01-01T00:03:00.000Z", "granularity": "PT1M"}}
+    assert measurements_api.check_move_fetch_window(kwargs) == (True, {"last_time_epoch": 1704067200 - 0.001, "granularity": "PT1M"})
+    measurements_api.last_time_epoch = 1704067200 - 0.001
+    assert measurements_api.check_move_fetch_window(kwargs) == (False, {})
+
+    # once the window covers the whole bucket it is emitted even with datapoints missing
+    measurements_api.window_end_epoch = 1704067200 + 600
+    metrics, state = measurements_api.transform_data(data)
+    assert len(metrics) == 4
+    assert measurements_api.pending_rollup_start is None
+    assert state["last_time_epoch"] == 1704067200 + 120
+
+
+def test_iter_datapoints_without_rollup(measurements_api):
+    measurement = {
+        "name": "CONNECTIONS",
+        "dataPoints": [
+            {"timestamp": "2024-01-01T00:00:00Z", "value": 1},
+            {"timestamp": "2024-01-01T00:01:00Z", "value": None},
+        ],
+    }
+    assert list(measurements_api._iter_datapoints(measurement)) == [("", 1, 1704067200, 1704067200)]
+
+
+@patch("sumomongodbatlascollector.api.get_current_timestamp")
+def test_get_measurement_window_backfill_tiers(mock_get_current_timestamp, measurements_api):
+    now = 1704067200
+    mock_get_current_timestamp.return_value = now
+    measurements_api.collection_config["MEASUREMENT_BACKFILL_TIERS"] = [
+        {"GRANULARITY": "PT5M", "LAG_SECONDS": 7200, "MAX_REQUEST_WINDOW_LENGTH": 86400},
+        {"GRANULARITY": "PT1H", "LAG_SECONDS": 172800, "MAX_REQUEST_WINDOW_LENGTH": 604800},
+    ]
+
+    # 30 days behind picks the coarsest tier with its larger window
+    start, end, granularity = measurements_api.get_measurement_window(now - 30 * 86400, "PROCESS_METRICS")
+    assert granularity == "PT1H"
+    assert end - start == 604800
+
+    # the coarse tier never crosses into the region covered by finer tiers
+    start, end, granularity = measurements_api.get_measurement_window(now - 3 * 86400, "PROCESS_METRICS")
+    assert granularity == "PT1H"
+    assert end == now - 60 - 172800
+
+    start, end, granularity = measurements_api.get_measurement_window(now - 86400, "PROCESS_METRICS")
+    assert granularity == "PT5M"
+    assert end == now - 60 - 7200
+
+    start, end, granularity = measurements_api.get_measurement_window(now - 600, "PROCESS_METRICS")
+    assert granularity == "PT1M"
+
+
+def test_backfill_window_ends_after_the_last_coarse_bucket(measurements_api):
+    measurements_api.DEFAULT_START_TIME_EPOCH = 0
+    data = {
+        "granularity": "PT1H", "hostId": "host", "processId": "host:27017", "groupId": "project1",
+        "measurements": [{"name": "CONNECTIONS", "units": "SCALAR", "dataPoints": [
+            {"timestamp": "2024-01-01T00:00:00Z", "value": 1}, {"timestamp": "2024-01-01T01:00:00Z", "value": 2},
+        ]}],
+    }
+
+    metrics, state = measurements_api.transform_data(data)
+
+    assert len(metrics) == 2
+    # the PT1M tier starts at 02:00 instead of fetching the 01:00 hour again
+    assert state["last_time_epoch"] == 1704067200 + 2 * 3600 - measurements_api.MOVING_WINDOW_DELTA
+    assert measurements_api.get_window(state["last_time_epoch"])[0] == 1704067200 + 2 * 3600
+
+
+def test_build_measurement_state(measurements_api):
+    measurements_api.granularity_coverage = {"PT1H": 100}
+    assert measurements_api._build_measurement_state(200, "PT5M") == {
+        "last_time_epoch": 200,
+        "granularity_coverage": {"PT1H": 100, "PT5M": 200},
+    }
+
+
+def test_iter_datapoints_drops_already_sent(measurements_api):
+    measurement = {
+        "name": "CONNECTIONS",
+        "dataPoints": [
+            {"timestamp": "2024-01-01T00:00:00Z", "value": 1},
+            {"timestamp": "2024-01-01T00:01:00Z", "value": 2},
+            {"timestamp": "2024-01-01T00:02:00Z", "value": 3},
+        ],
+    }
+    series_watermarks = {"CONNECTIONS": 1704067260}
+
+    rows = list(measurements_api._iter_datapoints(measurement, series_watermarks=series_watermarks))
+
+    assert rows == [("", 3, 1704067320, 1704067320)]
+    assert series_watermarks == {"CONNECTIONS": 1704067320}
+
+
+def test_build_measurement_state_prunes_watermarks(measurements_api):
+    measurements_api.collection_config["MEASUREMENT_WINDOW_OVERLAP_SECONDS"] = 300
+
+    state = measurements_api._build_measurement_state(1000, series_watermarks={"CONNECTIONS": 1000, "OLD_METRIC": 100})
+
+    assert state == {"last_time_epoch": 1000, "series_watermarks": {"CONNECTIONS": 1000}}
+
+
+def test_measurements_api_keys_and_urls(measurements_config):
+    disk_api = DiskMetricsAPI(MagicMock(), "host:27017", "data", measurements_config, {})
+    database_api = DatabaseMetricsAPI(MagicMock(), "host:27017", "admin", measurements_config, {})
+
+    assert disk_api.get_key() == "project1-host:27017-data-diskmetrics"
+    assert database_api.get_key() == "project1-host:27017-admin-dbmetrics"
+    assert disk_api.pathname == "disk_metrics.log"
+
+    disk_api.get_measurement_window = MagicMock(return_value=(1704067200, 1704067800, "PT1M"))
+    disk_api.kvstore.get.return_value = {"last_time_epoch": 1704067200}
+    url, kwargs = disk_api.build_fetch_params()
+    assert url == "https://cloud.mongodb.com/api/atlas/v1.0/groups/project1/processes/host:27017/disks/data/measurements"
+    assert kwargs["params"]["m"] == ["DISK_PARTITION_IOPS_READ"]
+
+
+def test_measurements_api_transform_data(measurements_config):
+    database_api = DatabaseMetricsAPI(
+        MagicMock(), "cluster0-shard-00-00:27017", "admin", measurements_config, {"cluster0": "prod"}
+    )
+    data = {
+        "groupId": "project1",
+        "hostId": "cluster0-shard-00-00:27017",
+        "processId": "cluster0-shard-00-00:27017",
+        "databaseName": "admin",
+        "granularity": "PT1M",
+        "measurements": [
+            {
+                "name": "DATABASE_AVERAGE_OBJECT_SIZE",
+                "units": "BYTES",
+                "dataPoints": [{"timestamp": "2024-01-01T00:00:00Z", "value": 10}],
+            }
+        ],
+    }
+
+    metrics, state = database_api.transform_data(data)
+
+    assert metrics == [
+        "projectId=project1 databaseName=admin hostId=cluster0-shard-00-00:27017 processId=prod-shard-00-00:27017 "
+        "metric=DATABASE_AVERAGE_OBJECT_SIZE  units=BYTES cluster_name=prod 10 1704067200"
+    ]
+    assert state["granularity"] == "PT1M"
+    assert state["series_watermarks"] == {"DATABASE_AVERAGE_OBJECT_SIZE": 1704067200}
+
+
+def test_get_metric_groups(measurements_api):
+    metric_names = ["A", "B", "C", "D", "E"]
+    assert measurements_api.get_metric_groups(metric_names) == [metric_names]
+    measurements_api.collection_config["METRICS_PER_REQUEST"] = 2
+    assert measurements_api.get_metric_groups(metric_names) == [["A", "B"], ["C", "D"], ["E"]]
+
+
+@patch("sumomongodbatlascollector.rate_limiter.ClientMixin.make_request")
+def test_make_fetch_request_merges_metric_groups(mock_make_request, measurements_api):
+    measurements_api.collection_config.update({"METRICS_PER_REQUEST": 1, "MAX_RETRY": 1, "BACKOFF_FACTOR": 1})
+
+    def make_request(url, params=None, **kwargs):
+        if params["m"] == ["C"]:
+            return False, "timeout"
+        return True, {"granularity": "PT1M", "measurements": [{"name": params["m"][0]}]}
+
+    mock_make_request.side_effect = make_request
+    measurements_api.last_time_epoch = 100
+
+    fetch_success, content = measurements_api.make_fetch_request("url", {"params": {"m": ["A", "B", "C"]}})
+
+    assert fetch_success
+    assert [measurement["name"] for measurement in content["measurements"]] == ["A", "B"]
+    assert measurements_api.failed_metric_groups == [["C"]]
+    assert measurements_api.check_move_fetch_window({"params": {"end": "2020-01-01T00:00:00.000Z", "granularity": "PT1M"}}) == (False, {})
+
+    measurements_api.collection_config["MEASUREMENT_DEDUP"] = False
+    fetch_success, content = measurements_api.make_fetch_request("url", {"params": {"m": ["A", "B", "C"]}})
+    assert not fetch_success
+
+
+@pytest.fixture
+def project_events_api(measurements_config):
+    measurements_config["Collection"].update({"MAX_RETRY": 1, "BACKOFF_FACTOR": 1, "OUTPUT_HANDLER": "HTTP", "PAGE_PREFETCH_DEPTH": 2})
+    return ProjectEventsAPI(MagicMock(), measurements_config)
+
+
+def test_iter_pages_prefetches_in_order(project_events_api):
+    def fetch_page(sess, url, kwargs):
+        page_num = kwargs["params"]["pageNum"]
+        return True, {"results": [{"page": page_num}] if page_num < 4 else []}
+
+    kwargs = {"params": {"pageNum": 1}}
+    with patch.object(project_events_api, "fetch_page", side_effect=fetch_page):
+        pages = project_events_api.iter_pages(None, "url", kwargs)
+        fetched = [next(pages) for _ in range(4)]
+        pages.close()
+
+    assert [data["results"] for _, data in fetched] == [[{"page": 1}], [{"page": 2}], [{"page": 3}], []]
+    # checkpointing relies on the caller owned pageNum
+    assert kwargs["params"]["pageNum"] == 1
+
+
+def test_iter_pages_close_does_not_wait_for_a_blocked_producer(project_events_api):
+    release = threading.Event()
+
+    def fetch_page(sess, url, kwargs):
+        if kwargs["params"]["pageNum"] > 1:
+            # the producer is inside a slow http call when the consumer stops
+            release.wait(5)
+        return True, {"results": [{"page": kwargs["params"]["pageNum"]}]}
+
+    with patch.object(project_events_api, "fetch_page", side_effect=fetch_page):
+        pages = project_events_api.iter_pages(None, "url", {"params": {"pageNum": 1}})
+        assert next(pages)[1]["results"] == [{"page": 1}]
+        start_time = time.time()
+        pages.close()
+        assert time.time() - start_time < 1
+        release.set()
+
+
+def test_iter_pages_close_does_not_wait_for_fanned_out_requests(project_events_api):
+    project_events_api.collection_config.update({"PAGE_FANOUT_WORKERS": 2})
+    release = threading.Event()
+
+    def fetch_page(sess, url, kwargs):
+        if kwargs["params"]["pageNum"] > 2:
+            # the workers are inside slow http calls when the consumer stops
+            release.wait(5)
+        return True, {"results": [{"page": kwargs["params"]["pageNum"]}], "totalCount": 10}
+
+    with patch.object(project_events_api, "fetch_page", side_effect=fetch_page):
+        pages = project_events_api.iter_pages(None, "url", {"params": {"pageNum": 1, "itemsPerPage": 1}})
+        assert [next(pages)[1]["results"] for _ in range(2)] == [[{"page": 1}], [{"page": 2}]]
+        start_time = time.time()
+        pages.close()
+        assert time.time() - start_time < 1
+        release.set()
+
+
+class DigestPagesHandler(BaseHTTPRequestHandler):
+    """
+    Atlas like paginated endpoint behind digest auth (qop=auth, MD5), it records the nc of every authorized request.
+    """
+
+    REALM, NONCE, USERNAME, PASSWORD = "MMS Public API", "nonce1", "public", "private"
+    TOTAL_COUNT = 20
+
+    def log_message(self, *args):
+        pass
+
+    def _is_authorized(self):
+        header = self.headers.get("Authorization", "")
+        if not header.startswith("Digest "):
+            return False
+        fields = requests.utils.parse_dict_header(header[len("Digest "):])
+        ha1 = hashlib.md5(f"{self.USERNAME}:{self.REALM}:{self.PASSWORD}".encode()).hexdigest()
+        ha2 = hashlib.md5(f"GET:{fields['uri']}".encode()).hexdigest()
+        expected = hashlib.md5(f"{ha1}:{fields['nonce']}:{fields['nc']}:{fields['cnonce']}:auth:{ha2}".encode()).hexdigest()
+        if fields["nonce"] != self.NONCE or fields["response"] != expected:
+            return False
+        with self.server.lock:
+            self.server.nonce_counts.append(fields["nc"])
+        return True
+
+    def do_GET(self):
+        if not self._is_authorized():
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", f'Digest realm="{self.REALM}", nonce="{self.NONCE}", qop="auth", algorithm=MD5')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        page_num = int(parse_qs(urlparse(self.path).query)["pageNum"][0])
+        body = json.dumps({"results": [{"page": page_num}] if page_num <= self.TOTAL_COUNT else [], "totalCount": self.TOTAL_COUNT}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def digest_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DigestPagesHandler)
+    server.lock = threading.Lock()
+    server.nonce_counts = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fan_out_pages_share_the_pooled_session(project_events_api, digest_server):
+    project_events_api.collection_config.update({"PAGE_FANOUT_WORKERS": 4, "TIMEOUT": 5})
+    url = f"http://127.0.0.1:{digest_server.server_address[1]}/api/atlas/v1.0/groups/project1/events"
+    sess = project_events_api.get_atlas_session(url)
+    auth = project_events_api.session_pool.get_auth(url, DigestPagesHandler.USERNAME, DigestPagesHandler.PASSWORD)
+    kwargs = {"auth": auth, "params": {"pageNum": 1, "itemsPerPage": 1}}
+
+    fetched = []
+    pages = project_events_api.iter_pages(sess, url, kwargs)
+    for status, data in pages:
+        assert status, data
+        if not data["results"]:
+            break
+        fetched.extend(data["results"])
+        kwargs["params"]["pageNum"] += 1
+    pages.close()
+
+    assert fetched == [{"page": page_num} for page_num in range(1, DigestPagesHandler.TOTAL_COUNT + 1)]
+    # the concurrent requests reuse the shared nonce, each with its own nc
+    assert auth.challenges == 1
+    assert len(digest_server.nonce_counts) == len(set(digest_server.nonce_counts)) == DigestPagesHandler.TOTAL_COUNT + 1
+
+
+@patch("sumomongodbatlascollector.api.OutputHandlerFactory.get_handler")
+def test_paginated_fetch_with_prefetch_saves_failed_page(mock_get_handler, project_events_api):
+    output_handler = mock_get_handler.return_value
+    output_handler.send.side_effect = [True, False]
+    project_events_api.kvstore.has_key.return_value = True
+    project_events_api.kvstore.get.return_value = {"last_time_epoch": 1704067200, "page_num": 0}
+
+    def fetch_page(sess, url, kwargs):
+        return True, {"results": [{"created": "2024-01-01T00:00:00Z"}]}
+
+    with patch.object(project_events_api, "fetch_page", side_effect=fetch_page), \
+            patch.object(project_events_api, "is_time_remaining", return_value=True):
+        project_events_api.fetch()
+
+    saved_state = project_events_api.kvstore.set.call_args[0][1]
+    assert saved_state["page_num"] == 2
+    assert output_handler.send.call_count == 2
+
+
+def test_iter_pages_fans_out_using_total_count(project_events_api):
+    project_events_api.collection_config.update({"PAGE_FANOUT_WORKERS": 3})
+    requested_pages = []
+
+    def fetch_page(sess, url, kwargs):
+        page_num = kwargs["params"]["pageNum"]
+        requested_pages.append(page_num)
+        results = [{"page": page_num}] if page_num <= 5 else []
+        return True, {"results": results, "totalCount": 9}
+
+    kwargs = {"params": {"pageNum": 1, "itemsPerPage": 2}}
+    with patch.object(project_events_api, "fetch_page", side_effect=fetch_page):
+        pages = project_events_api.iter_pages(None, "url", kwargs)
+        fetched = []
+        for status, data in pages:
+            fetched.append(data["results"])
+            if not data["results"]:
+                break
+            kwargs["params"]["pageNum"] += 1
+        pages.close()
+
+    assert fetched == [[{"page": page_num}] for page_num in range(1, 6)] + [[]]
+    assert sorted(requested_pages) == [1, 2, 3, 4, 5, 6]
+
+
+@patch("sumomongodbatlascollector.api.OutputHandlerFactory.get_handler")
+@patch("sumomongodbatlascollector.rate_limiter.ClientMixin.make_request")
+def test_alerts_fetch_sends_only_new_or_changed_alerts(mock_make_request, mock_get_handler, measurements_config):
+    measurements_config["Collection"].update({"MAX_RETRY": 1, "BACKOFF_FACTOR": 1, "OUTPUT_HANDLER": "HTTP"})
+    alerts_api = AlertsAPI(MagicMock(), measurements_config)
+    alerts_api.kvstore.has_key.return_value = True
+    alerts_api.kvstore.get.return_value = {
+        "page_num": 1,
+        "last_page_offset": 2,
+        "seen_alerts": {"a1": "2024-01-01T00:00:00Z", "a0": "2023-12-01T00:00:00Z"},
+        "active_alert_ids": ["a1"],
+    }
+    output_handler = mock_get_handler.return_value
+    output_handler.send.return_value = True
+    alert1 = {"id": "a1", "status": "OPEN", "updated": "2024-01-01T00:00:00Z"}
+    alert2 = {"id": "a2", "status": "OPEN", "updated": "2024-01-02T00:00:00Z"}
+    closed_alert1 = dict(alert1, status="CLOSED", updated="2024-01-03T00:00:00Z")
+
+    def make_request(url, params=None, **kwargs):
+        if url.endswith("/alerts/a1"):
+            return True, closed_alert1
+        if params.get("status") == "TRACKING":
+            return True, {"results": []}
+        if params.get("status") == "OPEN":
+            return True, {"results": [alert2]}
+        return True, {"results": [alert1, alert2]}
+
+    mock_make_request.side_effect = make_request
+    with patch.object(alerts_api, "is_time_remaining", return_value=True):
+        alerts_api.fetch()
+
+    sent_alerts = [alert for call in output_handler.send.call_args_list for alert in call[0][0]]
+    assert sent_alerts == [alert2, closed_alert1]
+    saved_state = alerts_api.kvstore.set.call_args[0][1]
+    assert saved_state == {
+        "page_num": 1,
+        "last_page_offset": 2,
+        "seen_alerts": {"a1": "2024-01-03T00:00:00Z", "a2": "2024-01-02T00:00:00Z"},
+        "active_alert_ids": ["a2"],
+    }
+
+
+@patch("sumomongodbatlascollector.api.OutputHandlerFactory.get_handler")
+@patch("sumomongodbatlascollector.rate_limiter.ClientMixin.make_request")
+def test_alerts_fetch_keeps_walked_pages_and_unsynced_alerts(mock_make_request, mock_get_handler, measurements_config):
+    measurements_config["Collection"].update({"MAX_RETRY": 1, "BACKOFF_FACTOR": 1, "OUTPUT_HANDLER": "HTTP"})
+    measurements_config["MongoDBAtlas"]["PAGINATION_LIMIT"] = 2
+    alerts_api = AlertsAPI(MagicMock(), measurements_config)
+    alerts_api.kvstore.has_key.return_value = True
+    alerts_api.kvstore.get.return_value = {"page_num": 1, "last_page_offset": 0, "seen_alerts": {}, "active_alert_ids": ["a0"]}
+    output_handler = mock_get_handler.return_value
+    alert1 = {"id": "a1", "status": "CLOSED", "updated": "2024-01-01T00:00:00Z"}
+    alert2 = {"id": "a2", "status": "CLOSED", "updated": "2024-01-02T00:00:00Z"}
+    alert3 = {"id": "a3", "status": "OPEN", "updated": "2024-01-03T00:00:00Z"}
+    changed_alert3 = dict(alert3, updated="2024-01-04T00:00:00Z")
+    pages = {1: [alert1, alert2], 2: [alert3]}
+
+    def make_request(url, params=None, **kwargs):
+        if params.get("status") == "OPEN":
+            return True, {"results": [changed_alert3]}
+        if params.get("status") == "TRACKING":
+            return True, {"results": []}
+        return True, {"results": pages[params["pageNum"]]}
+
+    mock_make_request.side_effect = make_request
+    # the send of the changed active alert fails
+    output_handler.send.side_effect = lambda data, **kwargs: data != [changed_alert3]
+    with patch.object(alerts_api, "is_time_remaining", return_value=True):
+        alerts_api.fetch()
+
+    saved_state = alerts_api.kvstore.set.call_args[0][1]
+    assert saved_state == {
+        "page_num": 2,
+        "last_page_offset": 1,
+        "seen_alerts": {"a1": "2024-01-01T00:00:00Z", "a2": "2024-01-02T00:00:00Z", "a3": "2024-01-03T00:00:00Z"},
+        "active_alert_ids": ["a0", "a3"],
+    }
+
+
+def test_events_transform_data_skips_sent_event_ids(project_events_api):
+    project_events_api.collection_config["EVENT_DEDUP_CACHE_SIZE"] = 2
+    project_events_api.kvstore.has_key.return_value = True
+    project_events_api.kvstore.get.return_value = {"last_time_epoch": 1704067200, "page_num": 2, "sent_event_ids": ["e1"]}
+    project_events_api.get_state()
+    data = {"results": [
+        {"id": "e1", "created": "2024-01-01T00:00:00Z"},
+        {"id": "e2", "created": "2024-01-01T00:01:00Z"},
+        {"id": "e2", "created": "2024-01-01T00:01:00Z"},
+        {"id": "e3", "created": "2024-01-01T00:02:00Z"},
+    ]}
+
+    payload, state = project_events_api.transform_data(data)
+
+    assert [event["id"] for event in payload] == ["e2", "e3"]
+    assert state["last_time_epoch"] >= 1704067320
+    project_events_api.on_send_success(payload)
+    project_events_api.save_state({"last_time_epoch": state["last_time_epoch"], "page_num": 0})
+    assert project_events_api.kvstore.set.call_args[0][1]["sent_event_ids"] == ["e2", "e3"]
+
+
+def test_events_event_type_filters(project_events_api):
+    project_events_api.api_config["EVENT_TYPE_FILTERS"] = {
+        "EVENTS_PROJECT": {"INCLUDE": ["CLUSTER_CREATED", "BILLING_EVENT"], "EXCLUDE": ["BILLING_EVENT", "API_KEY_ACCESS_LIST_ENTRY_ADDED"]},
+    }
+    project_events_api.kvstore.has_key.return_value = True
+    project_events_api.kvstore.get.return_value = {"last_time_epoch": 1704067200, "page_num": 0}
+
+    url, kwargs = project_events_api.build_fetch_params()
+    assert kwargs["params"]["eventType"] == ["CLUSTER_CREATED"]
+
+    data = {"results": [
+        {"id": "e1", "created": "2024-01-01T00:00:00Z", "eventTypeName": "API_KEY_ACCESS_LIST_ENTRY_ADDED"},
+        {"id": "e2", "created": "2024-01-01T00:01:00Z", "eventTypeName": "CLUSTER_CREATED"},
+    ]}
+    payload, _ = project_events_api.transform_data(data)
+    assert [event["id"] for event in payload] == ["e2"]
+
+
+class FakeAsyncResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = str(content)
+
+    def json(self):
+        return self.content
+
+
+class FakeAsyncClient:
+    def __init__(self, *args, **kwargs):
+        self.requests = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def get(self, url, params=None, **kwargs):
+        self.requests.append(params["m"])
+        if params["m"] == ["B"] and self.requests.count(["B"]) == 1:
+            return FakeAsyncResponse(503, "unavailable")
+        return FakeAsyncResponse(200, {"measurements": [{"name": params["m"][0]}]})
+
+
+def test_async_fetch_engine_runs_split_requests(measurements_api):
+    measurements_api.collection_config.update({"METRICS_PER_REQUEST": 1, "MAX_RETRY": 1, "BACKOFF_FACTOR": 0})
+    url = "https://cloud.mongodb.com/api/atlas/v1.0/groups/project1/processes/host/measurements"
+    kwargs = {"auth": measurements_api.digestauth, "params": {"m": ["A", "B"]}}
+    fake_httpx = MagicMock(AsyncClient=FakeAsyncClient, HTTPError=Exception)
+
+    with patch.object(async_engine, "httpx", fake_httpx), \
+            patch.object(measurements_api, "build_fetch_params", return_value=(url, kwargs)), \
+            patch.object(measurements_api, "get_output_handler"), \
+            patch.object(measurements_api, "handle_fetch_response") as mock_handle_fetch_response:
+        scheduler = MagicMock()
+        engine = async_engine.AsyncFetchEngine(measurements_api.config, MagicMock(), scheduler)
+        failed_tasks = engine.run([measurements_api])
+
+    assert failed_tasks == []
+    _, _, fetch_success, content, _, _ = mock_handle_fetch_response.call_args[0]
+    assert fetch_success
+    assert [measurement["name"] for measurement in content["measurements"]] == ["A", "B"]
+    assert list(engine.endpoint_semaphores) == ["cloud.mongodb.com/process_metrics.log"]
+    assert scheduler.record_duration.call_args[0][0] == measurements_api.get_key()
+    fake_httpx.DigestAuth.assert_called_once_with(measurements_api.digestauth.username, measurements_api.digestauth.password)
+
+
+@patch("sumomongodbatlascollector.rate_limiter.time.sleep")
+@patch("sumomongodbatlascollector.rate_limiter.ClientMixin.make_request")
+def test_rate_limiter_retries_throttled_requests(mock_make_request, mock_sleep):
+    limiter = AtlasRateLimiter({"Collection": {"ATLAS_MIN_REQUESTS_PER_SECOND": 1, "ATLAS_RATE_LIMIT_BURST": 1}})
+    url = "https://cloud.mongodb.com/api/atlas/v1.0/groups/project1/events"
+    responses = [(False, "too many requests"), (True, {"results": []})]
+
+    def make_request(url, session=None, **kwargs):
+        if len(responses) == 2:
+            session.hooks["response"][0](MagicMock(status_code=429, url=url, headers={"Retry-After": "5"}))
+        return responses.pop(0)
+
+    mock_make_request.side_effect = make_request
+    assert limiter.make_request(url, MAX_RETRY=2) == (True, {"results": []})
+    assert mock_make_request.call_count == 2
+    assert mock_sleep.call_args[0][0] == pytest.approx(5, abs=0.5)
+
+    metrics = limiter.get_metrics()
+    assert metrics["requests"] == 2
+    assert metrics["throttled"] == 1
+    assert metrics["waits"] == 1
+    assert metrics["rates"]["groups/project1"] == pytest.approx(1, abs=0.01)
+    # other projects are not slowed down
+    assert limiter.reserve("https://cloud.mongodb.com/api/atlas/v1.0/groups/project2/events") == 0
+
+
+def test_rate_limiter_is_shared_per_config():
+    config = {"Collection": {"ATLAS_MAX_REQUESTS_PER_SECOND": 5}}
+
+    assert get_atlas_rate_limiter(config) is get_atlas_rate_limiter({"Collection": {"ATLAS_MAX_REQUESTS_PER_SECOND": 5, "NUM_WORKERS": 4}})
+    assert get_atlas_rate_limiter(config).max_rate == 5
+    assert get_atlas_rate_limiter({"Collection": {"ATLAS_MAX_REQUESTS_PER_SECOND": 1}}).max_rate == 1
+
+
+def test_session_pool_is_shared_per_config():
+    config = {"Collection": {"ATLAS_MAX_REQUESTS_PER_SECOND": 5, "ATLAS_CONNECTION_POOL_SIZE": 20}}
+    session_pool = get_atlas_session_pool(config)
+
+    assert get_atlas_session_pool(dict(config, Logging={})) is session_pool
+    assert session_pool.pool_size == 20
+    assert session_pool.rate_limiter.max_rate == 5
+    assert get_atlas_session_pool({"Collection": {"ATLAS_MAX_REQUESTS_PER_SECOND": 5, "ATLAS_CONNECTION_POOL_SIZE": 2}}).pool_size == 2
+    assert get_atlas_session_pool({"Collection": {"ATLAS_MAX_REQUESTS_PER_SECOND": 1, "ATLAS_CONNECTION_POOL_SIZE": 20}}).rate_limiter.max_rate == 1
+
+
+def test_shared_digest_auth_reuses_nonce_across_threads():
+    auth = SharedDigestAuth("public", "private")
+    auth.chal = {"realm": "MMS Public API", "nonce": "nonce1", "qop": "auth"}
+    auth.last_nonce = "nonce1"
+    headers = []
+
+    def prepare_request():
+        request = requests.Request("GET", "https://cloud.mongodb.com/api/atlas/v1.0/groups/project1/events").prepare()
+        headers.append(auth(request).headers["Authorization"])
+
+    for _ in range(2):
+        thread = threading.Thread(target=prepare_request)
+        thread.start()
+        thread.join()
+
+    # requests from new threads are authorized upfront with the next nc of the shared nonce
+    assert ['nc=00000001' in header for header in headers] == [True, False]
+    assert 'nc=00000002' in headers[1]
+    assert all('nonce="nonce1"' in header for header in headers)
+
+    prepare_request()
+    challenge = MagicMock(status_code=401, headers={"www-authenticate": 'Digest realm="MMS Public API", nonce="nonce2", qop="auth"'}, raw=None)
+    challenge.request = requests.Request("GET", "https://cloud.mongodb.com/api/atlas/v1.0/groups/project1/events").prepare()
+    auth.handle_401(challenge)
+    assert auth.challenges == 1
+    retried_request = challenge.connection.send.call_args[0][0]
+    assert 'nonce="nonce2"' in retried_request.headers["Authorization"]
+    assert 'nc=00000001' in retried_request.headers["Authorization"]
+
+
+@pytest.mark.parametrize("algorithm,hash_function", [("MD5", hashlib.md5), ("SHA-256", hashlib.sha256), ("MD5-sess", hashlib.md5)])
+def test_shared_digest_auth_builds_rfc_2617_response(algorithm, hash_function):
+    auth = SharedDigestAuth("public", "private")
+    auth.chal = {"realm": "MMS Public API", "nonce": "nonce1", "qop": "auth,auth-int", "algorithm": algorithm, "opaque": "opaque1"}
+    with auth.lock:
+        header = auth.build_digest_header("GET", "https://cloud.mongodb.com/api/atlas/v1.0/groups/project1/events?pageNum=2")
+
+    assert header.startswith("Digest ")
+    fields = parse_dict_header(header[len("Digest "):])
+
+    def digest(value):
+        return hash_function(value.encode("utf-8")).hexdigest()
+
+    ha1 = digest("public:MMS Public API:private")
+    if algorithm == "MD5-sess":
+        ha1 = digest(f"{ha1}:nonce1:{fields['cnonce']}")
+    ha2 = digest(f"GET:{fields['uri']}")
+    assert fields["uri"] == "/api/atlas/v1.0/groups/project1/events?pageNum=2"
+    assert fields["nc"] == "00000001"
+    assert fields["opaque"] == "opaque1"
+    assert fields["response"] == digest(f"{ha1}:nonce1:00000001:{fields['cnonce']}:auth:{ha2}")
+
+
+def test_tasks_borrow_the_output_handler_from_the_pool(measurements_api):
+    measurements_api.output_handler_pool = MagicMock()
+
+    assert measurements_api.get_output_handler() is measurements_api.output_handler_pool.get_handler.return_value
+    measurements_api.output_handler_pool.get_handler.assert_called_once_with(path=measurements_api.pathname)
+
+
+def test_save_state_after_send_defers_the_state_to_the_background_sender(measurements_api):
+    measurements_api.kvstore = MagicMock()
+    checkpoints = []
+    output_handler = MagicMock(defers_checkpoints=True)
+    output_handler.defer_checkpoint.side_effect = checkpoints.append
+
+    measurements_api.save_state_after_send(output_handler, 1)
+    measurements_api.kvstore.set.assert_not_called()
+    checkpoints[0]()
+    assert measurements_api.kvstore.set.call_args[0][1]["last_time_epoch"] == 1
+
+    measurements_api.save_state_after_send(MagicMock(defers_checkpoints=False), 2)
+    assert measurements_api.kvstore.set.call_args[0][1]["last_time_epoch"] == 2
@@ -0,0 +1,70 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+from sumomongodbatlascollector.output_pool import OutputHandlerPool
+
+
+@pytest.fixture
+def config():
+    return {
+        "Collection": {"OUTPUT_HANDLER": "HTTP", "MAX_RETRY": 1, "BACKOFF_FACTOR": 1, "TIMEOUT": 10},
+        "SumoLogic": {"HTTP_LOGS_ENDPOINT": "https://sumo/logs", "HTTP_METRICS_ENDPOINT": "https://sumo/metrics"},
+        "DeployMetaData": {"PACKAGENAME": "sumologic-mongodb-atlas"},
+        "Logging": {},
+    }
+
+
+@patch("sumomongodbatlascollector.output_pool.PooledHTTPHandler")
+def test_output_handler_pool_shares_handler_per_endpoint(mock_get_handler, config):
+    mock_get_handler.side_effect = lambda *args, **kwargs: MagicMock()
+    pool = OutputHandlerPool(config)
+
+    for _ in range(2):
+        output_handler = pool.get_handler()
+        output_handler.send(["log"], endpoint_key="HTTP_LOGS_ENDPOINT")
+        output_handler.send(["metric"], endpoint_key="HTTP_METRICS_ENDPOINT", jsondump=False)
+        output_handler.close()
+
+    assert mock_get_handler.call_count == 2
+    logs_handler, metrics_handler = pool.handlers["HTTP_LOGS_ENDPOINT"], pool.handlers["HTTP_METRICS_ENDPOINT"]
+    assert logs_handler.send.call_count == 2
+    metrics_handler.send.assert_called_with(["metric"], endpoint_key="HTTP_METRICS_ENDPOINT", jsondump=False)
+    logs_handler.close.assert_not_called()
+
+    pool.close()
+    logs_handler.close.assert_called_once()
+    metrics_handler.close.assert_called_once()
+    assert pool.handlers == {}
+
+
+@patch("sumomongodbatlascollector.output_pool.ClientMixin.make_request_with_status")
+def test_output_handler_pool_queues_only_the_unsent_chunks(mock_make_request, config, tmp_path):
+    config["Collection"].update({"COMPRESSED": False, "COMPRESSION_CHUNK_BYTESIZE": 20, "RETRY_QUEUE_ENABLED": True, "RETRY_QUEUE_DIR": str(tmp_path)})
+    lines = [f"metric{idx} 1 100" for idx in range(4)]
+    mock_make_request.side_effect = lambda url, data=None, **kwargs: (data != b"metric2 1 100", {}, 200)
+    pool = OutputHandlerPool(config)
+
+    assert pool.send(lines, jsondump=False, endpoint_key="HTTP_METRICS_ENDPOINT")
+
+    queued = []
+    pool.retry_queue.replay(lambda data, **kwargs: queued.append(data) or True)
+    assert queued == [["metric2 1 100"], ["metric3 1 100"]]
+
+    # the lambda filesystem is not durable, the queue is turned off without a directory
+    config["Collection"].update({"ENVIRONMENT": "aws", "RETRY_QUEUE_DIR": None})
+    assert OutputHandlerPool(config).retry_queue is None
+
+
+def test_output_handler_pool_balances_only_endpoints_with_several_urls(config):
+    config["SumoLogic"] = {"HTTP_LOGS_ENDPOINT": ["https://sumo/logs1", "https://sumo/logs2"], "HTTP_METRICS_ENDPOINT": ["https://sumo/metrics"]}
+    pool = OutputHandlerPool(config)
+
+    assert pool.get_endpoint_handler("HTTP_LOGS_ENDPOINT").balancer is pool.balancer
+    assert pool.get_endpoint_handler("HTTP_METRICS_ENDPOINT").balancer is None
+    # handlers without a balancer send to a single url
+    assert pool.handler_config["SumoLogic"] == {"HTTP_LOGS_ENDPOINT": "https://sumo/logs1", "HTTP_METRICS_ENDPOINT": "https://sumo/metrics"}
+    assert config["SumoLogic"]["HTTP_LOGS_ENDPOINT"] == ["https://sumo/logs1", "https://sumo/logs2"]
+    pool.close()
+
+    config["SumoLogic"]["HTTP_LOGS_ENDPOINT"] = "https://sumo/logs1"
+    assert OutputHandlerPool(config).balancer is None
@@ -0,0 +1,39 @@
+import gzip
+import json
+
+import pytest
+
+from sumomongodbatlascollector.outputhandlers import OutputHandlerFactory
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {"Collection": {"FILE_SINK_DIR": str(tmp_path), "FILE_SINK_MAX_FILE_BYTES": 1024}, "Logging": {}}
+
+
+def test_file_sink_handler_rotates_and_compresses_files(config, tmp_path):
+    config["Collection"].update({"FILE_SINK_MAX_FILE_BYTES": 100, "FILE_SINK_BUFFER_BYTES": 50, "FILE_SINK_COMPRESSED": True})
+    handler = OutputHandlerFactory.get_handler("FILE_SINK", path="mongodbatlas.db", config=config)
+    for idx in range(4):
+        assert handler.send([{"log": "a" * 20, "idx": idx}], endpoint_key="HTTP_LOGS_ENDPOINT")
+    assert handler.send([f"metric{idx} 1 100" for idx in range(3)], endpoint_key="HTTP_METRICS_ENDPOINT", jsondump=False)
+    handler.close()
+
+    logs_files = sorted(tmp_path.glob("http_logs_endpoint-*.log.gz"))
+    metrics_files = sorted(tmp_path.glob("http_metrics_endpoint-*.log.gz"))
+    assert len(logs_files) == 2 and len(metrics_files) == 1
+    lines = [line for path in logs_files for line in gzip.decompress(path.read_bytes()).decode("utf-8").splitlines()]
+    assert [json.loads(line)["idx"] for line in lines] == [0, 1, 2, 3]
+    assert gzip.decompress(metrics_files[0].read_bytes()).decode("utf-8").splitlines() == ["metric0 1 100", "metric1 1 100", "metric2 1 100"]
+
+
+def test_file_sink_handler_tracks_file_metrics(config):
+    handler = OutputHandlerFactory.get_handler("FILE_SINK", config=config)
+    handler.send([{"log": 1}, {"log": 2}], endpoint_key="HTTP_LOGS_ENDPOINT")
+
+    metrics = handler.get_metrics()
+    assert len(metrics) == 1
+    assert metrics[0]["records"] == 2
+    assert metrics[0]["bytes"] == len('{"log": 1}\n{"log": 2}\n')
+    handler.close()
+    assert open(metrics[0]["path"]).read() == '{"log": 1}\n{"log": 2}\n'
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from sumomongodbatlascollector.retry_queue import DiskRetryQueue
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {"Collection": {"RETRY_QUEUE_DIR": str(tmp_path), "RETRY_QUEUE_SEGMENT_BYTES": 200, "RETRY_QUEUE_MAX_AGE_SECONDS": 60}, "Logging": {}}
+
+
+def test_disk_retry_queue_replays_and_keeps_unsent_records(config):
+    retry_queue = DiskRetryQueue(config)
+    for idx in range(4):
+        assert retry_queue.append([f"metric{idx} 1 100"], {"endpoint_key": "HTTP_METRICS_ENDPOINT", "jsondump": False})
+    assert len(retry_queue.get_segments()) > 1
+
+    # a torn record and an expired one are skipped
+    with open(retry_queue.get_segments()[0], "a") as fp:
+        fp.write('{"created": 1, "crc32": 1, "body": "[]"}\n')
+    retry_queue.append(["expired 1 100"], {"endpoint_key": "HTTP_METRICS_ENDPOINT"})
+    with open(retry_queue.get_segments()[-1], "r+") as fp:
+        record = json.loads(fp.readline())
+        record["created"] -= 120
+        fp.seek(0)
+        fp.write(json.dumps(record) + "\n")
+        fp.truncate()
+
+    sent = []
+
+    def send(data, endpoint_key=None, jsondump=True):
+        if data == ["metric2 1 100"] and not sent.count("failed"):
+            sent.append("failed")
+            return False
+        sent.append(data[0])
+        return True
+
+    assert not retry_queue.replay(send)
+    assert sent == ["metric0 1 100", "metric1 1 100", "failed"]
+    assert retry_queue.replay(send)
+    assert sent[3:] == ["metric2 1 100", "metric3 1 100"]
+    assert retry_queue.get_segments() == []
+    assert retry_queue.metrics["corrupted"] == 1
+    assert retry_queue.metrics["expired"] == 1
+
+    retry_queue.max_bytes = 300
+    retry_queue.append(["a" * 40], {"endpoint_key": "HTTP_LOGS_ENDPOINT"})
+    retry_queue.append(["b" * 40], {"endpoint_key": "HTTP_LOGS_ENDPOINT"})
+    assert retry_queue.metrics["evicted_segments"] == 1
+    assert retry_queue.get_size() <= 300